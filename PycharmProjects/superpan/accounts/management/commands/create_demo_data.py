@@ -213,8 +213,8 @@ class Command(BaseCommand):
             )
             self.stdout.write(f'✅ Создан расход: {title}')
         
-        # Обновляем потраченную сумму проекта
-        self.project.update_spent_amount()
+        # Потраченную сумму проекта ведет журнал расходов - перечитываем ее
+        self.project.refresh_from_db(fields=['spent_amount'])
         
         self.stdout.write('✅ Канбан-доска создана')
 
@@ -19,6 +19,7 @@ urlpatterns = [
     path('expenses/', views.expenses_overview, name='expenses_overview'),
     path('reports/', views.reports, name='reports'),
     path('reports/financial/', views.financial_reports, name='financial_reports'),
+    path('reports/variance/', views.variance_report, name='variance_report'),
     path('export/excel/', views.export_excel, name='export_excel'),
     path('export/pdf/', views.export_pdf, name='export_pdf'),
     path('export/csv/', views.export_csv, name='export_csv'),
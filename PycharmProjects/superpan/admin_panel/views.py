@@ -5,11 +5,14 @@ from django.http import JsonResponse
 from django.utils import timezone
 from django.views.decorators.http import require_http_methods
 from django.db.models import Count, Sum, Q
-from datetime import timedelta
+from datetime import date, datetime, timedelta
 from decimal import Decimal
+import uuid
 
 from accounts.models import User, ProjectAccessKey, LoginAttempt, UserSession, TelegramUser
 from projects.models import Project, ProjectActivity
+from projects.estimate_catalog import get_category_tree
+from projects.estimate_models import EstimateCategory, EstimateVarianceRollup
 from kanban.models import ExpenseItem, ExpenseCategory
 from accounts.forms import UserRegistrationForm
 from projects.forms import ProjectForm
@@ -452,6 +455,89 @@ def financial_reports(request):
     return render(request, 'admin_panel/financial_reports.html', context)
 
 
+@login_required
+@user_passes_test(is_superuser)
+def variance_report(request):
+    """План/факт по портфелю проектов: смета против одобренных расходов
+    
+    Данные берутся только из свода EstimateVarianceRollup, который
+    поддерживается при изменении позиций смет и расходов.
+    """
+    
+    def parse_month(value, default):
+        try:
+            return datetime.strptime(value, '%Y-%m').date()
+        except (TypeError, ValueError):
+            return default
+    
+    today = timezone.localdate()
+    default_from = date(today.year - 1, today.month, 1)
+    month_from = parse_month(request.GET.get('from'), default_from)
+    month_to = parse_month(request.GET.get('to'), date(today.year, today.month, 1))
+    
+    rollups = EstimateVarianceRollup.objects.filter(month__gte=month_from, month__lte=month_to)
+    project_id = request.GET.get('project')
+    if project_id:
+        try:
+            project_id = str(uuid.UUID(project_id))
+            rollups = rollups.filter(project_id=project_id)
+        except ValueError:
+            project_id = None
+    totals = {'planned': Sum('planned_amount'), 'actual': Sum('actual_amount')}
+    
+    def with_variance(row):
+        row['planned'] = row['planned'] or Decimal('0.00')
+        row['actual'] = row['actual'] or Decimal('0.00')
+        row['variance'] = row['actual'] - row['planned']
+        row['utilization'] = float(row['actual'] / row['planned'] * 100) if row['planned'] else 0
+        return row
+    
+    summary = with_variance(rollups.aggregate(**totals))
+    
+    by_project = [
+        with_variance({**row, 'name': row['project__name']}) for row in
+        rollups.values('project_id', 'project__name').annotate(**totals).order_by('project__name')
+    ]
+    
+    # Категории сворачиваются до корневых разделов по пути в дереве
+    tree = get_category_tree()
+    by_root = {}
+    for row in rollups.values('category__path').annotate(**totals).order_by():
+        path = row['category__path']
+        root = tree.by_id.get(int(path[:EstimateCategory.PATH_SEGMENT_LENGTH])) if path else None
+        key = root.pk if root else None
+        entry = by_root.setdefault(key, {
+            'name': root.name if root else 'Без раздела сметы',
+            'planned': Decimal('0.00'),
+            'actual': Decimal('0.00'),
+        })
+        entry['planned'] += row['planned'] or Decimal('0.00')
+        entry['actual'] += row['actual'] or Decimal('0.00')
+    by_category = sorted(
+        (with_variance(entry) for entry in by_root.values()),
+        key=lambda entry: entry['planned'],
+        reverse=True
+    )
+    
+    by_month = [
+        with_variance({**row, 'name': row['month'].strftime('%m.%Y')}) for row in
+        rollups.values('month').annotate(**totals).order_by('month')
+    ]
+    
+    context = {
+        'summary': summary,
+        'by_project': by_project,
+        'by_category': by_category,
+        'by_month': by_month,
+        'month_from': month_from,
+        'month_to': month_to,
+        'project_id': project_id or '',
+        'projects': Project.objects.order_by('name').values('id', 'name'),
+    }
+    
+    return render(request, 'admin_panel/variance_report.html', context)
+
+
 @login_required
 @user_passes_test(is_superuser)
 def export_excel(request):
@@ -3,6 +3,7 @@ from django.utils.translation import gettext_lazy as _
 from django.core.exceptions import ValidationError
 
 from .models import ExpenseItem, ExpenseDocument, ExpenseComment, ExpenseCommentAttachment, ExpenseCategory
+from projects.estimate_models import EstimateCategory
 from accounts.base_forms import BaseExpenseForm
 from constants import (
     MAX_FILE_SIZE, MAX_COMMENT_LENGTH, ALLOWED_FILE_EXTENSIONS, 
@@ -16,7 +17,7 @@ class ExpenseItemForm(forms.ModelForm):
     class Meta:
         model = ExpenseItem
         fields = [
-            'title', 'description', 'task_type', 'category',
+            'title', 'description', 'task_type', 'category', 'estimate_category',
             'estimated_hours', 'priority', 'assigned_to', 'due_date',
             'progress_percent', 'is_urgent', 'tags'
         ]
@@ -36,6 +37,9 @@ class ExpenseItemForm(forms.ModelForm):
             'category': forms.Select(attrs={
                 'class': 'form-select'
             }),
+            'estimate_category': forms.Select(attrs={
+                'class': 'form-select'
+            }),
             'estimated_hours': forms.NumberInput(attrs={
                 'class': 'form-control',
                 'placeholder': '0.0',
@@ -78,6 +82,11 @@ class ExpenseItemForm(forms.ModelForm):
         self.fields['category'].queryset = ExpenseCategory.objects.filter(is_active=True)
         self.fields['category'].empty_label = "Выберите категорию"
         
+        # Раздел сметы - для сравнения плана и факта по категориям работ
+        self.fields['estimate_category'].queryset = EstimateCategory.objects.filter(is_active=True).order_by('path')
+        self.fields['estimate_category'].label_from_instance = lambda category: '— ' * category.depth + category.name
+        self.fields['estimate_category'].empty_label = "Без раздела сметы"
+        
         # Настраиваем выбор исполнителя
         if project:
             # Показываем только участников проекта
@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kanban', '0008_statuschangerequest'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='expenseitem',
+            index=models.Index(fields=['-created_at', '-id'], name='expense_item_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expenseitem',
+            index=models.Index(fields=['project', '-created_at', '-id'], name='expense_item_proj_created_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+from django.db import migrations, models
+from django.db.models import DateField, Sum
+from django.db.models.functions import TruncMonth
+import django.db.models.deletion
+
+
+def fill_variance_rollups(apps, schema_editor):
+    """Заполнить свод план/факт по существующим позициям смет и одобренным расходам"""
+    ProjectEstimateItem = apps.get_model('projects', 'ProjectEstimateItem')
+    ExpenseItem = apps.get_model('kanban', 'ExpenseItem')
+    EstimateVarianceRollup = apps.get_model('projects', 'EstimateVarianceRollup')
+
+    rollups = {}
+
+    def add(rows, field):
+        for project_id, category_id, month, total in rows:
+            key = (project_id, category_id, month)
+            if key not in rollups:
+                rollups[key] = EstimateVarianceRollup(project_id=project_id, category_id=category_id, month=month)
+            setattr(rollups[key], field, total)
+
+    add(
+        ProjectEstimateItem.objects
+        .annotate(month=TruncMonth('created_at', output_field=DateField()))
+        .values_list('estimate__project_id', 'rate__category_id', 'month')
+        .annotate(total=Sum('total_price'))
+        .order_by(),
+        'planned_amount'
+    )
+    add(
+        ExpenseItem.objects.filter(status='approved')
+        .annotate(month=TruncMonth('created_at', output_field=DateField()))
+        .values_list('project_id', 'estimate_category_id', 'month')
+        .annotate(total=Sum('amount'))
+        .order_by(),
+        'actual_amount'
+    )
+    EstimateVarianceRollup.objects.bulk_create(rollups.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0009_estimatevariancerollup'),
+        ('kanban', '0009_expenseitem_created_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expenseitem',
+            name='estimate_category',
+            field=models.ForeignKey(blank=True, help_text='Категория сметных работ для сравнения плана и факта', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='expense_items', to='projects.estimatecategory', verbose_name='Раздел сметы'),
+        ),
+        migrations.RunPython(fill_variance_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations, models
+
+
+def fill_search_text(apps, schema_editor):
+    """Заполнить текст для поиска у существующих задач"""
+    ExpenseItem = apps.get_model('kanban', 'ExpenseItem')
+
+    batch = []
+    for task in ExpenseItem.objects.only('id', 'title', 'description').iterator(chunk_size=500):
+        task.search_text = f"{task.title} {task.description or ''}".casefold()
+        batch.append(task)
+        if len(batch) >= 500:
+            ExpenseItem.objects.bulk_update(batch, ['search_text'])
+            batch = []
+    if batch:
+        ExpenseItem.objects.bulk_update(batch, ['search_text'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kanban', '0010_expenseitem_estimate_category'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expenseitem',
+            name='search_text',
+            field=models.TextField(blank=True, editable=False, verbose_name='Текст для поиска'),
+        ),
+        migrations.RunPython(fill_search_text, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import MinValueValidator
 from decimal import Decimal
@@ -161,9 +161,21 @@ class ExpenseItem(models.Model):
         null=True,
         blank=True
     )
+    estimate_category = models.ForeignKey(
+        'projects.EstimateCategory',
+        on_delete=models.SET_NULL,
+        verbose_name=_('Раздел сметы'),
+        related_name='expense_items',
+        null=True,
+        blank=True,
+        help_text=_('Категория сметных работ для сравнения плана и факта')
+    )
     
     title = models.CharField(_('Название'), max_length=200)
     description = models.TextField(_('Описание'), blank=True)
+    # Название и описание в casefold для поиска подстрокой в SQL: LIKE в
+    # SQLite не различает регистр только для латиницы
+    search_text = models.TextField(_('Текст для поиска'), blank=True, editable=False)
     task_type = models.CharField(
         _('Тип задачи'),
         max_length=20,
@@ -264,15 +276,92 @@ class ExpenseItem(models.Model):
         verbose_name_plural = _('Задачи')
         db_table = 'expense_items'
         ordering = ['column__position', 'position', '-created_at']
+        indexes = [
+            # Постраничный вывод задач в боте по ключу (created_at, id)
+            models.Index(fields=['-created_at', '-id'], name='expense_item_created_idx'),
+            models.Index(fields=['project', '-created_at', '-id'], name='expense_item_proj_created_idx'),
+        ]
+
+    # Поля, от которых зависит учтенная сумма расхода: факт в своде
+    # план/факт (projects.variance) и проводки журнала (projects.ledger)
+    ACTUAL_FIELDS = ('project_id', 'estimate_category_id', 'status', 'amount', 'created_at')
 
     def __str__(self):
         return f"{self.title} - {self.get_status_display()}"
 
+    @staticmethod
+    def build_search_text(title, description):
+        """Значение search_text; при bulk_create его нужно заполнить явно"""
+        return f"{title} {description or ''}".casefold()
+
+    def _actual(self):
+        from projects.variance import APPROVED_STATUS
+
+        amount = self.amount if self.status == APPROVED_STATUS else Decimal('0.00')
+        return (self.project_id, self.estimate_category_id, amount, self.created_at)
+
+    def _saved_actual(self):
+        """Учтенная сумма по строке в базе; строка блокируется до конца транзакции
+
+        Блокировка не дает двум одновременным одобрениям одного расхода
+        провести его дважды.
+        """
+        from projects.variance import APPROVED_STATUS
+
+        row = (
+            type(self).objects
+            .select_for_update()
+            .filter(pk=self.pk)
+            .values_list(*self.ACTUAL_FIELDS)
+            .first()
+        )
+        if row is None:
+            return None
+        project_id, category_id, status, amount, created_at = row
+        if status != APPROVED_STATUS:
+            amount = Decimal('0.00')
+        return (project_id, category_id, amount, created_at)
+
     def save(self, *args, **kwargs):
+        from projects.ledger import post_expense_change
+        from projects.variance import move_actual
+
         # Синхронизируем статус с типом колонки
         if self.column:
             self.status = self.column.column_type
-        super().save(*args, **kwargs)
+
+        self.search_text = self.build_search_text(self.title, self.description)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'title', 'description'}.intersection(update_fields):
+            kwargs['update_fields'] = update_fields = [*update_fields, 'search_text']
+        tracked = {'project', 'estimate_category', 'status', 'amount'}
+        if update_fields is not None and not tracked.intersection(update_fields):
+            super().save(*args, **kwargs)
+            return
+
+        with transaction.atomic():
+            previous = None if self._state.adding else self._saved_actual()
+            super().save(*args, **kwargs)
+            current = self._actual()
+            move_actual(previous, current)
+            post_expense_change(
+                self,
+                (previous[0], previous[2]) if previous else None,
+                (current[0], current[2])
+            )
+
+    def delete(self, *args, **kwargs):
+        from projects.ledger import post_expense_change
+        from projects.variance import move_actual
+
+        with transaction.atomic():
+            saved = self._saved_actual()
+            if saved:
+                # Проводка до удаления: ссылка на расход в ней обнулится вместе с удалением
+                post_expense_change(self, (saved[0], saved[2]), None)
+            result = super().delete(*args, **kwargs)
+            move_actual(saved, None)
+        return result
     
     @property
     def is_overdue(self):
@@ -1,9 +1,9 @@
 from django.contrib import admin
 from django.utils.translation import gettext_lazy as _
-from .models import Project, ProjectMember, ProjectActivity, ProjectDocument, ProjectEstimate
+from .models import Project, ProjectMember, ProjectActivity, ProjectDocument, ProjectEstimate, ProjectLedgerEntry
 from .estimate_models import (
     EstimateCategory, EstimateUnit, EstimateRate, EstimateTemplate,
-    ProjectEstimateItem, EstimateImport, EstimateExport
+    ProjectEstimateItem, EstimateImport, EstimateExport, EstimateSnapshot, EstimateVarianceRollup
 )
 
 
@@ -17,7 +17,7 @@ class ProjectAdmin(admin.ModelAdmin):
     list_display = ('name', 'status', 'budget', 'spent_amount', 'foreman', 'created_at')
     list_filter = ('status', 'created_at')
     search_fields = ('name', 'description')
-    readonly_fields = ('id', 'created_at', 'updated_at')
+    readonly_fields = ('id', 'spent_amount', 'created_at', 'updated_at')
     inlines = [ProjectMemberInline]
     
     fieldsets = (
@@ -44,6 +44,14 @@ class ProjectActivityAdmin(admin.ModelAdmin):
     readonly_fields = ('created_at',)
 
 
+@admin.register(ProjectLedgerEntry)
+class ProjectLedgerEntryAdmin(admin.ModelAdmin):
+    list_display = ('project', 'entry_type', 'amount', 'expense', 'warehouse_transaction', 'description', 'created_at')
+    list_filter = ('entry_type', 'created_at')
+    search_fields = ('project__name', 'description')
+    readonly_fields = ('project', 'expense', 'warehouse_transaction', 'entry_type', 'amount', 'description', 'created_at')
+
+
 @admin.register(ProjectDocument)
 class ProjectDocumentAdmin(admin.ModelAdmin):
     list_display = ('name', 'project', 'document_type', 'uploaded_by', 'created_at')
@@ -57,12 +65,12 @@ class ProjectEstimateAdmin(admin.ModelAdmin):
     list_display = ('project', 'estimate_type', 'total_amount', 'spent_amount', 'is_approved', 'created_at')
     list_filter = ('estimate_type', 'is_approved', 'created_at')
     search_fields = ('project__name', 'name')
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = ('spent_amount', 'created_at', 'updated_at')
 
 
 @admin.register(EstimateCategory)
 class EstimateCategoryAdmin(admin.ModelAdmin):
-    list_display = ('code', 'name', 'parent', 'is_active', 'created_at')
+    list_display = ('code', 'name', 'parent', 'depth', 'is_active', 'created_at')
     list_filter = ('is_active', 'parent', 'created_at')
     search_fields = ('code', 'name')
     ordering = ('code',)
@@ -120,4 +128,20 @@ class EstimateExportAdmin(admin.ModelAdmin):
     list_display = ('project', 'format', 'file_name', 'status', 'created_by', 'created_at')
     list_filter = ('format', 'status', 'created_at')
     search_fields = ('project__name', 'file_name')
-    readonly_fields = ('created_at', 'completed_at')
\ No newline at end of file
+    readonly_fields = ('created_at', 'completed_at')
+
+@admin.register(EstimateSnapshot)
+class EstimateSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('estimate', 'version', 'is_keyframe', 'lines_count', 'total_amount', 'created_by', 'created_at')
+    list_filter = ('is_keyframe', 'created_at')
+    search_fields = ('estimate__project__name',)
+    readonly_fields = ('created_at',)
+    exclude = ('lines', 'removed')
+
+
+@admin.register(EstimateVarianceRollup)
+class EstimateVarianceRollupAdmin(admin.ModelAdmin):
+    list_display = ('project', 'category', 'month', 'planned_amount', 'actual_amount', 'updated_at')
+    list_filter = ('month',)
+    search_fields = ('project__name', 'category__name')
+    readonly_fields = ('project', 'category', 'month', 'planned_amount', 'actual_amount', 'updated_at')
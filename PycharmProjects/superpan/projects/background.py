@@ -0,0 +1,45 @@
+# Фоновое выполнение длительных операций со сметами (импорт, экспорт)
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Пул фоновых задач (создается при первом обращении)"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.ESTIMATE_BACKGROUND_WORKERS,
+                    thread_name_prefix='estimate-bg'
+                )
+    return _executor
+
+
+def _call(func, args, kwargs):
+    close_old_connections()
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        logger.exception(f"Ошибка фоновой задачи {func.__name__}")
+    finally:
+        close_old_connections()
+
+
+def run_in_background(func, *args, **kwargs):
+    """Выполнить функцию в фоновом потоке после фиксации текущей транзакции
+
+    Запрос пользователя не ждет выполнения: функция получает данные,
+    уже сохраненные в базе, и сама отражает прогресс и результат в записях
+    (например, EstimateImport.status).
+    """
+    transaction.on_commit(lambda: get_executor().submit(_call, func, args, kwargs))
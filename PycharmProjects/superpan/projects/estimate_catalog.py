@@ -0,0 +1,165 @@
+# Поиск и создание категорий и единиц измерения при загрузке расценок
+import hashlib
+import threading
+
+from django.db import IntegrityError, transaction
+
+from .estimate_models import EstimateCatalogVersion, EstimateCategory, EstimateUnit
+
+DEFAULT_CATEGORY_NAME = 'Импортированные работы'
+DEFAULT_CATEGORY_CODE = 'IMPORT'
+DEFAULT_UNIT_NAME = 'шт'
+
+
+def _normalize(value):
+    return ' '.join(str(value or '').split()).casefold()
+
+
+def _short_hash(value, length):
+    return hashlib.md5(value.encode('utf-8')).hexdigest()[:length].upper()
+
+
+class CatalogResolver:
+    """Кэш справочников категорий и единиц измерения на время загрузки
+
+    Справочники читаются один раз (они небольшие), поиск идет по
+    нормализованному названию, коду или краткому названию. Недостающие
+    записи создаются по требованию и сразу попадают в кэш, поэтому на
+    строку файла не приходится ни одного дополнительного запроса.
+    """
+
+    def __init__(self, create_missing=True):
+        self.create_missing = create_missing
+        self.created_categories = 0
+        self.created_units = 0
+        self._categories = {}
+        self._units = {}
+        self._loaded = False
+
+    def _load(self):
+        for category in EstimateCategory.objects.all():
+            self._categories[_normalize(category.name)] = category
+            self._categories.setdefault(_normalize(category.code), category)
+        for unit in EstimateUnit.objects.all():
+            self._units[_normalize(unit.name)] = unit
+            self._units.setdefault(_normalize(unit.short_name), unit)
+        self._loaded = True
+
+    def category(self, name, code=None):
+        """Категория по названию или коду (None - категория по умолчанию)"""
+        if not self._loaded:
+            self._load()
+
+        if not name and not code:
+            name, code = DEFAULT_CATEGORY_NAME, DEFAULT_CATEGORY_CODE
+
+        for key in (_normalize(code), _normalize(name)):
+            if key and key in self._categories:
+                return self._categories[key]
+
+        if not self.create_missing:
+            return None
+
+        name = (name or code)[:200]
+        code = (code or f"IMP-{_short_hash(_normalize(name), 10)}")[:20]
+        try:
+            with transaction.atomic():
+                category = EstimateCategory.objects.create(name=name, code=code)
+            self.created_categories += 1
+        except IntegrityError:
+            category = EstimateCategory.objects.filter(name=name).first() or EstimateCategory.objects.get(code=code)
+
+        self._categories[_normalize(category.name)] = category
+        self._categories[_normalize(category.code)] = category
+        return category
+
+    def unit(self, name):
+        """Единица измерения по названию или краткому названию"""
+        if not self._loaded:
+            self._load()
+
+        name = ' '.join(str(name or DEFAULT_UNIT_NAME).split())
+        key = _normalize(name)
+        if key in self._units:
+            return self._units[key]
+
+        if not self.create_missing:
+            return None
+
+        short_name = name[:10]
+        if _normalize(short_name) in self._units:
+            short_name = f"{name[:5]}{_short_hash(key, 5)}"
+        try:
+            with transaction.atomic():
+                unit = EstimateUnit.objects.create(name=name[:50], short_name=short_name)
+            self.created_units += 1
+        except IntegrityError:
+            unit = EstimateUnit.objects.filter(name=name[:50]).first() or EstimateUnit.objects.get(short_name=short_name)
+
+        self._units[key] = unit
+        self._units[_normalize(unit.short_name)] = unit
+        return unit
+
+
+class CategoryTree:
+    """Дерево категорий в памяти процесса, построенное одним запросом"""
+
+    def __init__(self, version):
+        self.version = version
+        self.categories = list(EstimateCategory.objects.order_by('path'))
+        self.by_id = {category.pk: category for category in self.categories}
+        self.children = {}
+        for category in self.categories:
+            category.tree_label = '— ' * category.depth + category.name
+            self.children.setdefault(category.parent_id, []).append(category)
+
+    def roots(self):
+        return self.children.get(None, [])
+
+    def active(self):
+        """Активные категории в порядке обхода дерева (неактивная скрывает свое поддерево)"""
+        hidden = []
+        result = []
+        for category in self.categories:
+            if any(category.path.startswith(path) for path in hidden):
+                continue
+            if not category.is_active:
+                hidden.append(category.path)
+                continue
+            result.append(category)
+        return result
+
+    def subtree_ids(self, category_id):
+        """id категории и всех ее подкатегорий"""
+        category = self.by_id.get(category_id)
+        if category is None:
+            return []
+        return [item.pk for item in self.categories if item.path.startswith(category.path)]
+
+    def ancestors(self, category_id):
+        """Родительские категории от корня"""
+        result = []
+        category = self.by_id.get(category_id)
+        while category is not None and category.parent_id is not None:
+            category = self.by_id.get(category.parent_id)
+            if category is not None:
+                result.append(category)
+        result.reverse()
+        return result
+
+
+_tree = None
+_tree_lock = threading.Lock()
+
+
+def get_category_tree():
+    """Дерево категорий; перестраивается, когда меняется версия справочника категорий"""
+    global _tree
+    version = EstimateCatalogVersion.current(EstimateCatalogVersion.CATEGORIES)
+    tree = _tree
+    if tree is None or tree.version != version:
+        with _tree_lock:
+            if _tree is None or _tree.version != version:
+                _tree = CategoryTree(version)
+            tree = _tree
+    return tree
@@ -0,0 +1,402 @@
+# Экспорт смет в Excel, PDF, Word, XML и JSON
+import json
+import logging
+import os
+import tempfile
+import zipfile
+from xml.sax.saxutils import XMLGenerator
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .estimate_models import EstimateExport
+from .estimate_snapshots import capture_snapshot
+
+logger = logging.getLogger(__name__)
+
+# Сколько позиций читается из базы за один запрос при выгрузке
+EXPORT_CHUNK_SIZE = 2000
+
+# Сколько раз выгрузка повторяется, если смета изменилась во время нее
+EXPORT_ATTEMPTS = 3
+
+FILE_EXTENSIONS = {
+    'excel': 'xlsx',
+    'pdf': 'pdf',
+    'word': 'docx',
+    'xml': 'xml',
+    'json': 'json',
+}
+
+CONTENT_TYPES = {
+    'excel': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'pdf': 'application/pdf',
+    'word': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'xml': 'application/xml',
+    'json': 'application/json',
+}
+
+ITEM_FIELDS = (
+    'position', 'rate__code', 'rate__name', 'rate__unit__short_name', 'quantity',
+    'unit_price', 'total_price', 'labor_amount', 'material_amount', 'equipment_amount', 'notes'
+)
+ITEM_HEADERS = (
+    '№', 'Код', 'Наименование работ', 'Ед.', 'Кол-во',
+    'Цена за ед.', 'Стоимость', 'Труд', 'Материалы', 'Оборудование', 'Примечания'
+)
+
+DEFAULT_OPTIONS = {'include_items': True, 'include_calculations': True, 'include_notes': True}
+
+
+def options_suffix(options):
+    """Часть имени файла по набору опций (полная выгрузка - без суффикса)"""
+    flags = ''.join(
+        flag for flag, key in (('i', 'include_items'), ('c', 'include_calculations'), ('n', 'include_notes'))
+        if options.get(key, True)
+    )
+    return '' if flags == 'icn' else f"-{flags or 'none'}"
+
+
+def artifact_path(estimate, export_format, options=None):
+    """Путь файла выгрузки: определяется сметой, ее версией и форматом"""
+    suffix = options_suffix(options or DEFAULT_OPTIONS)
+    return f"estimate_exports/{estimate.pk}/v{estimate.version}{suffix}.{FILE_EXTENSIONS[export_format]}"
+
+
+def iter_items(estimate):
+    """Позиции сметы кортежами ITEM_FIELDS, читаются из базы порциями"""
+    return (
+        estimate.items
+        .order_by('position', 'id')
+        .values_list(*ITEM_FIELDS)
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+
+
+def summary_rows(estimate):
+    return (
+        ('Стоимость труда', estimate.labor_amount),
+        ('Стоимость материалов', estimate.material_amount),
+        ('Стоимость оборудования', estimate.equipment_amount),
+        (f'Накладные расходы ({estimate.overhead_percent}%)', estimate.overhead_amount),
+        (f'Прибыль ({estimate.profit_percent}%)', estimate.profit_amount),
+        ('Итого по смете', estimate.calculated_total),
+    )
+
+
+def _row_values(row, options):
+    values = list(row)
+    if not options.get('include_notes', True):
+        values[-1] = ''
+    return values
+
+
+def _title(estimate):
+    return estimate.name or f"Смета проекта {estimate.project.name}"
+
+
+def render_excel(estimate, fileobj, options):
+    """xlsx в режиме write_only: строки пишутся в файл сразу, лист не хранится в памяти"""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Смета')
+    sheet.append([_title(estimate)])
+    sheet.append([f"Версия {estimate.version}, {timezone.now():%d.%m.%Y %H:%M}"])
+    sheet.append([])
+
+    if options.get('include_items', True):
+        sheet.append(ITEM_HEADERS)
+        for row in iter_items(estimate):
+            sheet.append(_row_values(row, options))
+        sheet.append([])
+
+    if options.get('include_calculations', True):
+        for label, value in summary_rows(estimate):
+            sheet.append([label, value])
+
+    workbook.save(fileobj)
+
+
+def _write_xml(generator, estimate, options):
+    generator.startDocument()
+    generator.startElement('Estimate', {
+        'project': str(estimate.project.name),
+        'name': _title(estimate),
+        'version': str(estimate.version),
+        'created': timezone.now().isoformat(),
+    })
+
+    if options.get('include_items', True):
+        generator.startElement('Items', {})
+        for row in iter_items(estimate):
+            values = _row_values(row, options)
+            generator.startElement('Item', {
+                field.replace('rate__unit__short_name', 'unit').replace('rate__', ''): str(value or '')
+                for field, value in zip(ITEM_FIELDS[:-1], values[:-1])
+            })
+            if values[-1]:
+                generator.startElement('Notes', {})
+                generator.characters(values[-1])
+                generator.endElement('Notes')
+            generator.endElement('Item')
+        generator.endElement('Items')
+
+    if options.get('include_calculations', True):
+        generator.startElement('Summary', {})
+        for label, value in summary_rows(estimate):
+            generator.startElement('Total', {'name': label, 'amount': str(value)})
+            generator.endElement('Total')
+        generator.endElement('Summary')
+
+    generator.endElement('Estimate')
+    generator.endDocument()
+
+
+def render_xml(estimate, fileobj, options):
+    """XML пишется потоком через XMLGenerator"""
+    _write_xml(XMLGenerator(fileobj, encoding='utf-8'), estimate, options)
+
+
+def render_json(estimate, fileobj, options):
+    """JSON пишется по одной позиции, без сборки всего документа в памяти"""
+    def write(text):
+        fileobj.write(text.encode('utf-8'))
+
+    header = {
+        'project': estimate.project.name,
+        'name': _title(estimate),
+        'version': estimate.version,
+        'created': timezone.now(),
+    }
+    write(json.dumps(header, cls=DjangoJSONEncoder, ensure_ascii=False)[:-1])
+
+    if options.get('include_items', True):
+        write(', "items": [')
+        keys = [field.replace('rate__unit__short_name', 'unit').replace('rate__', '') for field in ITEM_FIELDS]
+        for index, row in enumerate(iter_items(estimate)):
+            item = dict(zip(keys, _row_values(row, options)))
+            write((', ' if index else '') + json.dumps(item, cls=DjangoJSONEncoder, ensure_ascii=False))
+        write(']')
+
+    if options.get('include_calculations', True):
+        summary = [{'name': label, 'amount': value} for label, value in summary_rows(estimate)]
+        write(', "summary": ' + json.dumps(summary, cls=DjangoJSONEncoder, ensure_ascii=False))
+
+    write('}')
+
+
+def _pdf_font():
+    """Шрифт с кириллицей для PDF (путь в ESTIMATE_PDF_FONT), иначе Helvetica"""
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    font_path = settings.ESTIMATE_PDF_FONT
+    if font_path and os.path.exists(font_path):
+        if 'EstimateFont' not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(TTFont('EstimateFont', font_path))
+        return 'EstimateFont'
+    return 'Helvetica'
+
+
+def render_pdf(estimate, fileobj, options):
+    """PDF рисуется постранично: на странице хранятся только ее строки"""
+    from reportlab.lib.pagesizes import A4, landscape
+    from reportlab.pdfgen import canvas
+
+    font = _pdf_font()
+    width, height = landscape(A4)
+    margin = 30
+    line_height = 14
+    columns = (
+        (0, 30), (30, 70), (100, 300), (400, 40), (440, 60),
+        (500, 70), (570, 80), (650, 60), (710, 60), (770, 40),
+    )
+
+    pdf = canvas.Canvas(fileobj, pagesize=(width, height))
+    pdf.setTitle(_title(estimate))
+    page = 1
+    y = height - margin
+
+    def page_header():
+        nonlocal y
+        y = height - margin
+        pdf.setFont(font, 12)
+        pdf.drawString(margin, y, f"{_title(estimate)} (версия {estimate.version})")
+        pdf.setFont(font, 8)
+        pdf.drawRightString(width - margin, y, f"Стр. {page}")
+        y -= line_height * 2
+
+    def draw_row(values):
+        nonlocal y, page
+        if y < margin + line_height:
+            pdf.showPage()
+            page += 1
+            page_header()
+            pdf.setFont(font, 7)
+        for (x, column_width), value in zip(columns, values):
+            text = str(value if value is not None else '')
+            max_chars = max(int(column_width / 3.6), 3)
+            if len(text) > max_chars:
+                text = text[:max_chars - 1] + '…'
+            pdf.drawString(margin + x, y, text)
+        y -= line_height
+
+    page_header()
+    if options.get('include_items', True):
+        pdf.setFont(font, 7)
+        draw_row(ITEM_HEADERS[:len(columns)])
+        for row in iter_items(estimate):
+            draw_row(_row_values(row, options)[:len(columns)])
+        y -= line_height
+
+    if options.get('include_calculations', True):
+        pdf.setFont(font, 9)
+        for label, value in summary_rows(estimate):
+            draw_row(('', '', label, '', '', '', f"{value:,.2f}".replace(',', ' ')))
+
+    pdf.save()
+
+
+DOCX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>'
+)
+DOCX_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/>'
+    '</Relationships>'
+)
+
+
+def _docx_paragraph(generator, text, bold=False):
+    generator.startElement('w:p', {})
+    generator.startElement('w:r', {})
+    if bold:
+        generator.startElement('w:rPr', {})
+        generator.startElement('w:b', {})
+        generator.endElement('w:b')
+        generator.endElement('w:rPr')
+    generator.startElement('w:t', {'xml:space': 'preserve'})
+    generator.characters(str(text))
+    generator.endElement('w:t')
+    generator.endElement('w:r')
+    generator.endElement('w:p')
+
+
+def _docx_row(generator, values, bold=False):
+    generator.startElement('w:tr', {})
+    for value in values:
+        generator.startElement('w:tc', {})
+        _docx_paragraph(generator, value if value is not None else '', bold)
+        generator.endElement('w:tc')
+    generator.endElement('w:tr')
+
+
+def render_word(estimate, fileobj, options):
+    """docx (WordprocessingML): document.xml пишется потоком прямо в zip-архив"""
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', DOCX_CONTENT_TYPES)
+        archive.writestr('_rels/.rels', DOCX_RELS)
+
+        with archive.open('word/document.xml', 'w', force_zip64=True) as document:
+            generator = XMLGenerator(document, encoding='utf-8')
+            generator.startDocument()
+            generator.startElement('w:document', {
+                'xmlns:w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+            })
+            generator.startElement('w:body', {})
+            _docx_paragraph(generator, f"{_title(estimate)} (версия {estimate.version})", bold=True)
+
+            if options.get('include_items', True):
+                generator.startElement('w:tbl', {})
+                generator.startElement('w:tblPr', {})
+                generator.startElement('w:tblStyle', {'w:val': 'TableGrid'})
+                generator.endElement('w:tblStyle')
+                generator.endElement('w:tblPr')
+                _docx_row(generator, ITEM_HEADERS, bold=True)
+                for row in iter_items(estimate):
+                    _docx_row(generator, _row_values(row, options))
+                generator.endElement('w:tbl')
+
+            if options.get('include_calculations', True):
+                for label, value in summary_rows(estimate):
+                    _docx_paragraph(generator, f"{label}: {value:,.2f} ₽".replace(',', ' '))
+
+            generator.endElement('w:body')
+            generator.endElement('w:document')
+            generator.endDocument()
+
+
+RENDERERS = {
+    'excel': render_excel,
+    'pdf': render_pdf,
+    'word': render_word,
+    'xml': render_xml,
+    'json': render_json,
+}
+
+
+def find_cached_artifact(estimate, export_format, options=None):
+    """Путь готового файла для текущей версии сметы или None"""
+    path = artifact_path(estimate, export_format, options)
+    return path if default_storage.exists(path) else None
+
+
+def export_estimate(export_id, options=None):
+    """Фоновая задача экспорта (см. projects.background.run_in_background)
+
+    Файл для версии сметы создается один раз: если он уже есть в
+    хранилище, запись экспорта сразу получает его путь. Позиции читаются
+    из базы по ходу выгрузки, поэтому после нее версия сметы проверяется
+    заново: если смета успела измениться, файл смешивает версии и
+    отбрасывается, а выгрузка повторяется для новой версии.
+    """
+    options = {**DEFAULT_OPTIONS, **(options or {})}
+    record = EstimateExport.objects.select_related('project__estimate').get(pk=export_id)
+    EstimateExport.objects.filter(pk=record.pk).update(status='processing')
+
+    try:
+        estimate = record.project.estimate
+        for _ in range(EXPORT_ATTEMPTS):
+            path = artifact_path(estimate, record.format, options)
+            if default_storage.exists(path):
+                break
+            with tempfile.TemporaryFile() as tmp:
+                RENDERERS[record.format](estimate, tmp, options)
+                version = type(estimate).objects.values_list('version', flat=True).get(pk=estimate.pk)
+                if version == estimate.version:
+                    tmp.seek(0)
+                    path = default_storage.save(path, File(tmp))
+                    break
+            estimate.refresh_from_db()
+        else:
+            raise RuntimeError(f"Смета изменялась во время каждой из {EXPORT_ATTEMPTS} попыток выгрузки")
+
+        # Выгруженная версия должна оставаться доступной для сравнения
+        capture_snapshot(estimate, record.created_by)
+
+        EstimateExport.objects.filter(pk=record.pk).update(
+            status='completed',
+            file_path=path,
+            estimate_version=estimate.version,
+            completed_at=timezone.now()
+        )
+    except Exception as e:
+        logger.exception(f"Ошибка экспорта сметы {record.pk}")
+        EstimateExport.objects.filter(pk=record.pk).update(
+            status='failed',
+            error=str(e),
+            completed_at=timezone.now()
+        )
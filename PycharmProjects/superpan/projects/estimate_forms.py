@@ -269,10 +269,10 @@ class EstimateImportForm(forms.ModelForm):
     
     file = forms.FileField(
         label=_('Файл сметы'),
-        help_text=_('Поддерживаемые форматы: Excel, АРПС, XML'),
+        help_text=_('Поддерживаемые форматы: Excel (.xlsx), CSV, XML ГрандСмета, АРПС'),
         widget=forms.FileInput(attrs={
             'class': 'form-control',
-            'accept': '.xlsx,.xls,.xml,.arps'
+            'accept': '.xlsx,.csv,.xml,.arps'
         })
     )
     
@@ -288,12 +288,12 @@ class EstimateImportForm(forms.ModelForm):
     def clean_file(self):
         file = self.cleaned_data.get('file')
         if file:
-            # Проверяем размер файла (максимум 10MB)
-            if file.size > 10 * 1024 * 1024:
-                raise forms.ValidationError('Размер файла не должен превышать 10MB')
+            # Проверяем размер файла (максимум 50MB, файл разбирается потоково)
+            if file.size > 50 * 1024 * 1024:
+                raise forms.ValidationError('Размер файла не должен превышать 50MB')
             
             # Проверяем расширение файла
-            allowed_extensions = ['.xlsx', '.xls', '.xml', '.arps']
+            allowed_extensions = ['.xlsx', '.csv', '.xml', '.arps']
             file_extension = file.name.lower().split('.')[-1]
             if f'.{file_extension}' not in allowed_extensions:
                 raise forms.ValidationError(
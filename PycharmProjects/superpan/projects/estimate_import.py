@@ -0,0 +1,394 @@
+# Импорт смет из Excel, CSV и XML (ГрандСмета, АРПС)
+import codecs
+import csv
+import hashlib
+import logging
+import os
+import xml.etree.ElementTree as ET
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F, Max
+from django.utils import timezone
+
+from .estimate_catalog import CatalogResolver
+from .estimate_models import EstimateCatalogVersion, EstimateImport, EstimateRate, ProjectEstimateItem
+from .models import ProjectEstimate
+
+logger = logging.getLogger(__name__)
+
+# Сколько строк файла сохраняется одной транзакцией
+IMPORT_BATCH_SIZE = 1000
+
+# Сколько сообщений об ошибках хранится в записи импорта
+MAX_ERROR_LINES = 200
+
+# Сколько первых строк таблицы просматривается в поисках заголовка
+HEADER_SEARCH_ROWS = 50
+
+# Поля строки сметы и варианты заголовков колонок. Порядок важен:
+# «трудозатраты» проверяются раньше «труда», «материалы» раньше «цены»
+COLUMN_ALIASES = (
+    ('code', ('код', 'шифр', 'обоснование', 'code')),
+    ('name', ('наименование', 'название', 'name')),
+    ('unit', ('ед. изм', 'ед.изм', 'единица', 'ед.', 'unit')),
+    ('quantity', ('кол-во', 'количество', 'quantity')),
+    ('labor_hours', ('трудозатрат', 'чел.-ч', 'чел-ч', 'labor_hours')),
+    ('labor_cost', ('труд', 'зарплат', 'озп', 'labor')),
+    ('material_cost', ('материал', 'material')),
+    ('equipment_cost', ('машин', 'оборудован', 'эм', 'equipment')),
+    ('price', ('цена', 'стоимость ед', 'price')),
+    ('category', ('раздел', 'категория', 'category')),
+)
+
+# Атрибуты и вложенные элементы XML (ГрандСмета, АРПС) по полям строки
+XML_ALIASES = {
+    'code': ('code', 'justification', 'шифр', 'обоснование'),
+    'name': ('caption', 'name', 'наименование'),
+    'unit': ('units', 'unit', 'measure'),
+    'quantity': ('quantity', 'qty', 'количество'),
+    'price': ('pz', 'price', 'pricebase', 'cost'),
+    'labor_cost': ('oz', 'labor'),
+    'material_cost': ('mt', 'material'),
+    'equipment_cost': ('em', 'equipment'),
+    'labor_hours': ('tz', 'laborhours'),
+}
+XML_POSITION_TAGS = {'position', 'item', 'row', 'work'}
+XML_SECTION_TAGS = {'chapter', 'section', 'razdel'}
+
+DECIMAL_FIELDS = ('quantity', 'price', 'labor_cost', 'material_cost', 'equipment_cost', 'labor_hours')
+COST_FIELDS = ('labor_cost', 'material_cost', 'equipment_cost', 'labor_hours')
+
+
+class ImportRowError(ValueError):
+    """Строку файла нельзя импортировать"""
+
+
+def _to_decimal(value):
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float, Decimal)):
+        return Decimal(str(value))
+    text = str(value).replace('\xa0', '').replace(' ', '').replace(',', '.')
+    try:
+        return Decimal(text)
+    except InvalidOperation:
+        raise ImportRowError(f"не число: {value!r}")
+
+
+def map_header(cells):
+    """Номера колонок по полям строки или None, если это не строка заголовка"""
+    mapping = {}
+    for index, cell in enumerate(cells):
+        header = ' '.join(str(cell or '').split()).casefold()
+        if not header:
+            continue
+        for field, aliases in COLUMN_ALIASES:
+            if field not in mapping and any(header.startswith(alias) for alias in aliases):
+                mapping[field] = index
+                break
+
+    if 'name' in mapping and ('price' in mapping or 'quantity' in mapping):
+        return mapping
+    return None
+
+
+def _rows_with_header(rows):
+    """Строки таблицы в виде словарей по полям; заголовок ищется в начале"""
+    mapping = None
+    for line, cells in enumerate(rows, start=1):
+        if mapping is None:
+            if line > HEADER_SEARCH_ROWS:
+                raise ImportRowError('не найдена строка заголовка (нужны колонки «Наименование» и «Цена» или «Количество»)')
+            mapping = map_header(cells)
+            continue
+
+        if not any(cell not in (None, '') for cell in cells):
+            continue
+        yield line, {
+            field: cells[index] if index < len(cells) else None
+            for field, index in mapping.items()
+        }
+
+    if mapping is None:
+        raise ImportRowError('файл пуст или не содержит строки заголовка')
+
+
+def read_xlsx(fileobj):
+    """Строки листа Excel; openpyxl в режиме read_only не держит лист в памяти"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        yield from _rows_with_header(workbook.active.iter_rows(values_only=True))
+    finally:
+        workbook.close()
+
+
+def read_csv(fileobj):
+    """Строки CSV (UTF-8 или Windows-1251, разделитель «;» или «,»)"""
+    sample = fileobj.read(64 * 1024)
+    fileobj.seek(0)
+    try:
+        sample.decode('utf-8')
+        encoding = 'utf-8-sig'
+    except UnicodeDecodeError as e:
+        # Обрезанный по границе блока многобайтовый символ - все еще UTF-8
+        encoding = 'utf-8-sig' if e.start >= len(sample) - 3 else 'cp1251'
+
+    text = codecs.getreader(encoding)(fileobj)
+    try:
+        dialect = csv.Sniffer().sniff(sample.decode(encoding, errors='ignore'), delimiters=';,\t')
+    except csv.Error:
+        dialect = 'excel'
+    yield from _rows_with_header(csv.reader(text, dialect))
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1].casefold()
+
+
+def _xml_values(element):
+    """Атрибуты позиции и ее вложенных элементов в одном словаре"""
+    values = {name.casefold(): value for name, value in element.attrib.items()}
+    for child in element:
+        tag = _local_name(child.tag)
+        text = (child.text or '').strip()
+        values.setdefault(tag, text or child.get('Result') or child.get('Value'))
+        for name, value in child.attrib.items():
+            values.setdefault(name.casefold(), value)
+    return values
+
+
+def read_xml(fileobj):
+    """Позиции XML-сметы; обработанные элементы удаляются из дерева сразу"""
+    stack = []
+    sections = []
+    line = 0
+    for event, element in ET.iterparse(fileobj, events=('start', 'end')):
+        tag = _local_name(element.tag)
+        if event == 'start':
+            stack.append(element)
+            if tag in XML_SECTION_TAGS:
+                sections.append(element.get('Caption') or element.get('Name') or '')
+            continue
+
+        stack.pop()
+        if tag in XML_POSITION_TAGS:
+            line += 1
+            values = _xml_values(element)
+            record = {
+                field: next((values[alias] for alias in aliases if values.get(alias) not in (None, '')), None)
+                for field, aliases in XML_ALIASES.items()
+            }
+            record['category'] = sections[-1] if sections else None
+            yield line, record
+        elif tag in XML_SECTION_TAGS:
+            sections.pop()
+        else:
+            continue
+
+        # Память не растет с размером файла: элемент больше не нужен
+        element.clear()
+        if stack:
+            stack[-1].remove(element)
+
+
+READERS = {
+    '.xlsx': read_xlsx,
+    '.csv': read_csv,
+    '.xml': read_xml,
+    '.arps': read_xml,
+}
+
+
+def get_reader(file_name):
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension not in READERS:
+        raise ImportRowError(f"формат {extension or 'без расширения'} не поддерживается")
+    return READERS[extension]
+
+
+def clean_row(record):
+    """Проверить строку файла и привести значения к нужным типам"""
+    row = {field: record.get(field) for field in ('code', 'name', 'unit', 'category')}
+    for field in DECIMAL_FIELDS:
+        row[field] = _to_decimal(record.get(field))
+
+    row['name'] = ' '.join(str(row['name'] or '').split())[:500]
+    if not row['name']:
+        raise ImportRowError('не указано наименование')
+
+    if row['price'] is None:
+        components = [row[field] for field in ('labor_cost', 'material_cost', 'equipment_cost') if row[field]]
+        row['price'] = sum(components) if components else None
+    if not row['price'] or row['price'] <= 0:
+        raise ImportRowError('не указана цена')
+
+    code = ' '.join(str(row['code'] or '').split())
+    if not code:
+        # Без шифра расценка идентифицируется по наименованию и единице
+        digest = hashlib.md5(f"{row['name']}|{row['unit'] or ''}".casefold().encode('utf-8')).hexdigest()
+        code = f"IMP-{digest[:16].upper()}"
+    row['code'] = code[:50]
+    row['price'] = row['price'].quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    return row
+
+
+class EstimateImporter:
+    """Потоковый импорт файла сметы в справочник расценок и позиции сметы
+
+    Файл читается построчно (openpyxl read_only, csv.reader, iterparse)
+    и сохраняется пакетами по IMPORT_BATCH_SIZE строк: расценки
+    добавляются или обновляются по коду, строки с количеством становятся
+    позициями сметы проекта. После каждого пакета в записи импорта
+    обновляются imported_items и errors, поэтому прогресс виден сразу,
+    а расход памяти не зависит от размера файла.
+    """
+
+    def __init__(self, import_record):
+        self.record = import_record
+        self.catalog = CatalogResolver()
+        self.errors = []
+        self.error_count = 0
+        self.imported = 0
+        self.estimate = None
+
+    def run(self):
+        record = self.record
+        EstimateImport.objects.filter(pk=record.pk).update(status='processing')
+
+        try:
+            self.estimate, created = ProjectEstimate.objects.get_or_create(
+                project=record.project,
+                defaults={
+                    'estimate_type': ProjectEstimate.EstimateType.IMPORTED,
+                    'total_amount': record.project.budget,
+                    'created_by': record.created_by
+                }
+            )
+            self.position = (self.estimate.items.aggregate(last=Max('position'))['last'] or 0) + 1
+
+            reader = get_reader(record.file_name)
+            with default_storage.open(record.file_path, 'rb') as fileobj:
+                batch = []
+                for line, values in reader(fileobj):
+                    batch.append((line, values))
+                    if len(batch) >= IMPORT_BATCH_SIZE:
+                        self.save_batch(batch)
+                        batch = []
+                if batch:
+                    self.save_batch(batch)
+            status = 'completed'
+        except Exception as e:
+            logger.exception(f"Ошибка импорта сметы {record.pk}")
+            self.add_error(f"Импорт остановлен: {e}")
+            status = 'failed'
+
+        # Позиции добавлялись пакетами через bulk_create, в том числе до
+        # ошибки импорта - суммы сметы пересчитываем агрегатом в любом случае
+        if self.estimate is not None:
+            try:
+                self.estimate.rebuild_totals()
+            except Exception as e:
+                logger.exception(f"Ошибка пересчета сумм сметы при импорте {record.pk}")
+                self.add_error(f"Не удалось пересчитать суммы сметы: {e}")
+                status = 'failed'
+
+        EstimateImport.objects.filter(pk=record.pk).update(
+            status=status,
+            errors=self.errors_text(),
+            completed_at=timezone.now()
+        )
+        logger.info(
+            f"Импорт сметы {record.pk} ({record.file_name}): {status}, "
+            f"позиций {self.imported}, ошибок {self.error_count}"
+        )
+
+    def add_error(self, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERROR_LINES:
+            self.errors.append(message)
+
+    def errors_text(self):
+        text = '\n'.join(self.errors)
+        if self.error_count > len(self.errors):
+            text += f"\n... и еще {self.error_count - len(self.errors)} ошибок"
+        return text
+
+    def save_batch(self, batch):
+        rows = []
+        for line, values in batch:
+            try:
+                rows.append(clean_row(values))
+            except ImportRowError as e:
+                self.add_error(f"Строка {line}: {e}")
+
+        with transaction.atomic():
+            rates = self.upsert_rates(rows)
+            items = []
+            for row in rows:
+                if not row['quantity'] or row['quantity'] <= 0:
+                    continue
+                item = ProjectEstimateItem(
+                    estimate=self.estimate,
+                    rate=rates[row['code']],
+                    quantity=row['quantity'],
+                    position=self.position,
+                    region_factor=self.estimate.region_factor
+                )
+                item.calculate_amounts()
+                items.append(item)
+                self.position += 1
+            ProjectEstimateItem.objects.bulk_create(items)
+
+            # Каждая корректная строка - это расценка и, если есть количество, позиция сметы
+            self.imported += len(rows)
+            EstimateImport.objects.filter(pk=self.record.pk).update(
+                imported_items=F('imported_items') + len(rows),
+                errors=self.errors_text()
+            )
+
+    def upsert_rates(self, rows):
+        """Добавить новые и обновить изменившиеся расценки пакета, вернуть {код: расценка}"""
+        by_code = {row['code']: row for row in rows}
+        existing = EstimateRate.objects.in_bulk(list(by_code), field_name='code')
+
+        to_create, to_update = [], []
+        now = timezone.now()
+        for code, row in by_code.items():
+            values = {
+                'base_price': row['price'],
+                **{field: row[field] for field in COST_FIELDS if row[field] is not None}
+            }
+            rate = existing.get(code)
+            if rate is None:
+                to_create.append(EstimateRate(
+                    code=code,
+                    name=row['name'],
+                    category=self.catalog.category(row['category']),
+                    unit=self.catalog.unit(row['unit']),
+                    **values
+                ))
+            elif any(getattr(rate, field) != value for field, value in values.items()):
+                for field, value in values.items():
+                    setattr(rate, field, value)
+                rate.updated_at = now
+                to_update.append(rate)
+
+        if to_create:
+            EstimateRate.objects.bulk_create(to_create)
+            EstimateCatalogVersion.bump(EstimateCatalogVersion.RATES)
+        if to_update:
+            EstimateRate.objects.bulk_update(to_update, ['base_price', *COST_FIELDS, 'updated_at'])
+
+        if to_create:
+            existing = EstimateRate.objects.in_bulk(list(by_code), field_name='code')
+        return existing
+
+
+def import_estimate(import_id):
+    """Фоновая задача импорта (см. projects.background.run_in_background)"""
+    record = EstimateImport.objects.select_related('project', 'created_by').get(pk=import_id)
+    EstimateImporter(record).run()
@@ -1,12 +1,56 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Substr
 from django.utils.translation import gettext_lazy as _
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
-from decimal import Decimal
+from decimal import ROUND_HALF_UP, Decimal
 import uuid
 
 
+class EstimateCatalogVersion(models.Model):
+    """Номер версии справочника (категорий, расценок)
+    
+    Увеличивается при каждом изменении справочника; по нему процессы
+    приложения узнают, что закэшированные в памяти данные устарели.
+    """
+    
+    CATEGORIES = 'categories'
+    RATES = 'rates'
+    
+    name = models.CharField(_('Справочник'), max_length=50, unique=True)
+    version = models.PositiveBigIntegerField(_('Версия'), default=0)
+    updated_at = models.DateTimeField(_('Обновлена'), auto_now=True)
+    
+    class Meta:
+        verbose_name = _('Версия справочника')
+        verbose_name_plural = _('Версии справочников')
+        db_table = 'estimate_catalog_versions'
+    
+    def __str__(self):
+        return f"{self.name}: {self.version}"
+    
+    @classmethod
+    def current(cls, name):
+        return cls.objects.filter(name=name).values_list('version', flat=True).first() or 0
+    
+    @classmethod
+    def bump(cls, name):
+        """Отметить изменение справочника"""
+        if not cls.objects.filter(name=name).update(version=F('version') + 1):
+            cls.objects.get_or_create(name=name, defaults={'version': 1})
+
+
 class EstimateCategory(models.Model):
-    """Категории сметных работ"""
+    """Категории сметных работ
+    
+    Дерево категорий хранится как список смежности (parent) и
+    материализованный путь (path): последовательность id предков и самой
+    категории по PATH_SEGMENT_LENGTH цифр с разделителем "/". Поддерево -
+    это все категории с path, начинающимся с пути категории.
+    """
+    
+    PATH_SEGMENT_LENGTH = 10
     
     name = models.CharField(_('Название категории'), max_length=200, unique=True)
     code = models.CharField(_('Код категории'), max_length=20, unique=True)
@@ -19,6 +63,8 @@ class EstimateCategory(models.Model):
         null=True,
         blank=True
     )
+    path = models.CharField(_('Путь в дереве'), max_length=255, blank=True, editable=False, db_index=True)
+    depth = models.PositiveSmallIntegerField(_('Уровень вложенности'), default=0, editable=False)
     is_active = models.BooleanField(_('Активна'), default=True)
     created_at = models.DateTimeField(_('Создана'), auto_now_add=True)
     
@@ -30,6 +76,66 @@ class EstimateCategory(models.Model):
     
     def __str__(self):
         return f"{self.code} - {self.name}"
+    
+    @classmethod
+    def path_segment(cls, pk):
+        return f"{pk:0{cls.PATH_SEGMENT_LENGTH}d}/"
+    
+    def clean(self):
+        super().clean()
+        if self.pk and self.parent_id:
+            parent_path = type(self).objects.filter(pk=self.parent_id).values_list('path', flat=True).first() or ''
+            if self.parent_id == self.pk or self.path_segment(self.pk) in parent_path:
+                raise ValidationError({'parent': _('Категория не может быть вложена в свою подкатегорию')})
+    
+    def save(self, *args, **kwargs):
+        """Сохранение с обновлением пути категории и всех ее подкатегорий"""
+        cls = type(self)
+        with transaction.atomic():
+            old_path, old_depth = '', 0
+            if not self._state.adding:
+                old_path, old_depth = cls.objects.filter(pk=self.pk).values_list('path', 'depth').first() or ('', 0)
+            
+            parent_path = ''
+            if self.parent_id:
+                parent_path = cls.objects.filter(pk=self.parent_id).values_list('path', flat=True).first() or ''
+                if old_path and parent_path.startswith(old_path):
+                    raise ValidationError(_('Категория не может быть вложена в свою подкатегорию'))
+            
+            super().save(*args, **kwargs)
+            
+            self.path = parent_path + self.path_segment(self.pk)
+            self.depth = self.path.count('/') - 1
+            if self.path != old_path:
+                cls.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+                if old_path:
+                    # Перенос категории: пути подкатегорий меняются одним UPDATE
+                    cls.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                        path=Concat(Value(self.path), Substr('path', len(old_path) + 1)),
+                        depth=F('depth') + (self.depth - old_depth)
+                    )
+            
+            EstimateCatalogVersion.bump(EstimateCatalogVersion.CATEGORIES)
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            EstimateCatalogVersion.bump(EstimateCatalogVersion.CATEGORIES)
+        return result
+    
+    def descendants(self, include_self=False):
+        """Все подкатегории любого уровня (один запрос по индексу path)"""
+        categories = type(self).objects.filter(path__startswith=self.path)
+        if not include_self:
+            categories = categories.exclude(pk=self.pk)
+        return categories
+    
+    def ancestors(self, include_self=False):
+        """Родительские категории от корня (id берутся из пути)"""
+        ids = [int(segment) for segment in self.path.split('/') if segment]
+        if not include_self:
+            ids = ids[:-1]
+        return type(self).objects.filter(pk__in=ids).order_by('depth')
 
 
 class EstimateUnit(models.Model):
@@ -138,7 +244,31 @@ class EstimateRate(models.Model):
     def calculate_price(self, quantity=1, region_factor=None):
         """Рассчитать стоимость для заданного количества"""
         factor = region_factor or self.region_factor
-        return (self.base_price * self.complexity_factor * factor * Decimal(str(quantity))).quantize(Decimal('0.01'))
+        return (self.base_price * self.complexity_factor * factor * Decimal(str(quantity))).quantize(
+            Decimal('0.01'), rounding=ROUND_HALF_UP
+        )
+    
+    def save(self, *args, **kwargs):
+        from .variance import rebuild_planned_for_rates
+
+        update_fields = kwargs.get('update_fields')
+        with transaction.atomic():
+            category_changed = (
+                not self._state.adding
+                and (update_fields is None or {'category', 'category_id'}.intersection(update_fields))
+                and type(self).objects.filter(pk=self.pk).exclude(category_id=self.category_id).exists()
+            )
+            super().save(*args, **kwargs)
+            EstimateCatalogVersion.bump(EstimateCatalogVersion.RATES)
+            if category_changed:
+                # План в своде план/факт сводится по категории расценки
+                rebuild_planned_for_rates([self.pk])
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            EstimateCatalogVersion.bump(EstimateCatalogVersion.RATES)
+        return result
 
 
 class EstimateTemplate(models.Model):
@@ -255,9 +385,33 @@ class ProjectEstimateItem(models.Model):
         default=Decimal('1.00')
     )
     
+    # Стоимость труда, материалов и оборудования по позиции с учетом
+    # коэффициентов; из них складываются суммы сметы
+    labor_amount = models.DecimalField(
+        _('Стоимость труда'),
+        max_digits=12,
+        decimal_places=2,
+        default=Decimal('0.00')
+    )
+    material_amount = models.DecimalField(
+        _('Стоимость материалов'),
+        max_digits=12,
+        decimal_places=2,
+        default=Decimal('0.00')
+    )
+    equipment_amount = models.DecimalField(
+        _('Стоимость оборудования'),
+        max_digits=12,
+        decimal_places=2,
+        default=Decimal('0.00')
+    )
+    
     created_at = models.DateTimeField(_('Создана'), auto_now_add=True)
     updated_at = models.DateTimeField(_('Обновлена'), auto_now=True)
     
+    AMOUNT_FIELDS = ('labor_amount', 'material_amount', 'equipment_amount')
+    PLAN_FIELDS = ('estimate_id', 'rate_id', 'total_price', 'created_at')
+    
     class Meta:
         verbose_name = _('Позиция сметы')
         verbose_name_plural = _('Позиции сметы')
@@ -267,16 +421,108 @@ class ProjectEstimateItem(models.Model):
     def __str__(self):
         return f"{self.estimate.project.name} - {self.rate.name}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем сохраненные суммы, чтобы при save() применить к смете разницу
+        if all(name in instance.__dict__ for name in ('estimate_id',) + cls.AMOUNT_FIELDS):
+            instance._saved_amounts = instance._amounts()
+        # и плановую сумму для свода план/факт
+        if all(name in instance.__dict__ for name in cls.PLAN_FIELDS):
+            instance._saved_plan = instance._plan()
+        return instance
+    
+    def _amounts(self):
+        return (self.estimate_id, self.labor_amount, self.material_amount, self.equipment_amount)
+    
+    def _plan(self):
+        return (self.estimate_id, self.rate_id, self.total_price, self.created_at)
+    
+    def calculate_amounts(self):
+        """Рассчитать цену за единицу, общую стоимость и ее составляющие"""
+        from .estimate_pricing import price_rate
+        
+        self.apply_priced(price_rate(
+            self.rate,
+            self.quantity,
+            self.region_factor,
+            self.complexity_factor,
+            price=self.unit_price or None
+        ))
+    
+    def apply_priced(self, priced):
+        """Записать в позицию результат расчета (estimate_pricing.PricedLine)"""
+        self.unit_price = priced.unit_price
+        self.total_price = priced.total_price
+        self.labor_amount = priced.labor_amount
+        self.material_amount = priced.material_amount
+        self.equipment_amount = priced.equipment_amount
+    
     def save(self, *args, **kwargs):
-        """Автоматический расчет общей стоимости"""
-        if not self.unit_price:
-            self.unit_price = self.rate.calculate_price(
-                quantity=1,
-                region_factor=self.region_factor
-            ) * self.complexity_factor
+        """Автоматический расчет стоимости и обновление сумм сметы, ее снимка версии и свода план/факт"""
+        from .estimate_snapshots import item_line, record_change
+        from .models import ProjectEstimate
+        from .variance import move_planned
+        
+        self.calculate_amounts()
+        
+        with transaction.atomic():
+            previous = getattr(self, '_saved_amounts', None)
+            previous_plan = getattr(self, '_saved_plan', None)
+            if (previous is None or previous_plan is None) and not self._state.adding:
+                row = (
+                    type(self).objects
+                    .filter(pk=self.pk)
+                    .values_list('estimate_id', *self.AMOUNT_FIELDS, *self.PLAN_FIELDS[1:])
+                    .first()
+                )
+                if row:
+                    previous = row[:4]
+                    previous_plan = (row[0], *row[4:])
+            
+            super().save(*args, **kwargs)
+            
+            current = self._amounts()
+            # Ключ позиции в снимке прежней версии, если он изменился
+            removed = []
+            if previous_plan and (previous_plan[0], previous_plan[1]) != (self.estimate_id, self.rate_id):
+                removed = [(previous_plan[1], self.pk)]
+            if previous and previous[0] != current[0]:
+                # Позиция перенесена в другую смету
+                estimate = ProjectEstimate.apply_amounts_delta(previous[0], *(-value for value in previous[1:]))
+                if estimate:
+                    record_change(estimate, removed=removed)
+                removed = []
+                previous = None
+            if previous:
+                delta = [new - old for new, old in zip(current[1:], previous[1:])]
+            else:
+                delta = current[1:]
+            # Вызывается и при нулевой разнице: меняется версия сметы
+            estimate = ProjectEstimate.apply_amounts_delta(self.estimate_id, *delta)
+            if estimate:
+                record_change(estimate, upserts=[item_line(self)], removed=removed)
+            move_planned(previous_plan, self._plan())
         
-        self.total_price = (self.unit_price * self.quantity).quantize(Decimal('0.01'))
-        super().save(*args, **kwargs)
+        self._saved_amounts = current
+        self._saved_plan = self._plan()
+    
+    def delete(self, *args, **kwargs):
+        """Удаление позиции с вычитанием ее сумм из сметы и свода план/факт"""
+        from .estimate_snapshots import record_change
+        from .models import ProjectEstimate
+        from .variance import move_planned
+        
+        with transaction.atomic():
+            saved = getattr(self, '_saved_amounts', None) or self._amounts()
+            saved_plan = getattr(self, '_saved_plan', None) or self._plan()
+            key = (saved_plan[1], self.pk)
+            result = super().delete(*args, **kwargs)
+            estimate = ProjectEstimate.apply_amounts_delta(saved[0], *(-value for value in saved[1:]))
+            if estimate:
+                record_change(estimate, removed=[key])
+            move_planned(saved_plan, None)
+        return result
 
 
 class EstimateImport(models.Model):
@@ -379,6 +625,8 @@ class EstimateExport(models.Model):
     )
     created_at = models.DateTimeField(_('Создан'), auto_now_add=True)
     completed_at = models.DateTimeField(_('Завершен'), blank=True, null=True)
+    estimate_version = models.PositiveIntegerField(_('Версия сметы'), blank=True, null=True)
+    error = models.TextField(_('Ошибка'), blank=True)
     
     class Meta:
         verbose_name = _('Экспорт сметы')
@@ -388,3 +636,121 @@ class EstimateExport(models.Model):
     
     def __str__(self):
         return f"Экспорт {self.file_name} для {self.project.name}"
+
+
+class EstimateSnapshot(models.Model):
+    """Неизменяемый снимок позиций сметы на определенной версии
+    
+    Позиции хранятся отсортированным списком [rate_id, item_id, количество,
+    цена за единицу]. Опорный снимок (keyframe) содержит все позиции,
+    остальные - только изменения относительно предыдущего снимка
+    (см. projects.estimate_snapshots).
+    """
+    
+    estimate = models.ForeignKey(
+        'ProjectEstimate',
+        on_delete=models.CASCADE,
+        verbose_name=_('Смета'),
+        related_name='snapshots'
+    )
+    version = models.PositiveIntegerField(_('Версия сметы'))
+    is_keyframe = models.BooleanField(_('Опорный снимок'), default=False)
+    lines = models.JSONField(_('Позиции'), default=list)
+    removed = models.JSONField(_('Удаленные позиции'), default=list)
+    lines_count = models.PositiveIntegerField(_('Позиций в смете'), default=0)
+    total_amount = models.DecimalField(
+        _('Общая сумма сметы'),
+        max_digits=12,
+        decimal_places=2,
+        default=Decimal('0.00')
+    )
+    created_by = models.ForeignKey(
+        'accounts.User',
+        on_delete=models.SET_NULL,
+        verbose_name=_('Создал'),
+        related_name='estimate_snapshots',
+        null=True,
+        blank=True
+    )
+    created_at = models.DateTimeField(_('Создан'), auto_now_add=True)
+    
+    class Meta:
+        verbose_name = _('Снимок сметы')
+        verbose_name_plural = _('Снимки смет')
+        db_table = 'estimate_snapshots'
+        ordering = ['estimate', 'version']
+        unique_together = ['estimate', 'version']
+    
+    def __str__(self):
+        return f"{self.estimate} - версия {self.version}"
+
+
+class EstimateVarianceRollup(models.Model):
+    """Свод план/факт по проекту, категории сметных работ и месяцу
+    
+    План - стоимость позиций сметы по категории расценки (месяц - месяц
+    добавления позиции), факт - одобренные расходы по разделу сметы
+    (месяц - месяц создания расхода). Суммы меняются разницами при
+    сохранении и удалении позиций и расходов (см. projects.variance),
+    отчеты по портфелю читают только эту таблицу.
+    """
+    
+    project = models.ForeignKey(
+        'Project',
+        on_delete=models.CASCADE,
+        verbose_name=_('Проект'),
+        related_name='variance_rollups'
+    )
+    category = models.ForeignKey(
+        EstimateCategory,
+        on_delete=models.CASCADE,
+        verbose_name=_('Категория работ'),
+        related_name='variance_rollups',
+        null=True,
+        blank=True
+    )
+    month = models.DateField(_('Месяц'))
+    planned_amount = models.DecimalField(
+        _('План'),
+        max_digits=14,
+        decimal_places=2,
+        default=Decimal('0.00')
+    )
+    actual_amount = models.DecimalField(
+        _('Факт'),
+        max_digits=14,
+        decimal_places=2,
+        default=Decimal('0.00')
+    )
+    updated_at = models.DateTimeField(_('Обновлен'), auto_now=True)
+    
+    class Meta:
+        verbose_name = _('Свод план/факт')
+        verbose_name_plural = _('Своды план/факт')
+        db_table = 'estimate_variance_rollups'
+        ordering = ['project', 'month', 'category']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['project', 'category', 'month'],
+                name='variance_project_category_month_uniq'
+            ),
+            # NULL в уникальном индексе не конфликтует: строки без категории
+            # ограничиваются отдельно, иначе параллельные первые проводки
+            # создали бы две строки месяца
+            models.UniqueConstraint(
+                fields=['project', 'month'],
+                condition=models.Q(category__isnull=True),
+                name='variance_project_month_no_category_uniq'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['month', 'category'], name='variance_month_category_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.project} - {self.category or 'без категории'} - {self.month:%Y-%m}"
+    
+    @property
+    def variance_amount(self):
+        """Отклонение факта от плана"""
+        return self.actual_amount - self.planned_amount
@@ -0,0 +1,84 @@
+# Расчет стоимости позиций сметы по расценкам
+from collections import namedtuple
+from decimal import ROUND_HALF_UP, Decimal
+
+from .estimate_models import EstimateRate
+
+CENT = Decimal('0.01')
+# Округление до копеек половиной вверх - как ROUND в SQL массового пересчета
+# (estimate_repricing), чтобы смета считалась одинаково обоими путями
+ROUNDING = ROUND_HALF_UP
+
+# Сколько строк принимает пакетный расчет за один запрос
+MAX_BATCH_LINES = 1000
+
+PricedLine = namedtuple('PricedLine', [
+    'rate_id', 'quantity', 'unit_price', 'total_price',
+    'labor_amount', 'material_amount', 'equipment_amount', 'labor_hours'
+])
+
+
+def unit_price(rate, region_factor, complexity_factor):
+    """Цена за единицу работ с учетом регионального коэффициента и сложности"""
+    return (rate.calculate_price(quantity=1, region_factor=region_factor) * complexity_factor).quantize(CENT, rounding=ROUNDING)
+
+
+def price_rate(rate, quantity, region_factor, complexity_factor, price=None):
+    """Стоимость позиции и ее составляющие (труд, материалы, оборудование)
+
+    price - цена за единицу, если она уже известна (задана вручную или
+    посчитана для такой же расценки и коэффициентов).
+    """
+    if price is None:
+        price = unit_price(rate, region_factor, complexity_factor)
+    factor = region_factor * complexity_factor * quantity
+    return PricedLine(
+        rate_id=rate.pk,
+        quantity=quantity,
+        unit_price=price,
+        total_price=(price * quantity).quantize(CENT, rounding=ROUNDING),
+        labor_amount=(rate.labor_cost * factor).quantize(CENT, rounding=ROUNDING),
+        material_amount=(rate.material_cost * factor).quantize(CENT, rounding=ROUNDING),
+        equipment_amount=(rate.equipment_cost * factor).quantize(CENT, rounding=ROUNDING),
+        labor_hours=(rate.labor_hours * quantity).quantize(CENT, rounding=ROUNDING)
+    )
+
+
+def price_lines(lines, rates=None):
+    """Расчет набора строк (rate_id, quantity, region_factor, complexity_factor)
+
+    Расценки загружаются одним запросом (или берутся из rates), цена за
+    единицу считается один раз для каждой комбинации расценки и
+    коэффициентов. Возвращает PricedLine в порядке строк, None - для
+    строк с неизвестной расценкой.
+    """
+    lines = list(lines)
+    if rates is None:
+        rates = EstimateRate.objects.in_bulk({line[0] for line in lines})
+
+    unit_prices = {}
+    result = []
+    for rate_id, quantity, region_factor, complexity_factor in lines:
+        rate = rates.get(rate_id)
+        if rate is None:
+            result.append(None)
+            continue
+
+        key = (rate_id, region_factor, complexity_factor)
+        if key not in unit_prices:
+            unit_prices[key] = unit_price(rate, region_factor, complexity_factor)
+        result.append(price_rate(rate, quantity, region_factor, complexity_factor, unit_prices[key]))
+    return result
+
+
+def sum_lines(priced):
+    """Итоги по рассчитанным строкам (пропущенные строки не учитываются)"""
+    totals = dict.fromkeys(
+        ('total_price', 'labor_amount', 'material_amount', 'equipment_amount', 'labor_hours'),
+        Decimal('0.00')
+    )
+    for line in priced:
+        if line is not None:
+            for key in totals:
+                totals[key] += getattr(line, key)
+    return totals
@@ -0,0 +1,170 @@
+# Автодополнение кодов и названий расценок по индексу в памяти процесса
+import logging
+import re
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+
+from django.db import close_old_connections
+
+from .estimate_models import EstimateCatalogVersion, EstimateRate
+
+logger = logging.getLogger(__name__)
+
+# Сколько кандидатов просматривается при поиске по словам названия
+MAX_SCAN = 5000
+
+# Слова названия короче этой длины в индекс не попадают
+MIN_WORD_LENGTH = 2
+
+WORD_RE = re.compile(r'\w+')
+
+# Буквенный префикс сборника в коде: «ГЭСН 15-04-005-03», «ФЕР01-01-001-01»
+CODE_PREFIX_RE = re.compile(r'^[^\W\d_]+[\s.]*')
+
+
+def normalize(value):
+    return ' '.join(str(value or '').split()).casefold()
+
+
+def _sorted_keys(entries):
+    """Отсортированные ключи и позиции расценок для поиска через bisect"""
+    entries.sort()
+    return [key for key, _ in entries], array('I', (position for _, position in entries))
+
+
+def _prefix_range(keys, prefix):
+    """Позиции ключей, начинающихся с prefix"""
+    index = bisect_left(keys, prefix)
+    while index < len(keys) and keys[index].startswith(prefix):
+        yield index
+        index += 1
+
+
+class RatePrefixIndex:
+    """Отсортированные массивы кодов и слов названий активных расценок
+
+    Поиск - двоичный поиск начала диапазона (bisect) и просмотр ключей
+    с нужным префиксом, без обращений к базе.
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self.rates = list(
+            EstimateRate.objects.filter(is_active=True)
+            .order_by('code')
+            .values_list('id', 'code', 'name', 'unit__short_name')
+        )
+        self.names = [normalize(name) for _, _, name, _ in self.rates]
+
+        code_entries = []
+        word_entries = []
+        for position, (_, code, _, _) in enumerate(self.rates):
+            code = normalize(code)
+            code_entries.append((code, position))
+            # Код без названия сборника: «15-04-005-03» найдет «ГЭСН 15-04-005-03»
+            short_code = CODE_PREFIX_RE.sub('', code)
+            if short_code and short_code != code:
+                code_entries.append((short_code, position))
+
+            for word in set(WORD_RE.findall(self.names[position])):
+                if len(word) >= MIN_WORD_LENGTH:
+                    word_entries.append((sys.intern(word), position))
+
+        self.code_keys, self.code_positions = _sorted_keys(code_entries)
+        self.word_keys, self.word_positions = _sorted_keys(word_entries)
+
+    def __len__(self):
+        return len(self.rates)
+
+    def search(self, query, limit=20):
+        """Расценки, код которых начинается с запроса, затем - по словам названия
+
+        Для поиска по названию каждое слово запроса должно быть началом
+        какого-либо слова в названии расценки.
+        """
+        query = normalize(query)
+        if not query:
+            return []
+
+        found = []
+        seen = set()
+
+        def add(position):
+            if position not in seen:
+                seen.add(position)
+                found.append(position)
+
+        for index in _prefix_range(self.code_keys, query):
+            add(self.code_positions[index])
+            if len(found) >= limit:
+                return self._results(found)
+
+        words = [word for word in WORD_RE.findall(query) if word]
+        if words:
+            # Диапазон ищется по самому длинному слову - он самый узкий
+            words.sort(key=len, reverse=True)
+            lead, rest = words[0], words[1:]
+            for scanned, index in enumerate(_prefix_range(self.word_keys, lead)):
+                if scanned >= MAX_SCAN:
+                    break
+                position = self.word_positions[index]
+                if position in seen:
+                    continue
+                name = ' ' + self.names[position]
+                if all(' ' + word in name or f"-{word}" in name for word in rest):
+                    add(position)
+                    if len(found) >= limit:
+                        break
+
+        return self._results(found)
+
+    def _results(self, positions):
+        return [
+            {'id': rate_id, 'code': code, 'name': name, 'unit': unit}
+            for rate_id, code, name, unit in (self.rates[position] for position in positions)
+        ]
+
+
+_index = None
+_index_lock = threading.Lock()
+_rebuilding = False
+
+
+def _rebuild(version):
+    global _index, _rebuilding
+    close_old_connections()
+    try:
+        index = RatePrefixIndex(version)
+        _index = index
+        logger.info(f"Индекс расценок перестроен: {len(index)} расценок, версия {version}")
+    except Exception:
+        logger.exception("Ошибка построения индекса расценок")
+    finally:
+        _rebuilding = False
+        close_old_connections()
+
+
+def get_rate_index():
+    """Индекс расценок процесса
+
+    Строится при первом обращении. Когда версия справочника расценок
+    меняется, индекс перестраивается в фоновом потоке, а до окончания
+    перестройки запросы обслуживает прежний индекс.
+    """
+    global _index, _rebuilding
+    version = EstimateCatalogVersion.current(EstimateCatalogVersion.RATES)
+    index = _index
+    if index is None:
+        with _index_lock:
+            if _index is None:
+                _index = RatePrefixIndex(version)
+            return _index
+
+    if index.version != version and not _rebuilding:
+        with _index_lock:
+            if not _rebuilding and _index.version != version:
+                _rebuilding = True
+                threading.Thread(target=_rebuild, args=(version,), name='rate-index', daemon=True).start()
+    return index
@@ -0,0 +1,165 @@
+# Массовый пересчет смет после изменения справочника расценок
+from django.db import connection
+from django.db.models import F
+from django.db.models.functions import Round
+from django.utils import timezone
+
+from .estimate_models import EstimateRate, ProjectEstimateItem
+from .estimate_pricing import price_lines
+from .estimate_snapshots import capture_snapshot
+from .models import ProjectEstimate
+from .variance import rebuild_planned
+
+# Поля расценки, к которым применяется индекс
+RATE_PRICE_FIELDS = ('base_price', 'labor_cost', 'material_cost', 'equipment_cost')
+
+TOTAL_FIELDS = ('labor_amount', 'material_amount', 'equipment_amount', 'total_amount')
+
+# Поля позиции, которые пересчитывает ITEMS_UPDATE_SQL
+PRICED_FIELDS = ('unit_price', 'total_price', 'labor_amount', 'material_amount', 'equipment_amount')
+
+# Формулы совпадают с estimate_pricing.price_rate: цена за единицу округляется
+# до копеек дважды (как в EstimateRate.calculate_price и после коэффициента сложности).
+# ROUND округляет половину копейки вверх, как estimate_pricing.ROUNDING
+UNIT_PRICE_SQL = 'ROUND(ROUND(r.base_price * r.complexity_factor * i.region_factor, 2) * i.complexity_factor, 2)'
+
+ITEMS_UPDATE_SQL = """
+UPDATE {items} AS i SET
+    unit_price = {unit_price},
+    total_price = ROUND({unit_price} * i.quantity, 2),
+    labor_amount = ROUND(r.labor_cost * i.region_factor * i.complexity_factor * i.quantity, 2),
+    material_amount = ROUND(r.material_cost * i.region_factor * i.complexity_factor * i.quantity, 2),
+    equipment_amount = ROUND(r.equipment_cost * i.region_factor * i.complexity_factor * i.quantity, 2),
+    updated_at = %s
+FROM {rates} AS r
+WHERE r.id = i.rate_id
+    AND i.estimate_id IN ({estimate_ids})
+    AND i.rate_id IN ({rate_ids})
+"""
+
+# Итоги сметы как в ProjectEstimate.calculated_total: накладные от базы,
+# прибыль от базы с накладными
+ESTIMATES_UPDATE_SQL = """
+UPDATE {estimates} AS e SET
+    labor_amount = t.labor,
+    material_amount = t.material,
+    equipment_amount = t.equipment,
+    total_amount = ROUND(t.base + t.overhead + ROUND((t.base + t.overhead) * t.profit_percent / 100, 2), 2),
+    version = e.version + 1,
+    updated_at = %s
+FROM (
+    SELECT s.*, ROUND(s.base * s.overhead_percent / 100, 2) AS overhead
+    FROM (
+        SELECT i.estimate_id,
+            ROUND(SUM(i.labor_amount), 2) AS labor,
+            ROUND(SUM(i.material_amount), 2) AS material,
+            ROUND(SUM(i.equipment_amount), 2) AS equipment,
+            ROUND(SUM(i.labor_amount + i.material_amount + i.equipment_amount), 2) AS base,
+            pe.overhead_percent,
+            pe.profit_percent
+        FROM {items} AS i
+        JOIN {estimates} AS pe ON pe.id = i.estimate_id
+        WHERE i.estimate_id IN ({estimate_ids})
+        GROUP BY i.estimate_id, pe.overhead_percent, pe.profit_percent
+    ) AS s
+) AS t
+WHERE e.id = t.estimate_id
+"""
+
+
+def apply_rate_index(rates, index, fields=RATE_PRICE_FIELDS):
+    """Умножить цены расценок на индекс одним UPDATE, вернуть число расценок"""
+    return rates.update(
+        **{field: Round(F(field) * index, 2) for field in fields},
+        updated_at=timezone.now()
+    )
+
+
+def affected_estimate_ids(rates, estimates=None, include_approved=False):
+    """Сметы, в которых есть позиции по выбранным расценкам"""
+    items = ProjectEstimateItem.objects.filter(
+        rate__in=rates,
+        estimate__is_active=True
+    )
+    if estimates is not None:
+        items = items.filter(estimate__in=estimates)
+    if not include_approved:
+        items = items.filter(estimate__is_approved=False)
+    return list(items.values_list('estimate_id', flat=True).distinct().order_by('estimate_id'))
+
+
+def snapshot_totals(estimate_ids):
+    """Суммы смет: {id: (название проекта, труд, материалы, оборудование, итого)}"""
+    return {
+        row[0]: row[1:]
+        for row in ProjectEstimate.objects.filter(pk__in=estimate_ids).values_list(
+            'pk', 'project__name', *TOTAL_FIELDS
+        )
+    }
+
+
+def reprice_estimates(estimate_ids, rates):
+    """Пересчитать позиции и итоги смет двумя UPDATE ... FROM
+
+    Пересчитываются только позиции по расценкам из rates; итоги смет
+    и план в своде план/факт пересобираются по всем позициям, новые
+    версии смет получают снимки. Вызывать внутри транзакции. Возвращает
+    число пересчитанных позиций.
+    """
+    rate_ids_sql, rate_ids_params = rates.order_by().values('pk').query.sql_with_params()
+    placeholders = ', '.join(['%s'] * len(estimate_ids))
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    tables = {
+        'items': connection.ops.quote_name(ProjectEstimateItem._meta.db_table),
+        'rates': connection.ops.quote_name(EstimateRate._meta.db_table),
+        'estimates': connection.ops.quote_name(ProjectEstimate._meta.db_table),
+    }
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            ITEMS_UPDATE_SQL.format(
+                unit_price=UNIT_PRICE_SQL,
+                estimate_ids=placeholders,
+                rate_ids=rate_ids_sql,
+                **tables
+            ),
+            [now, *estimate_ids, *rate_ids_params]
+        )
+        items_count = cursor.rowcount
+
+        cursor.execute(
+            ESTIMATES_UPDATE_SQL.format(estimate_ids=placeholders, **tables),
+            [now, *estimate_ids]
+        )
+
+    for estimate in ProjectEstimate.objects.filter(pk__in=estimate_ids):
+        capture_snapshot(estimate)
+    rebuild_planned(ProjectEstimate.objects.filter(pk__in=estimate_ids).values_list('project_id', flat=True))
+    return items_count
+
+
+def check_repriced(estimate_ids, rates):
+    """Сверить пересчитанные сметы с расчетом estimate_pricing
+
+    Позиции по расценкам из rates пересчитываются в Python по текущим
+    расценкам, итоги смет - по ProjectEstimate.calculated_total.
+    Возвращает расхождения [(описание, поле, в базе, по расчету)]:
+    после пересчета без изменения цен (индекс 1.00) их быть не должно.
+    """
+    rows = list(
+        ProjectEstimateItem.objects
+        .filter(estimate_id__in=estimate_ids, rate__in=rates)
+        .order_by('pk')
+        .values_list('pk', 'rate_id', 'quantity', 'region_factor', 'complexity_factor', *PRICED_FIELDS)
+    )
+    mismatches = []
+    for row, priced in zip(rows, price_lines(row[1:5] for row in rows)):
+        for field, stored in zip(PRICED_FIELDS, row[5:]):
+            expected = getattr(priced, field)
+            if stored != expected:
+                mismatches.append((f'позиция {row[0]}', field, stored, expected))
+
+    for estimate in ProjectEstimate.objects.filter(pk__in=estimate_ids).order_by('pk'):
+        if estimate.total_amount != estimate.calculated_total:
+            mismatches.append((f'смета {estimate.pk}', 'total_amount', estimate.total_amount, estimate.calculated_total))
+    return mismatches
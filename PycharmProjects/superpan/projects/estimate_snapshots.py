@@ -0,0 +1,248 @@
+# Снимки версий смет и сравнение версий
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import IntegrityError, transaction
+
+from .estimate_models import EstimateRate, EstimateSnapshot
+from .models import ProjectEstimate
+
+# Через сколько снимков-изменений сохраняется полный (опорный) снимок
+KEYFRAME_INTERVAL = 10
+
+
+def line_key(line):
+    """Ключ сортировки и сопоставления позиции: (rate_id, item_id)"""
+    return line[0], line[1]
+
+
+def _field_value(item, name):
+    """Значение поля позиции строкой с точностью поля - как его возвращает база"""
+    places = item._meta.get_field(name).decimal_places
+    return str(Decimal(str(getattr(item, name))).quantize(Decimal(1).scaleb(-places)))
+
+
+def item_line(item):
+    """Позиция сметы в формате снимка [rate_id, item_id, количество, цена]"""
+    return [item.rate_id, item.pk, _field_value(item, 'quantity'), _field_value(item, 'unit_price')]
+
+
+def current_lines(estimate):
+    """Позиции сметы отсортированным списком [rate_id, item_id, количество, цена]"""
+    return [
+        [rate_id, item_id, str(quantity), str(unit_price)]
+        for rate_id, item_id, quantity, unit_price in estimate.items.order_by('rate_id', 'id').values_list(
+            'rate_id', 'id', 'quantity', 'unit_price'
+        ).iterator(chunk_size=2000)
+    ]
+
+
+def diff_lines(old, new):
+    """Сравнение двух отсортированных списков позиций за один проход
+
+    Возвращает (добавленные, удаленные, измененные), где измененные -
+    пары (старая, новая) позиция.
+    """
+    added, removed, changed = [], [], []
+    i = j = 0
+    while i < len(old) or j < len(new):
+        if j == len(new) or (i < len(old) and line_key(old[i]) < line_key(new[j])):
+            removed.append(old[i])
+            i += 1
+        elif i == len(old) or line_key(new[j]) < line_key(old[i]):
+            added.append(new[j])
+            j += 1
+        else:
+            if old[i][2:] != new[j][2:]:
+                changed.append((old[i], new[j]))
+            i += 1
+            j += 1
+    return added, removed, changed
+
+
+def apply_delta(lines, upserts, removed):
+    """Применить к отсортированному списку позиций изменения снимка (слияние за один проход)"""
+    removed = {tuple(key) for key in removed}
+    result = []
+    i = j = 0
+    while i < len(lines) or j < len(upserts):
+        if j == len(upserts) or (i < len(lines) and line_key(lines[i]) < line_key(upserts[j])):
+            if line_key(lines[i]) not in removed:
+                result.append(lines[i])
+            i += 1
+        elif i == len(lines) or line_key(upserts[j]) < line_key(lines[i]):
+            result.append(upserts[j])
+            j += 1
+        else:
+            result.append(upserts[j])
+            i += 1
+            j += 1
+    return result
+
+
+def load_lines(estimate, version):
+    """Позиции снимка версии: опорный снимок и цепочка изменений после него
+
+    Возвращает (снимок, позиции); EstimateSnapshot.DoesNotExist, если
+    снимка этой версии нет.
+    """
+    snapshot = EstimateSnapshot.objects.get(estimate=estimate, version=version)
+    keyframe = (
+        EstimateSnapshot.objects
+        .filter(estimate=estimate, version__lte=version, is_keyframe=True)
+        .order_by('-version')
+        .first()
+    )
+    lines = keyframe.lines
+    deltas = (
+        EstimateSnapshot.objects
+        .filter(estimate=estimate, version__gt=keyframe.version, version__lte=version)
+        .order_by('version')
+        .values_list('lines', 'removed')
+    )
+    for upserts, removed in deltas:
+        lines = apply_delta(lines, upserts, removed)
+    return snapshot, lines
+
+
+def capture_snapshot(estimate, user=None):
+    """Снимок текущей версии сметы (повторный вызов для той же версии вернет готовый)
+
+    Сохраняются только изменения относительно предыдущего снимка; полный
+    снимок - если изменений больше половины позиций или после
+    KEYFRAME_INTERVAL снимков-изменений подряд.
+    """
+    with transaction.atomic():
+        estimate = ProjectEstimate.objects.select_for_update().get(pk=estimate.pk)
+        existing = EstimateSnapshot.objects.filter(estimate=estimate, version=estimate.version).first()
+        if existing:
+            return existing
+
+        lines = current_lines(estimate)
+        snapshot = EstimateSnapshot(
+            estimate=estimate,
+            version=estimate.version,
+            lines_count=len(lines),
+            total_amount=estimate.total_amount,
+            created_by=user
+        )
+
+        previous = (
+            EstimateSnapshot.objects
+            .filter(estimate=estimate, version__lt=estimate.version)
+            .order_by('-version')
+            .first()
+        )
+        deltas_since_keyframe = 0
+        if previous is not None:
+            keyframe_version = (
+                EstimateSnapshot.objects
+                .filter(estimate=estimate, is_keyframe=True)
+                .order_by('-version')
+                .values_list('version', flat=True)
+                .first()
+            )
+            deltas_since_keyframe = EstimateSnapshot.objects.filter(
+                estimate=estimate, version__gt=keyframe_version
+            ).count()
+
+        if previous is None or deltas_since_keyframe >= KEYFRAME_INTERVAL:
+            snapshot.is_keyframe = True
+        else:
+            _, previous_lines = load_lines(estimate, previous.version)
+            added, removed, changed = diff_lines(previous_lines, lines)
+            upserts = sorted(added + [new for _, new in changed], key=line_key)
+            if len(upserts) + len(removed) > len(lines) // 2:
+                snapshot.is_keyframe = True
+            else:
+                snapshot.lines = upserts
+                snapshot.removed = [list(line_key(line)) for line in removed]
+
+        if snapshot.is_keyframe:
+            snapshot.lines = lines
+
+        try:
+            with transaction.atomic():
+                snapshot.save()
+        except IntegrityError:
+            return EstimateSnapshot.objects.get(estimate=estimate, version=estimate.version)
+        return snapshot
+
+
+def record_change(estimate, upserts=(), removed=()):
+    """Снимок новой версии сметы после изменения отдельных позиций
+
+    Вызывается в транзакции изменения сразу после увеличения версии;
+    estimate - смета с новой версией и суммой. upserts - новые и
+    измененные позиции (item_line), removed - ключи (rate_id, item_id)
+    удаленных. Снимок-изменение пишется без чтения позиций сметы; полный
+    снимок (capture_snapshot) - если у предыдущей версии нет снимка или
+    пора записать опорный.
+    """
+    recent = list(
+        EstimateSnapshot.objects
+        .filter(estimate=estimate, version__lt=estimate.version)
+        .order_by('-version')
+        .values_list('version', 'is_keyframe')[:KEYFRAME_INTERVAL]
+    )
+    keyframe_at = next((index for index, (_, is_keyframe) in enumerate(recent) if is_keyframe), None)
+    if not recent or recent[0][0] != estimate.version - 1 or keyframe_at is None:
+        return capture_snapshot(estimate)
+
+    snapshot = EstimateSnapshot(
+        estimate=estimate,
+        version=estimate.version,
+        lines=sorted(upserts, key=line_key),
+        removed=sorted(list(key) for key in removed),
+        lines_count=estimate.items.count(),
+        total_amount=estimate.total_amount
+    )
+    try:
+        with transaction.atomic():
+            snapshot.save()
+    except IntegrityError:
+        return EstimateSnapshot.objects.get(estimate=estimate, version=estimate.version)
+    return snapshot
+
+
+def diff_versions(estimate, from_version, to_version):
+    """Изменения сметы между двумя версиями со снимками
+
+    Позиции дополняются кодом и названием расценки; стоимость позиции
+    считается как количество × цена за единицу.
+    """
+    from_snapshot, old = load_lines(estimate, from_version)
+    to_snapshot, new = load_lines(estimate, to_version)
+    added, removed, changed = diff_lines(old, new)
+
+    rate_ids = {line[0] for line in added + removed} | {new_line[0] for _, new_line in changed}
+    rates = {
+        rate_id: (code, name)
+        for rate_id, code, name in EstimateRate.objects.filter(pk__in=rate_ids).values_list('id', 'code', 'name')
+    }
+
+    def describe(line):
+        code, name = rates.get(line[0], ('', ''))
+        quantity, unit_price = Decimal(line[2]), Decimal(line[3])
+        return {
+            'item_id': line[1],
+            'rate_id': line[0],
+            'rate_code': code,
+            'rate_name': name,
+            'quantity': line[2],
+            'unit_price': line[3],
+            'total_price': str((quantity * unit_price).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)),
+        }
+
+    return {
+        'from_version': from_version,
+        'to_version': to_version,
+        'added': [describe(line) for line in added],
+        'removed': [describe(line) for line in removed],
+        'changed': [
+            {'before': describe(old_line), 'after': describe(new_line)}
+            for old_line, new_line in changed
+        ],
+        'total_before': str(from_snapshot.total_amount),
+        'total_after': str(to_snapshot.total_amount),
+        'total_delta': str(to_snapshot.total_amount - from_snapshot.total_amount),
+    }
@@ -1,16 +1,31 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponseForbidden, FileResponse, Http404
 from django.views.decorators.http import require_http_methods
 from django.core.paginator import Paginator
-from django.db.models import Sum, Count
+from django.core.files.storage import default_storage
+from django.db.models import Sum, Count, F, Q
+from django.urls import reverse
+from django.utils import timezone
+from decimal import Decimal
+import json
 import logging
 
+from .background import run_in_background
 from .models import Project, ProjectEstimate
 from .estimate_models import (
-    EstimateCategory, EstimateUnit, EstimateRate, EstimateTemplate,
-    ProjectEstimateItem, EstimateImport, EstimateExport
+    EstimateUnit, EstimateRate, EstimateTemplate,
+    ProjectEstimateItem, EstimateImport, EstimateExport, EstimateSnapshot
+)
+from .estimate_catalog import get_category_tree
+from .estimate_import import import_estimate
+from .estimate_snapshots import capture_snapshot, diff_versions
+from .estimate_rate_index import get_rate_index
+from .estimate_pricing import MAX_BATCH_LINES, price_lines, price_rate, sum_lines
+from .estimate_export import (
+    CONTENT_TYPES as EXPORT_CONTENT_TYPES, FILE_EXTENSIONS as EXPORT_EXTENSIONS,
+    export_estimate, find_cached_artifact
 )
 from .estimate_forms import (
     EstimateCategoryForm, EstimateUnitForm, EstimateRateForm,
@@ -43,7 +58,8 @@ def estimate_rates_list(request):
             )
         
         if category:
-            rates = rates.filter(category=category)
+            # Категория вместе со всеми подкатегориями
+            rates = rates.filter(category__path__startswith=category.path)
         
         if unit:
             rates = rates.filter(unit=unit)
@@ -62,13 +78,28 @@ def estimate_rates_list(request):
     context = {
         'rates': rates,
         'search_form': search_form,
-        'categories': EstimateCategory.objects.filter(is_active=True),
+        'categories': get_category_tree().active(),
         'units': EstimateUnit.objects.filter(is_active=True),
     }
     
     return render(request, 'projects/estimate_rates_list.html', context)
 
 
+@login_required
+def estimate_rates_autocomplete(request):
+    """AJAX автодополнение кода и названия расценки (?q=ГЭСН 15-04&limit=20)"""
+    query = request.GET.get('q', '')
+    try:
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 50)
+    except ValueError:
+        limit = 20
+    
+    return JsonResponse({
+        'success': True,
+        'results': get_rate_index().search(query, limit=limit)
+    })
+
+
 @login_required
 def estimate_rate_detail(request, pk):
     """Детальная информация о расценке"""
@@ -91,32 +122,133 @@ def calculate_estimate_cost(request):
     """AJAX расчет стоимости работ"""
     try:
         data = json.loads(request.body)
-        rate_id = data.get('rate_id')
-        quantity = Decimal(str(data.get('quantity', 1)))
-        region_factor = Decimal(str(data.get('region_factor', 1.0)))
-        complexity_factor = Decimal(str(data.get('complexity_factor', 1.0)))
+        rate = get_object_or_404(EstimateRate, pk=data.get('rate_id'))
+        priced = price_rate(
+            rate,
+            Decimal(str(data.get('quantity', 1))),
+            Decimal(str(data.get('region_factor', 1.0))),
+            Decimal(str(data.get('complexity_factor', 1.0)))
+        )
+        
+        return JsonResponse({
+            'success': True,
+            'unit_price': str(priced.unit_price),
+            'total_price': str(priced.total_price),
+            'labor_cost': str(priced.labor_amount),
+            'material_cost': str(priced.material_amount),
+            'equipment_cost': str(priced.equipment_amount),
+            'labor_hours': str(priced.labor_hours)
+        })
+        
+    except Exception as e:
+        logger.error(f"Error calculating estimate cost: {e}")
+        return JsonResponse({'success': False, 'error': 'Ошибка расчета'})
+
+
+@login_required
+@require_http_methods(["POST"])
+def calculate_estimate_cost_batch(request):
+    """AJAX пакетный расчет стоимости работ
+    
+    Принимает {"lines": [{"rate_id", "quantity", "region_factor",
+    "complexity_factor"}, ...]} и возвращает расчет по каждой строке
+    в том же порядке и итоги.
+    """
+    try:
+        data = json.loads(request.body)
+        lines = data.get('lines') or []
+        if len(lines) > MAX_BATCH_LINES:
+            return JsonResponse(
+                {'success': False, 'error': f'Не более {MAX_BATCH_LINES} строк за запрос'},
+                status=400
+            )
         
-        rate = get_object_or_404(EstimateRate, pk=rate_id)
+        parsed = [
+            (
+                int(line['rate_id']),
+                Decimal(str(line.get('quantity', 1))),
+                Decimal(str(line.get('region_factor', 1.0))),
+                Decimal(str(line.get('complexity_factor', 1.0)))
+            )
+            for line in lines
+        ]
+    except (ValueError, TypeError, KeyError, ArithmeticError) as e:
+        logger.warning(f"Invalid batch calculation request: {e}")
+        return JsonResponse({'success': False, 'error': 'Некорректные данные для расчета'}, status=400)
+    
+    try:
+        priced = price_lines(parsed)
+        totals = sum_lines(priced)
         
-        # Рассчитываем стоимость
-        unit_price = rate.calculate_price(quantity=1, region_factor=region_factor) * complexity_factor
-        total_price = unit_price * quantity
+        results = []
+        for line in priced:
+            if line is None:
+                results.append({'success': False, 'error': 'Расценка не найдена'})
+                continue
+            results.append({
+                'success': True,
+                'rate_id': line.rate_id,
+                'unit_price': str(line.unit_price),
+                'total_price': str(line.total_price),
+                'labor_cost': str(line.labor_amount),
+                'material_cost': str(line.material_amount),
+                'equipment_cost': str(line.equipment_amount),
+                'labor_hours': str(line.labor_hours)
+            })
         
         return JsonResponse({
             'success': True,
-            'unit_price': str(unit_price.quantize(Decimal('0.01'))),
-            'total_price': str(total_price.quantize(Decimal('0.01'))),
-            'labor_cost': str((rate.labor_cost * region_factor * complexity_factor * quantity).quantize(Decimal('0.01'))),
-            'material_cost': str((rate.material_cost * region_factor * complexity_factor * quantity).quantize(Decimal('0.01'))),
-            'equipment_cost': str((rate.equipment_cost * region_factor * complexity_factor * quantity).quantize(Decimal('0.01'))),
-            'labor_hours': str((rate.labor_hours * quantity).quantize(Decimal('0.01')))
+            'lines': results,
+            'totals': {key: str(value) for key, value in totals.items()}
         })
         
     except Exception as e:
-        logger.error(f"Error calculating estimate cost: {e}")
+        logger.error(f"Error calculating estimate cost batch: {e}")
         return JsonResponse({'success': False, 'error': 'Ошибка расчета'})
 
 
+@login_required
+@require_http_methods(["POST"])
+def reprice_estimate(request, pk):
+    """Пересчет всех позиций сметы (например, при изменении регионального коэффициента)"""
+    project = get_object_or_404(Project, pk=pk)
+    
+    # Проверяем права
+    if not (request.user.is_admin_role() or 
+            project.created_by == request.user or 
+            project.foreman == request.user):
+        return JsonResponse({'error': 'Недостаточно прав'}, status=403)
+    
+    estimate = get_object_or_404(ProjectEstimate, project=project)
+    
+    try:
+        data = json.loads(request.body or b'{}')
+        region_factor = data.get('region_factor')
+        if region_factor is not None:
+            region_factor = Decimal(str(region_factor))
+            if region_factor <= 0:
+                return JsonResponse({'error': 'Коэффициент должен быть больше 0'}, status=400)
+        
+        items_count = estimate.reprice(region_factor)
+        
+        return JsonResponse({
+            'success': True,
+            'message': 'Смета пересчитана',
+            'items_count': items_count,
+            'estimate': {
+                'region_factor': str(estimate.region_factor),
+                'labor_amount': str(estimate.labor_amount),
+                'material_amount': str(estimate.material_amount),
+                'equipment_amount': str(estimate.equipment_amount),
+                'total_amount': str(estimate.total_amount)
+            }
+        })
+        
+    except Exception as e:
+        logger.error(f"Error repricing estimate: {e}")
+        return JsonResponse({'error': 'Ошибка пересчета сметы'}, status=500)
+
+
 @login_required
 def project_estimate_detailed(request, pk):
     """Детализированная смета проекта"""
@@ -136,20 +268,18 @@ def project_estimate_detailed(request, pk):
         }
     )
     
-    # Получаем позиции сметы
-    items = estimate.items.all().order_by('position')
-    
-    # Пересчитываем суммы
-    estimate.labor_amount = sum(item.rate.labor_cost * item.quantity for item in items)
-    estimate.material_amount = sum(item.rate.material_cost * item.quantity for item in items)
-    estimate.equipment_amount = sum(item.rate.equipment_cost * item.quantity for item in items)
-    estimate.total_amount = estimate.calculated_total
-    estimate.save()
+    # Получаем позиции сметы (суммы сметы поддерживаются при изменении позиций)
+    items = estimate.items.select_related('rate', 'rate__unit').order_by('position')
     
     # Статистика
-    total_items = items.count()
-    total_quantity = sum(item.quantity for item in items)
-    total_labor_hours = sum(item.rate.labor_hours * item.quantity for item in items)
+    stats = estimate.items.aggregate(
+        total_items=Count('id'),
+        total_quantity=Sum('quantity'),
+        total_labor_hours=Sum(F('rate__labor_hours') * F('quantity'))
+    )
+    total_items = stats['total_items']
+    total_quantity = stats['total_quantity'] or Decimal('0')
+    total_labor_hours = stats['total_labor_hours'] or Decimal('0')
     
     context = {
         'project': project,
@@ -193,7 +323,7 @@ def add_estimate_item(request, pk):
             }
         )
         
-        # Создаем позицию
+        # Создаем позицию (суммы сметы обновляются при сохранении)
         item = ProjectEstimateItem.objects.create(
             estimate=estimate,
             rate_id=data.get('rate_id'),
@@ -203,13 +333,6 @@ def add_estimate_item(request, pk):
             notes=data.get('notes', '')
         )
         
-        # Пересчитываем смету
-        estimate.labor_amount = sum(i.rate.labor_cost * i.quantity for i in estimate.items.all())
-        estimate.material_amount = sum(i.rate.material_cost * i.quantity for i in estimate.items.all())
-        estimate.equipment_amount = sum(i.rate.equipment_cost * i.quantity for i in estimate.items.all())
-        estimate.total_amount = estimate.calculated_total
-        estimate.save()
-        
         return JsonResponse({
             'success': True,
             'message': 'Позиция добавлена в смету',
@@ -242,16 +365,9 @@ def remove_estimate_item(request, pk, item_id):
     
     try:
         item = get_object_or_404(ProjectEstimateItem, pk=item_id, estimate__project=project)
+        # Суммы сметы уменьшаются при удалении позиции
         item.delete()
         
-        # Пересчитываем смету
-        estimate = project.estimate
-        estimate.labor_amount = sum(i.rate.labor_cost * i.quantity for i in estimate.items.all())
-        estimate.material_amount = sum(i.rate.material_cost * i.quantity for i in estimate.items.all())
-        estimate.equipment_amount = sum(i.rate.equipment_cost * i.quantity for i in estimate.items.all())
-        estimate.total_amount = estimate.calculated_total
-        estimate.save()
-        
         return JsonResponse({'success': True, 'message': 'Позиция удалена из сметы'})
         
     except Exception as e:
@@ -273,20 +389,21 @@ def estimate_import(request, pk):
     if request.method == 'POST':
         form = EstimateImportForm(request.POST, request.FILES)
         if form.is_valid():
-            # Создаем запись об импорте
+            # Сохраняем файл и создаем запись об импорте
+            uploaded_file = form.cleaned_data['file']
             import_record = form.save(commit=False)
             import_record.project = project
             import_record.created_by = request.user
-            import_record.file_name = form.cleaned_data['file'].name
+            import_record.file_name = uploaded_file.name
+            import_record.file_path = default_storage.save(
+                f"estimate_imports/{project.pk}/{uploaded_file.name}", uploaded_file
+            )
             import_record.save()
             
-            # TODO: Здесь будет логика обработки файла
-            # Пока просто помечаем как завершенный
-            import_record.status = 'completed'
-            import_record.completed_at = timezone.now()
-            import_record.save()
+            # Файл разбирается в фоне, прогресс виден в записи импорта
+            run_in_background(import_estimate, import_record.pk)
             
-            messages.success(request, 'Смета успешно импортирована')
+            messages.success(request, 'Файл загружен, импорт сметы выполняется в фоне')
             return redirect('projects:estimate_detailed', pk=project.pk)
     else:
         form = EstimateImportForm()
@@ -299,6 +416,26 @@ def estimate_import(request, pk):
     return render(request, 'projects/estimate_import.html', context)
 
 
+@login_required
+def estimate_import_status(request, pk, import_id):
+    """AJAX статус импорта сметы"""
+    project = get_object_or_404(Project, pk=pk)
+    
+    if not project.can_user_access(request.user):
+        return JsonResponse({'error': 'Нет доступа'}, status=403)
+    
+    import_record = get_object_or_404(EstimateImport, pk=import_id, project=project)
+    
+    return JsonResponse({
+        'success': True,
+        'status': import_record.status,
+        'status_display': import_record.get_status_display(),
+        'imported_items': import_record.imported_items,
+        'errors': import_record.errors,
+        'completed_at': import_record.completed_at.isoformat() if import_record.completed_at else None
+    })
+
+
 @login_required
 def estimate_export(request, pk):
     """Экспорт сметы"""
@@ -311,21 +448,39 @@ def estimate_export(request, pk):
     if request.method == 'POST':
         form = EstimateExportForm(request.POST)
         if form.is_valid():
-            # Создаем запись об экспорте
+            estimate = getattr(project, 'estimate', None)
+            if estimate is None:
+                messages.error(request, 'У проекта нет сметы для экспорта')
+                return redirect('projects:estimate_detailed', pk=project.pk)
+            
+            export_format = form.cleaned_data['format']
+            options = {
+                key: form.cleaned_data[key]
+                for key in ('include_items', 'include_calculations', 'include_notes')
+            }
             export_record = EstimateExport.objects.create(
                 project=project,
-                format=form.cleaned_data['format'],
+                format=export_format,
                 created_by=request.user,
-                file_name=f"estimate_{project.name}_{timezone.now().strftime('%Y%m%d_%H%M%S')}"
+                file_name=(
+                    f"estimate_{project.name}_{timezone.now().strftime('%Y%m%d_%H%M%S')}"
+                    f".{EXPORT_EXTENSIONS[export_format]}"
+                )
             )
             
-            # TODO: Здесь будет логика генерации файла
-            # Пока просто помечаем как завершенный
-            export_record.status = 'completed'
-            export_record.completed_at = timezone.now()
-            export_record.save()
+            # Файл для этой версии сметы уже есть - отдаем его без повторной генерации
+            cached_path = find_cached_artifact(estimate, export_format, options)
+            if cached_path:
+                export_record.status = 'completed'
+                export_record.file_path = cached_path
+                export_record.estimate_version = estimate.version
+                export_record.completed_at = timezone.now()
+                export_record.save()
+                return redirect('projects:estimate_export_download', pk=project.pk, export_id=export_record.pk)
             
-            messages.success(request, 'Смета успешно экспортирована')
+            run_in_background(export_estimate, export_record.pk, options)
+            
+            messages.success(request, 'Экспорт сметы выполняется в фоне, файл появится в списке экспортов')
             return redirect('projects:estimate_detailed', pk=project.pk)
     else:
         form = EstimateExportForm()
@@ -338,6 +493,106 @@ def estimate_export(request, pk):
     return render(request, 'projects/estimate_export.html', context)
 
 
+@login_required
+def estimate_export_status(request, pk, export_id):
+    """AJAX статус экспорта сметы"""
+    project = get_object_or_404(Project, pk=pk)
+    
+    if not project.can_user_access(request.user):
+        return JsonResponse({'error': 'Нет доступа'}, status=403)
+    
+    export_record = get_object_or_404(EstimateExport, pk=export_id, project=project)
+    
+    return JsonResponse({
+        'success': True,
+        'status': export_record.status,
+        'status_display': export_record.get_status_display(),
+        'error': export_record.error,
+        'download_url': (
+            reverse('projects:estimate_export_download', args=[project.pk, export_record.pk])
+            if export_record.status == 'completed' else None
+        ),
+        'completed_at': export_record.completed_at.isoformat() if export_record.completed_at else None
+    })
+
+
+@login_required
+def estimate_export_download(request, pk, export_id):
+    """Скачивание файла экспорта сметы"""
+    project = get_object_or_404(Project, pk=pk)
+    
+    if not project.can_user_access(request.user):
+        return HttpResponseForbidden("У вас нет доступа к этому проекту")
+    
+    export_record = get_object_or_404(EstimateExport, pk=export_id, project=project, status='completed')
+    if not export_record.file_path or not default_storage.exists(export_record.file_path):
+        raise Http404("Файл экспорта не найден")
+    
+    return FileResponse(
+        default_storage.open(export_record.file_path, 'rb'),
+        as_attachment=True,
+        filename=export_record.file_name,
+        content_type=EXPORT_CONTENT_TYPES[export_record.format]
+    )
+
+
+@login_required
+@require_http_methods(["GET", "POST"])
+def estimate_versions(request, pk):
+    """AJAX список снимков версий сметы; POST - снимок текущей версии"""
+    project = get_object_or_404(Project, pk=pk)
+    
+    if not project.can_user_access(request.user):
+        return JsonResponse({'error': 'Нет доступа'}, status=403)
+    
+    estimate = get_object_or_404(ProjectEstimate, project=project)
+    
+    if request.method == 'POST':
+        snapshot = capture_snapshot(estimate, request.user)
+        return JsonResponse({'success': True, 'version': snapshot.version})
+    
+    snapshots = estimate.snapshots.select_related('created_by').order_by('-version')
+    
+    return JsonResponse({
+        'success': True,
+        'current_version': estimate.version,
+        'versions': [
+            {
+                'version': snapshot.version,
+                'lines_count': snapshot.lines_count,
+                'total_amount': str(snapshot.total_amount),
+                'created_by': snapshot.created_by.get_full_name() if snapshot.created_by else None,
+                'created_at': snapshot.created_at.isoformat()
+            }
+            for snapshot in snapshots
+        ]
+    })
+
+
+@login_required
+def estimate_versions_diff(request, pk):
+    """AJAX изменения сметы между двумя версиями (?from=3&to=7)"""
+    project = get_object_or_404(Project, pk=pk)
+    
+    if not project.can_user_access(request.user):
+        return JsonResponse({'error': 'Нет доступа'}, status=403)
+    
+    estimate = get_object_or_404(ProjectEstimate, project=project)
+    
+    try:
+        from_version = int(request.GET['from'])
+        to_version = int(request.GET['to'])
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'Укажите версии from и to'}, status=400)
+    
+    try:
+        diff = diff_versions(estimate, from_version, to_version)
+    except EstimateSnapshot.DoesNotExist:
+        return JsonResponse({'error': 'Нет снимка одной из версий'}, status=404)
+    
+    return JsonResponse({'success': True, **diff})
+
+
 @login_required
 def estimate_templates_list(request):
     """Список шаблонов смет"""
@@ -395,30 +650,13 @@ def apply_template_to_project(request, pk, template_id):
             }
         )
         
-        # Очищаем существующие позиции
-        estimate.items.all().delete()
-        
-        # Добавляем позиции из шаблона
-        for template_item in template.items.all():
-            ProjectEstimateItem.objects.create(
-                estimate=estimate,
-                rate=template_item.rate,
-                quantity=template_item.quantity,
-                region_factor=estimate.region_factor,
-                complexity_factor=Decimal('1.00')
-            )
-        
-        # Пересчитываем смету
-        estimate.labor_amount = sum(i.rate.labor_cost * i.quantity for i in estimate.items.all())
-        estimate.material_amount = sum(i.rate.material_cost * i.quantity for i in estimate.items.all())
-        estimate.equipment_amount = sum(i.rate.equipment_cost * i.quantity for i in estimate.items.all())
-        estimate.total_amount = estimate.calculated_total
-        estimate.save()
+        # Заменяем позиции сметы позициями шаблона
+        items_count = estimate.apply_template(template)
         
         return JsonResponse({
             'success': True,
             'message': f'Шаблон "{template.name}" применен к проекту',
-            'items_count': estimate.items.count()
+            'items_count': items_count
         })
         
     except Exception as e:
@@ -0,0 +1,146 @@
+# Журнал расходов проекта: проводки и потраченные суммы проекта и сметы
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Sum
+
+from .models import Project, ProjectEstimate, ProjectLedgerEntry
+
+ZERO = Decimal('0.00')
+
+EntryType = ProjectLedgerEntry.EntryType
+
+
+def post_entry(project_id, amount, entry_type, expense_id=None, description='', warehouse_transaction_id=None):
+    """Добавить проводку и изменить потраченные суммы проекта и сметы на amount
+
+    Суммы меняются через F() в той же транзакции, поэтому одновременные
+    одобрения расходов одного проекта не перезаписывают друг друга, а
+    стоимость не зависит от числа расходов проекта.
+    """
+    if project_id is None or not amount:
+        return None
+    with transaction.atomic():
+        entry = ProjectLedgerEntry.objects.create(
+            project_id=project_id,
+            expense_id=expense_id,
+            warehouse_transaction_id=warehouse_transaction_id,
+            entry_type=entry_type,
+            amount=amount,
+            description=description[:255]
+        )
+        Project.objects.filter(pk=project_id).update(spent_amount=F('spent_amount') + amount)
+        ProjectEstimate.objects.filter(project_id=project_id).update(spent_amount=F('spent_amount') + amount)
+    return entry
+
+
+def post_entries(entries):
+    """Добавить пачку проводок (несохраненные ProjectLedgerEntry) одним bulk_create
+
+    Потраченные суммы меняются одним UPDATE на проект на сумму его
+    проводок. Вызывается внутри транзакции.
+    """
+    entries = [entry for entry in entries if entry.project_id is not None and entry.amount]
+    if not entries:
+        return []
+    totals = {}
+    for entry in entries:
+        entry.description = entry.description[:255]
+        totals[entry.project_id] = totals.get(entry.project_id, ZERO) + entry.amount
+    ProjectLedgerEntry.objects.bulk_create(entries, batch_size=500)
+    for project_id, amount in totals.items():
+        if amount:
+            Project.objects.filter(pk=project_id).update(spent_amount=F('spent_amount') + amount)
+            ProjectEstimate.objects.filter(project_id=project_id).update(spent_amount=F('spent_amount') + amount)
+    return entries
+
+
+def post_expense_change(expense, previous, current):
+    """Провести изменение учтенной суммы расхода
+
+    previous и current - (project_id, сумма) до и после изменения, где
+    сумма - 0 для неодобренного расхода; None - расхода не было или
+    больше нет. Одобрение, отмена одобрения и изменение суммы
+    одобренного расхода дают по одной проводке, перенос одобренного
+    расхода в другой проект - две.
+    """
+    old_project, old_amount = previous or (None, ZERO)
+    new_project, new_amount = current or (None, ZERO)
+    description = expense.title
+
+    if old_project == new_project:
+        delta = new_amount - old_amount
+        if not delta:
+            return
+        if not old_amount:
+            entry_type = EntryType.APPROVAL
+        elif not new_amount:
+            entry_type = EntryType.REVERSAL
+        else:
+            entry_type = EntryType.ADJUSTMENT
+            description = f"{expense.title}: {old_amount} → {new_amount}"
+        post_entry(new_project, delta, entry_type, expense.pk, description)
+        return
+
+    if old_amount:
+        post_entry(old_project, -old_amount, EntryType.REVERSAL, expense.pk, description)
+    if new_amount:
+        post_entry(new_project, new_amount, EntryType.APPROVAL, expense.pk, description)
+
+
+def reconcile(project_ids):
+    """Сверка журнала по проектам
+
+    Возвращает список (проект, сумма одобренных расходов и себестоимости
+    списанных на проект материалов, сумма проводок, потрачено по проекту,
+    потрачено по смете или None) для проектов, где эти суммы расходятся. Каждая сумма считается одним агрегатом на
+    группу проектов.
+    """
+    from kanban.models import ExpenseItem
+    from warehouse.costing import charged_transactions
+    from .variance import APPROVED_STATUS
+
+    project_ids = list(project_ids)
+    approved = dict(
+        ExpenseItem.objects.filter(project_id__in=project_ids, status=APPROVED_STATUS)
+        .values_list('project_id')
+        .annotate(total=Sum('amount'))
+        .order_by()
+    )
+    materials = dict(
+        charged_transactions().filter(project_id__in=project_ids)
+        .values_list('project_id')
+        .annotate(total=Sum('cost_amount'))
+        .order_by()
+    )
+    ledger = dict(
+        ProjectLedgerEntry.objects.filter(project_id__in=project_ids)
+        .values_list('project_id')
+        .annotate(total=Sum('amount'))
+        .order_by()
+    )
+    estimates = dict(
+        ProjectEstimate.objects.filter(project_id__in=project_ids).values_list('project_id', 'spent_amount')
+    )
+
+    mismatches = []
+    for project in Project.objects.filter(pk__in=project_ids).only('pk', 'name', 'spent_amount'):
+        expected = (approved.get(project.pk) or ZERO) + (materials.get(project.pk) or ZERO)
+        posted = ledger.get(project.pk) or ZERO
+        estimate_spent = estimates.get(project.pk)
+        if expected != posted or project.spent_amount != posted or (
+            estimate_spent is not None and estimate_spent != posted
+        ):
+            mismatches.append((project, expected, posted, project.spent_amount, estimate_spent))
+    return mismatches
+
+
+def fix_mismatch(project, expected, posted):
+    """Исправить расхождение: корректирующая проводка и потраченные суммы по журналу"""
+    with transaction.atomic():
+        if expected != posted:
+            post_entry(project.pk, expected - posted, EntryType.CORRECTION, description='Сверка с одобренными расходами и списанием материалов')
+        total = ProjectLedgerEntry.objects.filter(project_id=project.pk).aggregate(total=Sum('amount'))['total'] or ZERO
+        Project.objects.filter(pk=project.pk).update(spent_amount=total)
+        ProjectEstimate.objects.filter(project_id=project.pk).update(spent_amount=total)
+    return total
@@ -0,0 +1,198 @@
+"""
+Загрузка нормативного справочника расценок (ГЭСН, ФЕР) из файла
+Использование:
+    python manage.py load_rate_catalog gesn_2024.xlsx --deactivate-missing --code-prefix "ГЭСН"
+    python manage.py load_rate_catalog fer.csv --dry-run
+"""
+import os
+import time
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from projects.estimate_catalog import CatalogResolver
+from projects.estimate_import import COST_FIELDS, ImportRowError, clean_row, get_reader
+from projects.estimate_models import EstimateCatalogVersion, EstimateRate
+from projects.variance import rebuild_planned_for_rates
+
+# Поля расценки, которые берутся из справочника и сравниваются с базой
+CATALOG_FIELDS = ('name', 'category_id', 'unit_id', 'base_price', *COST_FIELDS, 'is_active')
+
+# Сколько сообщений об ошибках строк выводится
+MAX_REPORTED_ERRORS = 20
+
+
+class CatalogLoader:
+    """Сравнение справочника из файла с расценками в базе по коду
+
+    Существующие расценки читаются одним запросом в словарь по коду,
+    файл читается потоково. Новые расценки добавляются bulk_create,
+    изменившиеся записываются bulk_update, совпадающие строки не
+    порождают ни одного запроса - повторная загрузка той же редакции
+    ничего не пишет в базу.
+    """
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.catalog = CatalogResolver()
+        self.existing = {
+            row[0]: row[1:]
+            for row in EstimateRate.objects.values_list('code', 'pk', *CATALOG_FIELDS).iterator(chunk_size=5000)
+        }
+        self.seen = set()
+        self.to_create = []
+        self.to_update = []
+        # Расценки пакета, у которых сменилась категория: план их смет пересчитывается
+        self.recategorized = []
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.errors = []
+        self.error_count = 0
+
+    def load(self, reader, fileobj):
+        for line, record in reader(fileobj):
+            try:
+                row = clean_row(record)
+            except ImportRowError as e:
+                self.error_count += 1
+                if len(self.errors) < MAX_REPORTED_ERRORS:
+                    self.errors.append(f"Строка {line}: {e}")
+                continue
+            self.add(row)
+        self.flush()
+
+    def add(self, row):
+        code = row['code']
+        if code in self.seen:
+            # Повтор кода в файле: учитывается первая строка
+            return
+        self.seen.add(code)
+
+        values = {
+            'name': row['name'],
+            'category_id': self.catalog.category(row['category']).pk,
+            'unit_id': self.catalog.unit(row['unit']).pk,
+            'base_price': row['price'],
+            'is_active': True,
+        }
+        existing = self.existing.get(code)
+        current = dict(zip(CATALOG_FIELDS, existing[1:])) if existing else {}
+        for field in COST_FIELDS:
+            if row[field] is not None:
+                values[field] = row[field].quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+            elif existing:
+                values[field] = current[field]
+
+        if existing is None:
+            self.to_create.append(EstimateRate(code=code, **values))
+        elif any(current[field] != value for field, value in values.items()):
+            self.to_update.append(EstimateRate(pk=existing[0], code=code, updated_at=timezone.now(), **values))
+            if current['category_id'] != values['category_id']:
+                self.recategorized.append(existing[0])
+        else:
+            self.unchanged += 1
+
+        if len(self.to_create) + len(self.to_update) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.to_create and not self.to_update:
+            return
+        with transaction.atomic():
+            if self.to_create:
+                EstimateRate.objects.bulk_create(self.to_create, batch_size=self.batch_size)
+            if self.to_update:
+                EstimateRate.objects.bulk_update(
+                    self.to_update,
+                    [*CATALOG_FIELDS, 'updated_at'],
+                    batch_size=self.batch_size
+                )
+            EstimateCatalogVersion.bump(EstimateCatalogVersion.RATES)
+            rebuild_planned_for_rates(self.recategorized)
+        self.created += len(self.to_create)
+        self.updated += len(self.to_update)
+        self.to_create = []
+        self.to_update = []
+        self.recategorized = []
+
+    def deactivate_missing(self, code_prefix=''):
+        """Отключить активные расценки, которых нет в файле (с кодом на code_prefix)"""
+        is_active_index = CATALOG_FIELDS.index('is_active') + 1
+        missing = [
+            values[0] for code, values in self.existing.items()
+            if values[is_active_index] and code not in self.seen and code.startswith(code_prefix)
+        ]
+        for start in range(0, len(missing), self.batch_size):
+            EstimateRate.objects.filter(pk__in=missing[start:start + self.batch_size]).update(
+                is_active=False,
+                updated_at=timezone.now()
+            )
+        if missing:
+            EstimateCatalogVersion.bump(EstimateCatalogVersion.RATES)
+        return len(missing)
+
+
+class Command(BaseCommand):
+    help = 'Загрузка справочника расценок из файла (xlsx, csv, xml) с обновлением только изменившихся расценок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='Файл справочника')
+        parser.add_argument(
+            '--deactivate-missing',
+            action='store_true',
+            help='Отключить расценки, которых нет в новой редакции справочника'
+        )
+        parser.add_argument(
+            '--code-prefix',
+            default='',
+            help='Отключать только расценки с кодом на этот префикс (например "ГЭСН")'
+        )
+        parser.add_argument('--batch-size', type=int, default=2000, help='Расценок в одной транзакции')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Сравнить файл с базой и откатить изменения'
+        )
+
+    def handle(self, *args, **options):
+        path = options['file']
+        if not os.path.exists(path):
+            raise CommandError(f'Файл не найден: {path}')
+        try:
+            reader = get_reader(path)
+        except ImportRowError as e:
+            raise CommandError(str(e))
+
+        started_at = time.perf_counter()
+        # Редакция справочника применяется целиком или не применяется совсем
+        with transaction.atomic():
+            loader = CatalogLoader(max(options['batch_size'], 1))
+            with open(path, 'rb') as fileobj:
+                try:
+                    loader.load(reader, fileobj)
+                except ImportRowError as e:
+                    raise CommandError(str(e))
+
+            deactivated = 0
+            if options['deactivate_missing']:
+                deactivated = loader.deactivate_missing(options['code_prefix'])
+
+            if options['dry_run']:
+                transaction.set_rollback(True)
+
+        for error in loader.errors:
+            self.stdout.write(self.style.WARNING(error))
+        if loader.error_count > len(loader.errors):
+            self.stdout.write(self.style.WARNING(f'... и еще {loader.error_count - len(loader.errors)} ошибок'))
+
+        elapsed = time.perf_counter() - started_at
+        prefix = 'Пробный запуск (изменения отменены): ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}добавлено {loader.created}, обновлено {loader.updated}, '
+            f'без изменений {loader.unchanged}, отключено {deactivated}, '
+            f'новых категорий {loader.catalog.created_categories}, единиц {loader.catalog.created_units}, '
+            f'ошибок {loader.error_count} за {elapsed:.1f} с'
+        ))
@@ -0,0 +1,41 @@
+"""
+Пересборка свода план/факт по позициям смет и одобренным расходам
+Использование:
+    python manage.py rebuild_variance_rollups
+    python manage.py rebuild_variance_rollups --project <uuid>
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from projects.estimate_models import EstimateVarianceRollup
+from projects.models import Project
+from projects.variance import rebuild_actual, rebuild_planned
+
+
+class Command(BaseCommand):
+    help = 'Пересборка свода план/факт агрегатом по позициям смет и расходам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', action='append', default=[], help='ID проекта (можно несколько)')
+        parser.add_argument('--chunk-size', type=int, default=100, help='Проектов в одной транзакции')
+
+    def handle(self, *args, **options):
+        projects = Project.objects.order_by('pk')
+        if options['project']:
+            projects = projects.filter(pk__in=options['project'])
+        project_ids = list(projects.values_list('pk', flat=True))
+
+        started_at = time.perf_counter()
+        chunk_size = max(options['chunk_size'], 1)
+        for start in range(0, len(project_ids), chunk_size):
+            chunk = project_ids[start:start + chunk_size]
+            rebuild_planned(chunk)
+            rebuild_actual(chunk)
+            self.stdout.write(f'  {min(start + chunk_size, len(project_ids))}/{len(project_ids)}')
+
+        rows = EstimateVarianceRollup.objects.filter(project_id__in=project_ids).count()
+        elapsed = time.perf_counter() - started_at
+        self.stdout.write(self.style.SUCCESS(
+            f'Свод пересобран: проектов {len(project_ids)}, строк {rows} за {elapsed:.1f} с'
+        ))
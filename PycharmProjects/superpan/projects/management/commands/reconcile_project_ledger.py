@@ -0,0 +1,54 @@
+"""
+Сверка журнала расходов проектов с одобренными расходами, списанием материалов
+со склада и потраченными суммами
+Использование:
+    python manage.py reconcile_project_ledger
+    python manage.py reconcile_project_ledger --project <uuid> --fix
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from projects.ledger import fix_mismatch, reconcile
+from projects.models import Project
+
+
+class Command(BaseCommand):
+    help = 'Сверка журнала расходов: одобренные расходы и материалы, сумма проводок и потраченные суммы проектов и смет'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', action='append', default=[], help='ID проекта (можно несколько)')
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='Добавить корректирующие проводки и выставить потраченные суммы по журналу'
+        )
+        parser.add_argument('--chunk-size', type=int, default=500, help='Проектов в одной проверке')
+
+    def handle(self, *args, **options):
+        projects = Project.objects.order_by('pk')
+        if options['project']:
+            projects = projects.filter(pk__in=options['project'])
+        project_ids = list(projects.values_list('pk', flat=True))
+
+        started_at = time.perf_counter()
+        chunk_size = max(options['chunk_size'], 1)
+        mismatches = []
+        for start in range(0, len(project_ids), chunk_size):
+            mismatches.extend(reconcile(project_ids[start:start + chunk_size]))
+
+        for project, expected, posted, spent, estimate_spent in mismatches:
+            self.stdout.write(self.style.WARNING(
+                f'{project.name} ({project.pk}): одобрено и списано материалов {expected}, проводок {posted}, '
+                f'потрачено по проекту {spent}, по смете {"-" if estimate_spent is None else estimate_spent}'
+            ))
+            if options['fix']:
+                total = fix_mismatch(project, expected, posted)
+                self.stdout.write(f'  исправлено: потрачено {total}')
+
+        elapsed = time.perf_counter() - started_at
+        message = f'Проверено проектов {len(project_ids)}, расхождений {len(mismatches)} за {elapsed:.1f} с'
+        if mismatches and not options['fix']:
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS(message))
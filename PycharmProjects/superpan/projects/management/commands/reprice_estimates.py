@@ -0,0 +1,161 @@
+"""
+Пересчет смет после изменения справочника расценок
+Использование:
+    python manage.py reprice_estimates --index 1.045 --category EARTH --report reprice_q3.csv
+    python manage.py reprice_estimates --rate 01-01-001 --project <uuid> --dry-run
+    python manage.py reprice_estimates --report after_import.csv   # только перенос текущих цен в сметы
+    python manage.py reprice_estimates --index 1.00 --check --dry-run  # SQL-пересчет совпадает с расчетом позиций
+"""
+import csv
+import time
+from contextlib import nullcontext
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+
+from projects.estimate_models import EstimateCategory, EstimateRate
+from projects.estimate_repricing import (
+    TOTAL_FIELDS, affected_estimate_ids, apply_rate_index, check_repriced, reprice_estimates, snapshot_totals
+)
+from projects.models import ProjectEstimate
+
+
+class Command(BaseCommand):
+    help = 'Индексация расценок и пересчет зависящих от них смет пакетными UPDATE'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--index',
+            help='Индекс цен (например 1.045); без него в сметы переносятся текущие цены справочника'
+        )
+        parser.add_argument('--rate', action='append', default=[], help='Код расценки (можно несколько)')
+        parser.add_argument('--category', action='append', default=[], help='Код категории расценок, с подкатегориями (можно несколько)')
+        parser.add_argument('--estimate', action='append', type=int, default=[], help='ID сметы (можно несколько)')
+        parser.add_argument('--project', action='append', default=[], help='ID проекта (можно несколько)')
+        parser.add_argument(
+            '--include-approved',
+            action='store_true',
+            help='Пересчитывать и утвержденные сметы'
+        )
+        parser.add_argument('--chunk-size', type=int, default=500, help='Смет в одной транзакции')
+        parser.add_argument('--report', help='CSV-файл с суммами смет до и после пересчета')
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Сверить пересчитанные позиции и итоги с расчетом estimate_pricing; при расхождении - откат'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Посчитать и записать отчет, но откатить изменения'
+        )
+
+    def handle(self, *args, **options):
+        index = None
+        if options['index']:
+            try:
+                index = Decimal(options['index'])
+            except InvalidOperation:
+                raise CommandError(f"Некорректный индекс: {options['index']}")
+            if index <= 0:
+                raise CommandError('Индекс должен быть больше 0')
+
+        rates = EstimateRate.objects.filter(is_active=True)
+        if options['rate']:
+            rates = rates.filter(code__in=options['rate'])
+        if options['category']:
+            # Категории берутся вместе с подкатегориями
+            paths = EstimateCategory.objects.filter(code__in=options['category']).values_list('path', flat=True)
+            if not paths:
+                raise CommandError('Категории не найдены')
+            subtree = Q()
+            for path in paths:
+                subtree |= Q(category__path__startswith=path)
+            rates = rates.filter(subtree)
+
+        estimates = None
+        if options['estimate'] or options['project']:
+            estimates = ProjectEstimate.objects.all()
+            if options['estimate']:
+                estimates = estimates.filter(pk__in=options['estimate'])
+            if options['project']:
+                estimates = estimates.filter(project_id__in=options['project'])
+
+        started_at = time.perf_counter()
+        report_rows = []
+
+        # Каждая порция смет пересчитывается в своей транзакции; если запуск
+        # прервется, повторный запуск без --index перенесет цены в оставшиеся сметы.
+        # При --dry-run все выполняется в общей транзакции и откатывается
+        with transaction.atomic() if options['dry_run'] else nullcontext():
+            if index is not None:
+                rates_count = apply_rate_index(rates, index)
+                self.stdout.write(f'Проиндексировано расценок: {rates_count} (индекс {index})')
+
+            estimate_ids = affected_estimate_ids(rates, estimates, options['include_approved'])
+            self.stdout.write(f'Смет для пересчета: {len(estimate_ids)}')
+
+            chunk_size = max(options['chunk_size'], 1)
+            items_count = 0
+            for start in range(0, len(estimate_ids), chunk_size):
+                chunk = estimate_ids[start:start + chunk_size]
+                with transaction.atomic():
+                    before = snapshot_totals(chunk)
+                    items_count += reprice_estimates(chunk, rates)
+                    after = snapshot_totals(chunk)
+                    if options['check']:
+                        self.check(chunk, rates)
+                report_rows.extend(self.diff_rows(chunk, before, after))
+                self.stdout.write(f'  {min(start + chunk_size, len(estimate_ids))}/{len(estimate_ids)}')
+
+            if options['dry_run']:
+                transaction.set_rollback(True)
+
+        if options['report']:
+            self.write_report(options['report'], report_rows)
+            self.stdout.write(f"Отчет: {options['report']}")
+
+        changed = sum(1 for row in report_rows if row[-1] != 0)
+        total_delta = sum((row[-1] for row in report_rows), Decimal('0.00'))
+        elapsed = time.perf_counter() - started_at
+        prefix = 'Пробный запуск (изменения отменены): ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}пересчитано позиций {items_count}, смет {len(estimate_ids)}, '
+            f'изменилось {changed}, разница итогов {total_delta} ₽ за {elapsed:.1f} с'
+        ))
+
+    def check(self, estimate_ids, rates):
+        mismatches = check_repriced(estimate_ids, rates)
+        if mismatches:
+            details = '\n'.join(
+                f'  {label}: {field} {stored} вместо {expected}'
+                for label, field, stored, expected in mismatches[:20]
+            )
+            raise CommandError(f'Пересчет расходится с расчетом позиций ({len(mismatches)}):\n{details}')
+
+    def diff_rows(self, estimate_ids, before, after):
+        """Строки отчета: смета, проект, суммы до и после, изменение итога"""
+        rows = []
+        for estimate_id in estimate_ids:
+            old, new = before.get(estimate_id), after.get(estimate_id)
+            if old is None or new is None:
+                continue
+            row = [estimate_id, old[0]]
+            for old_value, new_value in zip(old[1:], new[1:]):
+                row.extend([old_value, new_value])
+            row.append(new[-1] - old[-1])
+            rows.append(row)
+        return rows
+
+    def write_report(self, path, rows):
+        header = ['estimate_id', 'project']
+        for field in TOTAL_FIELDS:
+            header.extend([f'{field}_before', f'{field}_after'])
+        header.append('total_delta')
+
+        with open(path, 'w', newline='', encoding='utf-8') as report:
+            writer = csv.writer(report)
+            writer.writerow(header)
+            writer.writerows(rows)
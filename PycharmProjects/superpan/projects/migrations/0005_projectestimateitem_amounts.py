@@ -0,0 +1,65 @@
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_item_amounts(apps, schema_editor):
+    """Заполнить суммы позиций и пересчитать суммы смет"""
+    ProjectEstimate = apps.get_model('projects', 'ProjectEstimate')
+    ProjectEstimateItem = apps.get_model('projects', 'ProjectEstimateItem')
+    cent = Decimal('0.01')
+
+    batch = []
+    for item in ProjectEstimateItem.objects.select_related('rate').iterator(chunk_size=1000):
+        factor = item.region_factor * item.complexity_factor * item.quantity
+        item.labor_amount = (item.rate.labor_cost * factor).quantize(cent)
+        item.material_amount = (item.rate.material_cost * factor).quantize(cent)
+        item.equipment_amount = (item.rate.equipment_cost * factor).quantize(cent)
+        batch.append(item)
+        if len(batch) == 1000:
+            ProjectEstimateItem.objects.bulk_update(batch, ['labor_amount', 'material_amount', 'equipment_amount'])
+            batch = []
+    if batch:
+        ProjectEstimateItem.objects.bulk_update(batch, ['labor_amount', 'material_amount', 'equipment_amount'])
+
+    for estimate in ProjectEstimate.objects.filter(items__isnull=False).distinct():
+        totals = ProjectEstimateItem.objects.filter(estimate=estimate).aggregate(
+            labor=Sum('labor_amount'),
+            material=Sum('material_amount'),
+            equipment=Sum('equipment_amount')
+        )
+        estimate.labor_amount = totals['labor'] or Decimal('0.00')
+        estimate.material_amount = totals['material'] or Decimal('0.00')
+        estimate.equipment_amount = totals['equipment'] or Decimal('0.00')
+        base = estimate.labor_amount + estimate.material_amount + estimate.equipment_amount
+        overhead = (base * estimate.overhead_percent / 100).quantize(cent)
+        profit = ((base + overhead) * estimate.profit_percent / 100).quantize(cent)
+        estimate.total_amount = (base + overhead + profit).quantize(cent)
+        estimate.save(update_fields=['labor_amount', 'material_amount', 'equipment_amount', 'total_amount'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0004_project_avatar'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='projectestimateitem',
+            name='labor_amount',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12, verbose_name='Стоимость труда'),
+        ),
+        migrations.AddField(
+            model_name='projectestimateitem',
+            name='material_amount',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12, verbose_name='Стоимость материалов'),
+        ),
+        migrations.AddField(
+            model_name='projectestimateitem',
+            name='equipment_amount',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12, verbose_name='Стоимость оборудования'),
+        ),
+        migrations.RunPython(backfill_item_amounts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0005_projectestimateitem_amounts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='estimateexport',
+            name='estimate_version',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Версия сметы'),
+        ),
+        migrations.AddField(
+            model_name='estimateexport',
+            name='error',
+            field=models.TextField(blank=True, verbose_name='Ошибка'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('projects', '0006_estimateexport_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstimateSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(verbose_name='Версия сметы')),
+                ('is_keyframe', models.BooleanField(default=False, verbose_name='Опорный снимок')),
+                ('lines', models.JSONField(default=list, verbose_name='Позиции')),
+                ('removed', models.JSONField(default=list, verbose_name='Удаленные позиции')),
+                ('lines_count', models.PositiveIntegerField(default=0, verbose_name='Позиций в смете')),
+                ('total_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12, verbose_name='Общая сумма сметы')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создан')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='estimate_snapshots', to=settings.AUTH_USER_MODEL, verbose_name='Создал')),
+                ('estimate', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='projects.projectestimate', verbose_name='Смета')),
+            ],
+            options={
+                'verbose_name': 'Снимок сметы',
+                'verbose_name_plural': 'Снимки смет',
+                'db_table': 'estimate_snapshots',
+                'ordering': ['estimate', 'version'],
+                'unique_together': {('estimate', 'version')},
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+from django.db import migrations, models
+
+PATH_SEGMENT_LENGTH = 10
+
+
+def fill_category_paths(apps, schema_editor):
+    """Заполнить пути категорий обходом дерева от корней"""
+    EstimateCategory = apps.get_model('projects', 'EstimateCategory')
+    children = {}
+    for category in EstimateCategory.objects.all():
+        children.setdefault(category.parent_id, []).append(category)
+
+    updated = []
+    stack = [(category, '') for category in children.get(None, [])]
+    while stack:
+        category, parent_path = stack.pop()
+        category.path = f"{parent_path}{category.pk:0{PATH_SEGMENT_LENGTH}d}/"
+        category.depth = category.path.count('/') - 1
+        updated.append(category)
+        stack.extend((child, category.path) for child in children.get(category.pk, []))
+
+    EstimateCategory.objects.bulk_update(updated, ['path', 'depth'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0007_estimatesnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstimateCatalogVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='Справочник')),
+                ('version', models.PositiveBigIntegerField(default=0, verbose_name='Версия')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлена')),
+            ],
+            options={
+                'verbose_name': 'Версия справочника',
+                'verbose_name_plural': 'Версии справочников',
+                'db_table': 'estimate_catalog_versions',
+            },
+        ),
+        migrations.AddField(
+            model_name='estimatecategory',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255, verbose_name='Путь в дереве'),
+        ),
+        migrations.AddField(
+            model_name='estimatecategory',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='Уровень вложенности'),
+        ),
+        migrations.RunPython(fill_category_paths, migrations.RunPython.noop),
+    ]
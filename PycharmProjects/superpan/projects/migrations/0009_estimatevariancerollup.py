@@ -0,0 +1,33 @@
+from django.db import migrations, models
+import django.db.models.deletion
+from decimal import Decimal
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0008_estimatecategory_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstimateVarianceRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(verbose_name='Месяц')),
+                ('planned_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14, verbose_name='План')),
+                ('actual_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14, verbose_name='Факт')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлен')),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='variance_rollups', to='projects.estimatecategory', verbose_name='Категория работ')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variance_rollups', to='projects.project', verbose_name='Проект')),
+            ],
+            options={
+                'verbose_name': 'Свод план/факт',
+                'verbose_name_plural': 'Своды план/факт',
+                'db_table': 'estimate_variance_rollups',
+                'ordering': ['project', 'month', 'category'],
+                'indexes': [models.Index(fields=['month', 'category'], name='variance_month_category_idx')],
+                'unique_together': {('project', 'category', 'month')},
+            },
+        ),
+    ]
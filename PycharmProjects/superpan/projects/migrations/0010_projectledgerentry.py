@@ -0,0 +1,68 @@
+from django.db import migrations, models
+from django.db.models import Sum
+import django.db.models.deletion
+
+
+def open_ledger(apps, schema_editor):
+    """Начальные проводки по одобренным расходам и потраченные суммы по ним
+
+    Прежний пересчет складывал планируемые часы вместо сумм, поэтому
+    потраченные суммы проектов и смет перезаписываются суммами проводок.
+    """
+    ExpenseItem = apps.get_model('kanban', 'ExpenseItem')
+    Project = apps.get_model('projects', 'Project')
+    ProjectEstimate = apps.get_model('projects', 'ProjectEstimate')
+    ProjectLedgerEntry = apps.get_model('projects', 'ProjectLedgerEntry')
+
+    entries = [
+        ProjectLedgerEntry(
+            project_id=project_id,
+            expense_id=expense_id,
+            entry_type='opening',
+            amount=amount,
+            description=title[:255]
+        )
+        for expense_id, project_id, amount, title in ExpenseItem.objects.filter(
+            status='approved', amount__gt=0
+        ).values_list('id', 'project_id', 'amount', 'title').iterator()
+    ]
+    ProjectLedgerEntry.objects.bulk_create(entries, batch_size=500)
+
+    totals = dict(
+        ProjectLedgerEntry.objects.values_list('project_id').annotate(total=Sum('amount')).order_by()
+    )
+    for project in Project.objects.only('id', 'spent_amount'):
+        total = totals.get(project.pk) or 0
+        Project.objects.filter(pk=project.pk).update(spent_amount=total)
+        ProjectEstimate.objects.filter(project_id=project.pk).update(spent_amount=total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0009_estimatevariancerollup'),
+        ('kanban', '0010_expenseitem_estimate_category'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectLedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_type', models.CharField(choices=[('opening', 'Начальный остаток'), ('approval', 'Одобрение расхода'), ('reversal', 'Отмена одобрения'), ('adjustment', 'Изменение суммы'), ('correction', 'Корректировка сверки')], max_length=20, verbose_name='Тип проводки')),
+                ('amount', models.DecimalField(decimal_places=2, help_text='Положительная - расход учтен, отрицательная - снят', max_digits=12, verbose_name='Сумма')),
+                ('description', models.CharField(blank=True, max_length=255, verbose_name='Описание')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создана')),
+                ('expense', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='kanban.expenseitem', verbose_name='Расход')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='projects.project', verbose_name='Проект')),
+            ],
+            options={
+                'verbose_name': 'Проводка по проекту',
+                'verbose_name_plural': 'Журнал расходов проектов',
+                'db_table': 'project_ledger_entries',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['project', '-created_at'], name='ledger_project_created_idx')],
+            },
+        ),
+        migrations.RunPython(open_ledger, migrations.RunPython.noop),
+    ]
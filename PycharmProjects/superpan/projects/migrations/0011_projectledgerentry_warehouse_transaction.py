@@ -0,0 +1,23 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0010_projectledgerentry'),
+        ('warehouse', '0005_stocklot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='projectledgerentry',
+            name='warehouse_transaction',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='warehouse.warehousetransaction', verbose_name='Операция склада'),
+        ),
+        migrations.AlterField(
+            model_name='projectledgerentry',
+            name='entry_type',
+            field=models.CharField(choices=[('opening', 'Начальный остаток'), ('approval', 'Одобрение расхода'), ('reversal', 'Отмена одобрения'), ('adjustment', 'Изменение суммы'), ('correction', 'Корректировка сверки'), ('materials', 'Списание материалов со склада')], max_length=20, verbose_name='Тип проводки'),
+        ),
+    ]
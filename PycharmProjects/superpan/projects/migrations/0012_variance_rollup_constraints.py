@@ -0,0 +1,46 @@
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def merge_uncategorized_duplicates(apps, schema_editor):
+    """Слить строки свода без категории, созданные дважды за один месяц проекта"""
+    Rollup = apps.get_model('projects', 'EstimateVarianceRollup')
+    duplicates = (
+        Rollup.objects.filter(category__isnull=True)
+        .values('project_id', 'month')
+        .annotate(rows=Count('id'), planned=Sum('planned_amount'), actual=Sum('actual_amount'))
+        .filter(rows__gt=1)
+        .order_by()
+    )
+    for duplicate in duplicates:
+        rows = Rollup.objects.filter(
+            category__isnull=True, project_id=duplicate['project_id'], month=duplicate['month']
+        ).order_by('id')
+        keep = rows.first()
+        rows.exclude(pk=keep.pk).delete()
+        Rollup.objects.filter(pk=keep.pk).update(
+            planned_amount=duplicate['planned'], actual_amount=duplicate['actual']
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0011_projectledgerentry_warehouse_transaction'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_uncategorized_duplicates, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='estimatevariancerollup',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='estimatevariancerollup',
+            constraint=models.UniqueConstraint(fields=('project', 'category', 'month'), name='variance_project_category_month_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='estimatevariancerollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('category__isnull', True)), fields=('project', 'month'), name='variance_project_month_no_category_uniq'),
+        ),
+    ]
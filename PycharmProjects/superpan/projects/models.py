@@ -1,10 +1,19 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Sum
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import MinValueValidator
-from decimal import Decimal
+from decimal import ROUND_HALF_UP, Decimal
 import uuid
 
 
+def _fields_except_spent_amount(instance):
+    """Все поля модели, кроме потраченной суммы, которую ведет журнал расходов"""
+    return [
+        field.name for field in instance._meta.concrete_fields
+        if not field.primary_key and field.name != 'spent_amount'
+    ]
+
+
 class Project(models.Model):
     """Модель строительного проекта"""
     
@@ -74,6 +83,17 @@ class Project(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        """Полное сохранение не перезаписывает потраченную сумму
+        
+        spent_amount меняется только проводками журнала (projects.ledger)
+        через F(), поэтому устаревшее значение в памяти не должно попасть
+        в базу при сохранении формы проекта.
+        """
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = _fields_except_spent_amount(self)
+        super().save(*args, **kwargs)
+
     @property
     def remaining_budget(self):
         """Оставшийся бюджет"""
@@ -110,19 +130,6 @@ class Project(models.Model):
             is_active=True
         ).exists()
 
-    def update_spent_amount(self):
-        """Обновить потраченную сумму на основе расходов"""
-        from kanban.models import ExpenseItem
-        
-        total_spent = ExpenseItem.objects.filter(
-            project=self,
-            status='approved'
-        ).aggregate(
-            total=models.Sum('estimated_hours')
-        )['total'] or Decimal('0.00')
-        
-        self.spent_amount = total_spent
-        self.save(update_fields=['spent_amount'])
 
 
 class ProjectMember(models.Model):
@@ -361,6 +368,9 @@ class ProjectEstimate(models.Model):
     updated_at = models.DateTimeField(_('Обновлена'), auto_now=True)
     is_active = models.BooleanField(_('Активна'), default=True)
 
+    # Суммы, которые ведут позиции сметы (apply_amounts_delta, set_totals)
+    AMOUNT_FIELDS = ('labor_amount', 'material_amount', 'equipment_amount', 'total_amount')
+
     class Meta:
         verbose_name = _('Смета проекта')
         verbose_name_plural = _('Сметы проектов')
@@ -369,6 +379,47 @@ class ProjectEstimate(models.Model):
     def __str__(self):
         return f"Смета проекта {self.project.name}"
 
+    def save(self, *args, **kwargs):
+        """Полное сохранение сметы (изменение параметров расчета) увеличивает версию
+        
+        Потраченная сумма при этом не перезаписывается: ее меняют только
+        проводки журнала (projects.ledger). Суммы по труду, материалам и
+        оборудованию тоже не перезаписываются копией из памяти - их ведут
+        позиции; общая сумма пересчитывается от сумм в базе под блокировкой
+        строки (могли измениться проценты накладных и прибыли). Новая смета
+        получает потраченную сумму проекта. Новая версия сразу получает снимок.
+        """
+        from .estimate_snapshots import record_change
+        
+        full_save = not self._state.adding and not kwargs.get('update_fields')
+        new_version = self._state.adding or full_save
+        if self._state.adding:
+            self.spent_amount = (
+                Project.objects.filter(pk=self.project_id).values_list('spent_amount', flat=True).first()
+                or Decimal('0.00')
+            )
+        elif not kwargs.get('update_fields'):
+            # Версия увеличивается в базе: позиции могли уже поднять ее через F()
+            self.version = F('version') + 1
+            kwargs['update_fields'] = [
+                name for name in _fields_except_spent_amount(self) if name not in self.AMOUNT_FIELDS
+            ]
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if full_save:
+                self.refresh_from_db(fields=['version'])
+                amounts = (
+                    type(self).objects.select_for_update()
+                    .filter(pk=self.pk)
+                    .values_list(*self.AMOUNT_FIELDS)
+                    .get()
+                )
+                for name, value in zip(self.AMOUNT_FIELDS, amounts):
+                    setattr(self, name, value)
+                self.update_total_amount()
+            if new_version:
+                record_change(self)
+
     @property
     def remaining_amount(self):
         """Оставшаяся сумма"""
@@ -385,30 +436,225 @@ class ProjectEstimate(models.Model):
     def overhead_amount(self):
         """Сумма накладных расходов"""
         base_amount = self.labor_amount + self.material_amount + self.equipment_amount
-        return (base_amount * self.overhead_percent / 100).quantize(Decimal('0.01'))
+        return (base_amount * self.overhead_percent / 100).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
     
     @property
     def profit_amount(self):
         """Сумма прибыли"""
         base_amount = self.labor_amount + self.material_amount + self.equipment_amount + self.overhead_amount
-        return (base_amount * self.profit_percent / 100).quantize(Decimal('0.01'))
+        return (base_amount * self.profit_percent / 100).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
     
     @property
     def calculated_total(self):
         """Рассчитанная общая сумма"""
         return (self.labor_amount + self.material_amount + self.equipment_amount + 
-                self.overhead_amount + self.profit_amount).quantize(Decimal('0.01'))
-
-    def update_spent_amount(self):
-        """Обновить потраченную сумму на основе одобренных расходов"""
-        from kanban.models import ExpenseItem
+                self.overhead_amount + self.profit_amount).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    
+    @classmethod
+    def apply_amounts_delta(cls, estimate_id, labor, material, equipment):
+        """Прибавить к суммам сметы изменение по одной позиции
         
-        total_spent = ExpenseItem.objects.filter(
-            project=self.project,
-            status='approved'
-        ).aggregate(
-            total=models.Sum('estimated_hours')
-        )['total'] or Decimal('0.00')
+        Суммы меняются через F() прямо в базе, поэтому стоимость не зависит
+        от числа позиций в смете. Вызывается внутри транзакции сохранения
+        или удаления позиции. Версия сметы увеличивается при каждом вызове:
+        по ней различаются выгрузки разного содержимого (см. estimate_export).
+        Возвращает смету с новой версией для снимка изменения.
+        """
+        with transaction.atomic():
+            cls.objects.filter(pk=estimate_id).update(
+                labor_amount=F('labor_amount') + labor,
+                material_amount=F('material_amount') + material,
+                equipment_amount=F('equipment_amount') + equipment,
+                version=F('version') + 1
+            )
+            estimate = cls.objects.select_for_update().filter(pk=estimate_id).first()
+            if estimate:
+                estimate.update_total_amount()
+        return estimate
+    
+    def rebuild_totals(self):
+        """Полный пересчет сумм сметы агрегатом по позициям в базе"""
+        with transaction.atomic():
+            totals = self.items.aggregate(
+                labor=Sum('labor_amount'),
+                material=Sum('material_amount'),
+                equipment=Sum('equipment_amount')
+            )
+            self.set_totals(
+                totals['labor'] or Decimal('0.00'),
+                totals['material'] or Decimal('0.00'),
+                totals['equipment'] or Decimal('0.00')
+            )
+    
+    def set_totals(self, labor, material, equipment):
+        """Записать суммы по труду, материалам, оборудованию и общую сумму одним UPDATE
+        
+        Вызывается после массовых изменений позиций, поэтому здесь же
+        пересобирается план проекта в своде план/факт и записывается
+        снимок новой версии.
+        """
+        from .estimate_snapshots import capture_snapshot
+        from .variance import rebuild_planned
+        
+        self.labor_amount = labor
+        self.material_amount = material
+        self.equipment_amount = equipment
+        self.total_amount = self.calculated_total
+        self.version = F('version') + 1
+        self.save(update_fields=[
+            'labor_amount', 'material_amount', 'equipment_amount', 'total_amount', 'version', 'updated_at'
+        ])
+        self.refresh_from_db(fields=['version'])
+        capture_snapshot(self)
+        rebuild_planned([self.project_id])
+    
+    def apply_template(self, template, complexity_factor=Decimal('1.00')):
+        """Заменить позиции сметы позициями шаблона
+        
+        Расценки загружаются одним запросом, цены считаются в памяти (один
+        раз на расценку), позиции вставляются через bulk_create, а суммы
+        сметы записываются одним обновлением в той же транзакции.
+        Возвращает число созданных позиций.
+        """
+        from .estimate_models import ProjectEstimateItem
+        from .estimate_pricing import price_lines, sum_lines
+        
+        template_items = list(
+            template.items.order_by('position').values_list('rate_id', 'quantity', 'position')
+        )
+        priced = price_lines(
+            (rate_id, quantity, self.region_factor, complexity_factor)
+            for rate_id, quantity, _ in template_items
+        )
+        
+        items = []
+        for (rate_id, quantity, position), line in zip(template_items, priced):
+            item = ProjectEstimateItem(
+                estimate=self,
+                rate_id=rate_id,
+                quantity=quantity,
+                position=position,
+                region_factor=self.region_factor,
+                complexity_factor=complexity_factor
+            )
+            item.apply_priced(line)
+            items.append(item)
+        totals = sum_lines(priced)
+        
+        with transaction.atomic():
+            # Удаление одним запросом: суммы сметы перезаписываются ниже
+            self.items.all().delete()
+            ProjectEstimateItem.objects.bulk_create(items, batch_size=500)
+            self.set_totals(totals['labor_amount'], totals['material_amount'], totals['equipment_amount'])
+        
+        return len(items)
+    
+    def reprice(self, region_factor=None):
+        """Пересчитать все позиции сметы по текущим расценкам
+        
+        Используется при изменении регионального коэффициента: позиции
+        получают коэффициент сметы, цены считаются пакетно
+        (estimate_pricing.price_lines), позиции записываются bulk_update,
+        суммы сметы - одним обновлением. Возвращает число позиций.
+        """
+        from .estimate_models import ProjectEstimateItem
+        from .estimate_pricing import price_lines, sum_lines
+        
+        with transaction.atomic():
+            if region_factor is not None and region_factor != self.region_factor:
+                self.region_factor = region_factor
+                self.save(update_fields=['region_factor', 'updated_at'])
+            
+            items = list(self.items.select_related('rate').select_for_update(of=('self',)))
+            priced = price_lines(
+                ((item.rate_id, item.quantity, self.region_factor, item.complexity_factor) for item in items),
+                rates={item.rate_id: item.rate for item in items}
+            )
+            for item, line in zip(items, priced):
+                item.region_factor = self.region_factor
+                item.apply_priced(line)
+            
+            ProjectEstimateItem.objects.bulk_update(
+                items,
+                ['region_factor', 'unit_price', 'total_price'] + list(ProjectEstimateItem.AMOUNT_FIELDS),
+                batch_size=500
+            )
+            totals = sum_lines(priced)
+            self.set_totals(totals['labor_amount'], totals['material_amount'], totals['equipment_amount'])
         
-        self.spent_amount = total_spent
-        self.save(update_fields=['spent_amount'])
\ No newline at end of file
+        return len(items)
+    
+    def update_total_amount(self):
+        """Пересчитать общую сумму из сумм по труду, материалам и оборудованию"""
+        total = self.calculated_total
+        if total != self.total_amount:
+            self.total_amount = total
+            self.save(update_fields=['total_amount', 'updated_at'])
+
+
+class ProjectLedgerEntry(models.Model):
+    """Проводка журнала расходов проекта
+    
+    Каждое одобрение, отмена одобрения (отклонение) или изменение суммы
+    одобренного расхода, а также списание материалов со склада на проект
+    по себестоимости FIFO добавляет проводку и в той же транзакции меняет
+    потраченную сумму проекта и сметы на сумму проводки через F().
+    Сумма проводок проекта равна его потраченной сумме
+    (проверка - команда reconcile_project_ledger).
+    """
+    
+    class EntryType(models.TextChoices):
+        OPENING = 'opening', _('Начальный остаток')
+        APPROVAL = 'approval', _('Одобрение расхода')
+        REVERSAL = 'reversal', _('Отмена одобрения')
+        ADJUSTMENT = 'adjustment', _('Изменение суммы')
+        CORRECTION = 'correction', _('Корректировка сверки')
+        MATERIALS = 'materials', _('Списание материалов со склада')
+    
+    project = models.ForeignKey(
+        Project,
+        on_delete=models.CASCADE,
+        verbose_name=_('Проект'),
+        related_name='ledger_entries'
+    )
+    expense = models.ForeignKey(
+        'kanban.ExpenseItem',
+        on_delete=models.SET_NULL,
+        verbose_name=_('Расход'),
+        related_name='ledger_entries',
+        null=True,
+        blank=True
+    )
+    warehouse_transaction = models.ForeignKey(
+        'warehouse.WarehouseTransaction',
+        on_delete=models.SET_NULL,
+        verbose_name=_('Операция склада'),
+        related_name='ledger_entries',
+        null=True,
+        blank=True
+    )
+    entry_type = models.CharField(
+        _('Тип проводки'),
+        max_length=20,
+        choices=EntryType.choices
+    )
+    amount = models.DecimalField(
+        _('Сумма'),
+        max_digits=12,
+        decimal_places=2,
+        help_text=_('Положительная - расход учтен, отрицательная - снят')
+    )
+    description = models.CharField(_('Описание'), max_length=255, blank=True)
+    created_at = models.DateTimeField(_('Создана'), auto_now_add=True)
+    
+    class Meta:
+        verbose_name = _('Проводка по проекту')
+        verbose_name_plural = _('Журнал расходов проектов')
+        db_table = 'project_ledger_entries'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['project', '-created_at'], name='ledger_project_created_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.project.name}: {self.get_entry_type_display()} {self.amount}"
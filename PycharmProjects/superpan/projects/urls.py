@@ -22,13 +22,21 @@ urlpatterns = [
     
     # Сметы и расценки
     path('estimates/rates/', estimate_views.estimate_rates_list, name='estimate_rates_list'),
+    path('estimates/rates/autocomplete/', estimate_views.estimate_rates_autocomplete, name='estimate_rates_autocomplete'),
     path('estimates/rates/<int:pk>/', estimate_views.estimate_rate_detail, name='estimate_rate_detail'),
     path('estimates/calculate/', estimate_views.calculate_estimate_cost, name='calculate_estimate_cost'),
+    path('estimates/calculate/batch/', estimate_views.calculate_estimate_cost_batch, name='calculate_estimate_cost_batch'),
     path('<uuid:pk>/estimate/detailed/', estimate_views.project_estimate_detailed, name='estimate_detailed'),
     path('<uuid:pk>/estimate/add-item/', estimate_views.add_estimate_item, name='add_estimate_item'),
     path('<uuid:pk>/estimate/remove-item/<int:item_id>/', estimate_views.remove_estimate_item, name='remove_estimate_item'),
+    path('<uuid:pk>/estimate/reprice/', estimate_views.reprice_estimate, name='reprice_estimate'),
+    path('<uuid:pk>/estimate/versions/', estimate_views.estimate_versions, name='estimate_versions'),
+    path('<uuid:pk>/estimate/versions/diff/', estimate_views.estimate_versions_diff, name='estimate_versions_diff'),
     path('<uuid:pk>/estimate/import/', estimate_views.estimate_import, name='estimate_import'),
+    path('<uuid:pk>/estimate/import/<int:import_id>/status/', estimate_views.estimate_import_status, name='estimate_import_status'),
     path('<uuid:pk>/estimate/export/', estimate_views.estimate_export, name='estimate_export'),
+    path('<uuid:pk>/estimate/export/<int:export_id>/status/', estimate_views.estimate_export_status, name='estimate_export_status'),
+    path('<uuid:pk>/estimate/export/<int:export_id>/download/', estimate_views.estimate_export_download, name='estimate_export_download'),
     
     # Шаблоны смет
     path('estimates/templates/', estimate_views.estimate_templates_list, name='estimate_templates_list'),
@@ -0,0 +1,187 @@
+# Свод план/факт: плановые суммы позиций смет и одобренные расходы
+# по проекту, категории сметных работ и месяцу
+from datetime import date
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import DateField, F, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .estimate_models import EstimateRate, EstimateVarianceRollup, ProjectEstimateItem
+from .models import ProjectEstimate
+
+ZERO = Decimal('0.00')
+
+# Статус расхода, сумма которого входит в факт
+APPROVED_STATUS = 'approved'
+
+
+def month_start(value):
+    """Первое число месяца даты или времени (время - в текущем часовом поясе)"""
+    if hasattr(value, 'hour') and timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return date(value.year, value.month, 1)
+
+
+def apply_delta(project_id, category_id, month, planned=ZERO, actual=ZERO):
+    """Прибавить разницу плана и факта к строке свода (строка создается при первом изменении)
+
+    Суммы меняются через F() в базе, поэтому одновременные изменения
+    разных позиций и расходов не теряются. Вызывается внутри транзакции
+    сохранения позиции или расхода.
+    """
+    if project_id is None or (not planned and not actual):
+        return
+    changes = {
+        'planned_amount': F('planned_amount') + planned,
+        'actual_amount': F('actual_amount') + actual,
+        'updated_at': timezone.now(),
+    }
+    rollup_id = (
+        EstimateVarianceRollup.objects
+        .filter(project_id=project_id, category_id=category_id, month=month)
+        .values_list('pk', flat=True)
+        .first()
+    )
+    if rollup_id is not None:
+        EstimateVarianceRollup.objects.filter(pk=rollup_id).update(**changes)
+        return
+    try:
+        with transaction.atomic():
+            EstimateVarianceRollup.objects.create(
+                project_id=project_id,
+                category_id=category_id,
+                month=month,
+                planned_amount=planned,
+                actual_amount=actual
+            )
+    except IntegrityError:
+        # Строку только что создал параллельный запрос
+        EstimateVarianceRollup.objects.filter(
+            project_id=project_id, category_id=category_id, month=month
+        ).update(**changes)
+
+
+def _planned_key(estimate_id, rate_id, created_at):
+    project_id = ProjectEstimate.objects.filter(pk=estimate_id).values_list('project_id', flat=True).first()
+    category_id = EstimateRate.objects.filter(pk=rate_id).values_list('category_id', flat=True).first()
+    return project_id, category_id, month_start(created_at)
+
+
+def move_planned(previous, current):
+    """Учесть в своде изменение позиции сметы
+
+    previous и current - (estimate_id, rate_id, total_price, created_at)
+    до и после изменения; None - позиции не было (добавление) или больше
+    нет (удаление).
+    """
+    if previous and current and previous[:2] == current[:2] and previous[3] == current[3]:
+        apply_delta(*_planned_key(current[0], current[1], current[3]), planned=current[2] - previous[2])
+        return
+    if previous:
+        apply_delta(*_planned_key(previous[0], previous[1], previous[3]), planned=-previous[2])
+    if current:
+        apply_delta(*_planned_key(current[0], current[1], current[3]), planned=current[2])
+
+
+def move_actual(previous, current):
+    """Учесть в своде изменение расхода
+
+    previous и current - (project_id, estimate_category_id, сумма, created_at),
+    где сумма - 0 для неодобренного расхода; None - расхода не было или
+    больше нет.
+    """
+    if previous and current and previous[:2] == current[:2] and previous[3] == current[3]:
+        apply_delta(current[0], current[1], month_start(current[3]), actual=current[2] - previous[2])
+        return
+    if previous:
+        apply_delta(previous[0], previous[1], month_start(previous[3]), actual=-previous[2])
+    if current:
+        apply_delta(current[0], current[1], month_start(current[3]), actual=current[2])
+
+
+def _replace_amounts(project_ids, field, totals):
+    """Записать пересчитанные суммы поля field для проектов, удалить пустые строки"""
+    now = timezone.now()
+    to_update = []
+    for rollup in EstimateVarianceRollup.objects.select_for_update().filter(project_id__in=project_ids):
+        amount = totals.pop((rollup.project_id, rollup.category_id, rollup.month), ZERO)
+        if getattr(rollup, field) != amount:
+            setattr(rollup, field, amount)
+            rollup.updated_at = now
+            to_update.append(rollup)
+
+    EstimateVarianceRollup.objects.bulk_update(to_update, [field, 'updated_at'], batch_size=500)
+    EstimateVarianceRollup.objects.bulk_create(
+        [
+            EstimateVarianceRollup(project_id=project_id, category_id=category_id, month=month, **{field: amount})
+            for (project_id, category_id, month), amount in totals.items()
+            if amount
+        ],
+        batch_size=500
+    )
+    EstimateVarianceRollup.objects.filter(
+        project_id__in=project_ids, planned_amount=0, actual_amount=0
+    ).delete()
+
+
+def _month_totals(queryset, project_field, category_field, amount_field):
+    rows = (
+        queryset
+        .annotate(month=TruncMonth('created_at', output_field=DateField()))
+        .values_list(project_field, category_field, 'month')
+        .annotate(total=Sum(amount_field))
+        .order_by()
+    )
+    return {(project_id, category_id, month): total or ZERO for project_id, category_id, month, total in rows}
+
+
+def rebuild_planned(project_ids):
+    """Пересчитать план проектов агрегатом по позициям смет
+
+    Для массовых изменений позиций (шаблон, импорт, пересчет смет), при
+    которых save() отдельных позиций не вызывается.
+    """
+    project_ids = list(project_ids)
+    if not project_ids:
+        return
+    with transaction.atomic():
+        totals = _month_totals(
+            ProjectEstimateItem.objects.filter(estimate__project_id__in=project_ids),
+            'estimate__project_id', 'rate__category_id', 'total_price'
+        )
+        _replace_amounts(project_ids, 'planned_amount', totals)
+
+
+def rebuild_planned_for_rates(rate_ids):
+    """Пересчитать план проектов, в сметах которых есть позиции по расценкам
+
+    План сводится по категории расценки позиции, поэтому смена категории
+    расценки переносит суммы ее позиций между разделами свода.
+    """
+    rate_ids = list(rate_ids)
+    if not rate_ids:
+        return
+    project_ids = (
+        ProjectEstimateItem.objects
+        .filter(rate_id__in=rate_ids)
+        .values_list('estimate__project_id', flat=True)
+        .distinct()
+    )
+    rebuild_planned(project_ids)
+
+
+def rebuild_actual(project_ids):
+    """Пересчитать факт проектов агрегатом по одобренным расходам"""
+    from kanban.models import ExpenseItem
+
+    project_ids = list(project_ids)
+    if not project_ids:
+        return
+    with transaction.atomic():
+        totals = _month_totals(
+            ExpenseItem.objects.filter(project_id__in=project_ids, status=APPROVED_STATUS),
+            'project_id', 'estimate_category_id', 'amount'
+        )
+        _replace_amounts(project_ids, 'actual_amount', totals)
@@ -324,9 +324,6 @@ def project_estimate(request, pk):
         }
     )
     
-    # Обновляем потраченную сумму
-    estimate.update_spent_amount()
-    
     # Получаем расходы проекта
     from kanban.models import ExpenseItem
     expenses = ExpenseItem.objects.filter(
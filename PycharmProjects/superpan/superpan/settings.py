@@ -102,6 +102,7 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '60')),  # Повторное использование соединений (сек.)
     }
 }
 
@@ -146,6 +147,14 @@ CSRF_TRUSTED_ORIGINS = [
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', '8367784150:AAF7m6ZWW9BcoV17YOqnkLp1ScPmYpssy_E')
 TELEGRAM_BOT_USERNAME = os.getenv('TELEGRAM_BOT_USERNAME', 'projectpanell_bot').replace('@', '')
 TELEGRAM_WEBHOOK_URL = os.getenv('TELEGRAM_WEBHOOK_URL', '')
+TELEGRAM_WEBHOOK_LISTEN = os.getenv('TELEGRAM_WEBHOOK_LISTEN', '0.0.0.0')
+TELEGRAM_WEBHOOK_PORT = int(os.getenv('TELEGRAM_WEBHOOK_PORT', '8443'))
+TELEGRAM_WEBHOOK_SECRET = os.getenv('TELEGRAM_WEBHOOK_SECRET', '')
+TELEGRAM_BOT_WORKERS = int(os.getenv('TELEGRAM_BOT_WORKERS', '8'))  # Параллельно обрабатываемые чаты
+TELEGRAM_UPDATE_QUEUE_SIZE = int(os.getenv('TELEGRAM_UPDATE_QUEUE_SIZE', '256'))  # Лимит очереди обновлений
+TELEGRAM_BOT_DB_WORKERS = int(os.getenv('TELEGRAM_BOT_DB_WORKERS', '4'))  # Потоки (соединения) для запросов бота к БД
+TELEGRAM_MEDIA_WORKERS = int(os.getenv('TELEGRAM_MEDIA_WORKERS', '2'))  # Потоки сохранения файлов и миниатюр бота
+TELEGRAM_PERSISTENCE_INTERVAL = float(os.getenv('TELEGRAM_PERSISTENCE_INTERVAL', '5'))  # Период записи состояния бота в БД (сек.)
 
 # Настройки cookies - безопасные для продакшена
 CSRF_COOKIE_SECURE = not DEBUG  # True для HTTPS в продакшене
@@ -180,6 +189,12 @@ DATA_UPLOAD_MAX_NUMBER_FIELDS = 1000
 # Custom user model
 AUTH_USER_MODEL = 'accounts.User'
 
+# Фоновые операции со сметами (импорт, экспорт)
+ESTIMATE_BACKGROUND_WORKERS = int(os.getenv('ESTIMATE_BACKGROUND_WORKERS', '2'))
+
+# Шрифт с кириллицей для выгрузки смет в PDF
+ESTIMATE_PDF_FONT = os.getenv('ESTIMATE_PDF_FONT', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
+
 # Django REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
@@ -1,9 +1,16 @@
 import os
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
+import time
+from telegram import (
+    Update, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle,
+    InlineQueryResultsButton, InputTextMessageContent
+)
+from telegram.ext import (
+    Application, CommandHandler, CallbackQueryHandler, InlineQueryHandler, MessageHandler, filters, ContextTypes
+)
 from django.conf import settings
-from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Count, Q, Sum
 
 # Настройка логирования
 logging.basicConfig(
@@ -19,7 +26,60 @@ django.setup()
 
 from accounts.models import TelegramUser, User, TelegramAuthToken
 from projects.models import Project, ProjectMember
-from kanban.models import ExpenseItem, ConstructionStage, ExpenseCategory
+from kanban.models import (
+    ExpenseItem, ExpenseDocument, ExpenseHistory, ConstructionStage, ExpenseCategory,
+    KanbanBoard, KanbanColumn
+)
+from telegram_bot.db import db_async, get_db_executor
+from telegram_bot.media import get_media_ingestor
+from telegram_bot.paging import (
+    NEXT, PREV, build_callback, decode_uuid, encode_uuid, fetch_page,
+    get_cached_page, parse_callback, set_cached_page
+)
+from telegram_bot.parsing import parse_single_task, parse_task_message
+from telegram_bot.persistence import DjangoPersistence
+from telegram_bot.search import search_projects_and_tasks
+from telegram_bot.updates import BoundedUpdateQueue, ChatOrderedUpdateProcessor
+
+# Inline-режим: размер страницы, время кэширования ответа на стороне Telegram
+# и порог, после которого ответ логируется как медленный
+INLINE_PAGE_SIZE = 20
+INLINE_CACHE_TIME = 30
+INLINE_SLOW_MS = 300
+
+# Размеры страниц списков и префиксы callback_data для листания
+PROJECTS_PAGE_SIZE = 10
+TASKS_PAGE_SIZE = 15
+PROJECT_TASKS_PAGE_SIZE = 10
+PROJECTS_PAGING_PREFIX = 'pp'
+TASKS_PAGING_PREFIX = 'tp'
+PROJECT_TASKS_PAGING_PREFIX = 'pt:'
+PAGING_PREFIXES = ('pp:', 'tp:', 'pt:')
+
+ROLE_NAMES = {
+    'admin': 'администратор',
+    'foreman': 'прораб',
+    'warehouse_keeper': 'кладовщик',
+    'supplier': 'снабженец',
+    'contractor': 'подрядчик'
+}
+
+PROJECT_STATUS_EMOJI = {
+    'planning': '📋',
+    'in_progress': '🚧',
+    'on_hold': '⏸️',
+    'completed': '✅',
+    'cancelled': '❌'
+}
+
+TASK_STATUS_EMOJI = {
+    'new': '🆕',
+    'todo': '📝',
+    'in_progress': '🚧',
+    'review': '👀',
+    'done': '✅',
+    'cancelled': '❌'
+}
 
 
 class ConstructionBot:
@@ -27,9 +87,32 @@ class ConstructionBot:
     
     def __init__(self):
         self.token = settings.TELEGRAM_BOT_TOKEN
-        self.application = Application.builder().token(self.token).build()
+        
+        # Обновления проходят через ограниченную очередь и пул обработчиков:
+        # разные чаты обрабатываются параллельно, один чат - по порядку
+        workers = settings.TELEGRAM_BOT_WORKERS
+        self.update_queue = BoundedUpdateQueue(
+            maxsize=settings.TELEGRAM_UPDATE_QUEUE_SIZE,
+            max_in_flight=workers
+        )
+        self.application = (
+            Application.builder()
+            .token(self.token)
+            .update_queue(self.update_queue)
+            .concurrent_updates(ChatOrderedUpdateProcessor(workers, self.update_queue))
+            # Незавершенное создание задачи (user_data) переживает перезапуск
+            # и доступно всем процессам бота за одним веб-хуком
+            .persistence(DjangoPersistence(update_interval=settings.TELEGRAM_PERSISTENCE_INTERVAL))
+            .post_shutdown(self.shutdown_db)
+            .build()
+        )
         self.setup_handlers()
     
+    async def shutdown_db(self, application):
+        """Остановка пулов загрузки файлов и запросов к базе при завершении бота"""
+        get_media_ingestor().shutdown()
+        get_db_executor().shutdown()
+    
     def setup_handlers(self):
         """Настройка обработчиков команд"""
         # Команды
@@ -43,6 +126,9 @@ class ConstructionBot:
         # Обработчики кнопок
         self.application.add_handler(CallbackQueryHandler(self.button_callback))
         
+        # Inline-поиск проектов и задач (@bot запрос в любом чате)
+        self.application.add_handler(InlineQueryHandler(self.inline_query))
+        
         # Обработчик текстовых сообщений для создания задач
         self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_text_message))
         
@@ -99,11 +185,11 @@ class ConstructionBot:
         
         try:
             # Проверяем, есть ли пользователь в системе
-            telegram_user = await sync_to_async(TelegramUser.objects.get)(telegram_id=user.id)
-            django_user = await sync_to_async(lambda: telegram_user.user)()
-            user_name = await sync_to_async(lambda: django_user.get_full_name())()
+            telegram_user = await db_async(TelegramUser.objects.get)(telegram_id=user.id)
+            django_user = await db_async(lambda: telegram_user.user)()
+            user_name = await db_async(lambda: django_user.get_full_name())()
             
-            user_role_display = await sync_to_async(lambda: django_user.get_role_display())()
+            user_role_display = await db_async(lambda: django_user.get_role_display())()
             welcome_text = f"""
 🏗️ Привет, {user_name}!
 Роль: {user_role_display}
@@ -117,7 +203,7 @@ class ConstructionBot:
             
             # Получаем домен сайта
             try:
-                current_site = await sync_to_async(Site.objects.get_current)()
+                current_site = await db_async(Site.objects.get_current)()
                 domain = current_site.domain
             except:
                 domain = "127.0.0.1:8000"  # Fallback для разработки
@@ -132,7 +218,7 @@ class ConstructionBot:
             from django.utils import timezone
             expires_at = timezone.now() + timedelta(minutes=30)  # Токен действует 30 минут
             
-            login_auth_token = await sync_to_async(TelegramAuthToken.objects.create)(
+            login_auth_token = await db_async(TelegramAuthToken.objects.create)(
                 token=login_token,
                 user=django_user,
                 telegram_user=telegram_user,
@@ -201,7 +287,7 @@ class ConstructionBot:
             # Ищем токен в базе данных
             try:
                 print(f"[AUTH] Ищем токен в базе данных...")
-                auth_token_obj = await sync_to_async(TelegramAuthToken.objects.get)(token=auth_token)
+                auth_token_obj = await db_async(TelegramAuthToken.objects.get)(token=auth_token)
                 print(f"[AUTH] Токен найден в базе данных: {auth_token_obj.token}")
                 print(f"[AUTH] Токен создан: {auth_token_obj.created_at}")
                 print(f"[AUTH] Токен истекает: {auth_token_obj.expires_at}")
@@ -212,7 +298,7 @@ class ConstructionBot:
                 return
             
             # Проверяем, не истек ли токен
-            if await sync_to_async(auth_token_obj.is_expired)():
+            if await db_async(auth_token_obj.is_expired)():
                 await update.message.reply_text("Токен авторизации истек. Попробуйте еще раз.")
                 return
             
@@ -232,11 +318,11 @@ class ConstructionBot:
             print(f"[AUTH] Создаем/находим Django пользователя: {email}")
             
             try:
-                django_user = await sync_to_async(User.objects.get)(email=email)
+                django_user = await db_async(User.objects.get)(email=email)
                 print(f"[AUTH] Найден существующий Django пользователь: {django_user.email}")
             except User.DoesNotExist:
                 print(f"[AUTH] Создаем нового Django пользователя: {email}")
-                django_user = await sync_to_async(User.objects.create_user)(
+                django_user = await db_async(User.objects.create_user)(
                     email=email,
                     first_name=user.first_name or 'Telegram',
                     last_name=user.last_name or 'User',
@@ -246,7 +332,7 @@ class ConstructionBot:
                 print(f"[AUTH] Django пользователь создан: {django_user.email} (ID: {django_user.id})")
             
             # Теперь создаем Telegram пользователя с привязкой к Django пользователю
-            telegram_user, created = await sync_to_async(TelegramUser.objects.get_or_create)(
+            telegram_user, created = await db_async(TelegramUser.objects.get_or_create)(
                 telegram_id=user.id,
                 defaults={
                     'user': django_user,  # Сразу привязываем к Django пользователю
@@ -268,15 +354,15 @@ class ConstructionBot:
                 telegram_user.last_name = user.last_name or ''
                 telegram_user.photo_url = ''
                 telegram_user.language_code = user.language_code or 'ru'
-                await sync_to_async(telegram_user.save)()
+                await db_async(telegram_user.save)()
                 print(f"[AUTH] Telegram пользователь обновлен")
             
             # Отмечаем токен как использованный
             print(f"[AUTH] Отмечаем токен как использованный...")
-            await sync_to_async(auth_token_obj.mark_as_used)(django_user, telegram_user)
+            await db_async(auth_token_obj.mark_as_used)(django_user, telegram_user)
             print(f"[AUTH] Токен отмечен как использованный")
             
-            user_name = await sync_to_async(lambda: django_user.get_full_name())()
+            user_name = await db_async(lambda: django_user.get_full_name())()
             welcome_text = f"""
 ✅ Авторизация успешна!
 
@@ -295,7 +381,7 @@ class ConstructionBot:
             
             # Получаем домен сайта
             try:
-                current_site = await sync_to_async(Site.objects.get_current)()
+                current_site = await db_async(Site.objects.get_current)()
                 domain = current_site.domain
             except:
                 domain = "127.0.0.1:8000"  # Fallback для разработки
@@ -310,7 +396,7 @@ class ConstructionBot:
             from django.utils import timezone
             expires_at = timezone.now() + timedelta(minutes=30)  # Токен действует 30 минут
             
-            login_auth_token = await sync_to_async(TelegramAuthToken.objects.create)(
+            login_auth_token = await db_async(TelegramAuthToken.objects.create)(
                 token=login_token,
                 user=django_user,
                 telegram_user=telegram_user,
@@ -340,7 +426,7 @@ class ConstructionBot:
     
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Команда /help"""
-        help_text = """
+        help_text = f"""
 🔧 Доступные команды:
 
 /start - Начать работу с ботом
@@ -350,6 +436,8 @@ class ConstructionBot:
 /stages - Этапы строительства
 /create_task - Создать новую задачу
 
+🔎 Поиск в любом чате: @{settings.TELEGRAM_BOT_USERNAME} плитка
+
 📱 Управление:
 • Используйте кнопки для быстрого доступа
 • Отправьте номер задачи для просмотра деталей
@@ -359,86 +447,11 @@ class ConstructionBot:
         """
         await self.send_message(update, help_text)
     
-    async def projects_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def projects_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE, cursor=None, direction=NEXT):
         """Команда /projects - показать проекты пользователя"""
         try:
-            telegram_user = await sync_to_async(TelegramUser.objects.get)(telegram_id=update.effective_user.id)
-            user = await sync_to_async(lambda: telegram_user.user)()
-            user_role = await sync_to_async(lambda: user.role)()
-            
-            # Получаем проекты через метод get_accessible_projects()
-            projects = await sync_to_async(list)(user.get_accessible_projects().order_by('-created_at')[:10])
-            
-            if not projects:
-                role_text = {
-                    'admin': 'администратор',
-                    'foreman': 'прораб',
-                    'warehouse_keeper': 'кладовщик',
-                    'supplier': 'снабженец',
-                    'contractor': 'подрядчик'
-                }.get(user_role, 'пользователь')
-                
-                await self.send_message(update, f"📭 У вас как {role_text} пока нет проектов.")
-                return
-            
-            user_role_display = await sync_to_async(lambda: user.get_role_display())()
-            text = f"🏗️ Проекты ({user_role_display}):\n\n"
-            keyboard = []
-            
-            # Подготавливаем данные для всех проектов
-            project_data = []
-            for project in projects:
-                try:
-                    project_status = project.status
-                except:
-                    project_status = 'unknown'
-                
-                status_emoji = {
-                    'planning': '📋',
-                    'in_progress': '🚧',
-                    'on_hold': '⏸️',
-                    'completed': '✅',
-                    'cancelled': '❌'
-                }.get(project_status, '❓')
-                
-                project_data.append({
-                    'project': project,
-                    'status_emoji': status_emoji
-                })
-            
-            # Теперь обрабатываем данные асинхронно
-            for data in project_data:
-                project = data['project']
-                status_emoji = data['status_emoji']
-                
-                # Получаем роль пользователя в проекте
-                project_role = "👤 Участник"
-                project_created_by = await sync_to_async(lambda: project.created_by)()
-                project_foreman = await sync_to_async(lambda: project.foreman)()
-                
-                if project_created_by == user:
-                    project_role = "👑 Создатель"
-                elif project_foreman == user:
-                    project_role = "👷 Прораб"
-                
-                project_name = await sync_to_async(lambda: project.name)()
-                project_budget = await sync_to_async(lambda: project.budget)()
-                project_spent = await sync_to_async(lambda: project.spent_amount)()
-                project_id = await sync_to_async(lambda: project.id)()
-                
-                if project_budget > 0:
-                    progress = (project_spent / project_budget) * 100
-                    text += f"{status_emoji} {project_name}\n💰 {project_budget:,.0f}₽ | 💸 {project_spent:,.0f}₽ | 📊 {progress:.0f}%\n\n"
-                else:
-                    text += f"{status_emoji} {project_name}\n💰 {project_budget:,.0f}₽ | 💸 {project_spent:,.0f}₽\n\n"
-                
-                keyboard.append([InlineKeyboardButton(
-                    f"📋 {project_name[:30]}{'...' if len(project_name) > 30 else ''}",
-                    callback_data=f"project_{project_id}"
-                )])
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await self.send_message(update, text, reply_markup=reply_markup)
+            rendered = await db_async(self.render_projects_page)(update.effective_user.id, cursor, direction)
+            await self.send_page(update, rendered, edit=cursor is not None)
             
         except TelegramUser.DoesNotExist:
             await self.send_message(update, "❌ Сначала авторизуйтесь в веб-приложении.")
@@ -446,110 +459,49 @@ class ConstructionBot:
             logger.error(f"Ошибка в projects_command: {e}")
             await self.send_message(update, "❌ Произошла ошибка при получении проектов.")
     
-    async def tasks_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Команда /tasks - показать задачи пользователя"""
-        try:
-            telegram_user = await sync_to_async(TelegramUser.objects.get)(telegram_id=update.effective_user.id)
-            user = await sync_to_async(lambda: telegram_user.user)()
-            user_role = await sync_to_async(lambda: user.role)()
+    def render_projects_page(self, telegram_id, cursor=None, direction=NEXT):
+        """Страница списка проектов пользователя (выполняется в пуле запросов)"""
+        cache_parts = ('projects', telegram_id, direction, cursor)
+        if cursor:
+            rendered = get_cached_page(*cache_parts)
+            if rendered is not None:
+                return rendered
+        
+        user = TelegramUser.objects.select_related('user').get(telegram_id=telegram_id).user
+        page = fetch_page(user.get_accessible_projects(), PROJECTS_PAGE_SIZE, cursor, direction)
+        
+        if not page.items:
+            role_text = ROLE_NAMES.get(user.role, 'пользователь')
+            return {'text': f"📭 У вас как {role_text} пока нет проектов.", 'keyboard': []}
+        
+        text = f"🏗️ Проекты ({user.get_role_display()}):\n\n"
+        keyboard = []
+        
+        for project in page.items:
+            status_emoji = PROJECT_STATUS_EMOJI.get(project.status, '❓')
             
-            # Получаем задачи в зависимости от роли
-            if user_role == 'admin':
-                # Администратор видит все задачи
-                tasks = await sync_to_async(lambda: list(ExpenseItem.objects.all().order_by('-created_at')[:15]))()
-            elif user_role == 'foreman':
-                # Прораб видит задачи своих проектов
-                projects = await sync_to_async(lambda: list(Project.objects.filter(
-                    Q(foreman=user) | Q(created_by=user)
-                ).values_list('id', flat=True)))()
-                tasks = await sync_to_async(lambda: list(ExpenseItem.objects.filter(
-                    project_id__in=projects
-                ).order_by('-created_at')[:15]))()
+            if project.budget > 0:
+                progress = (project.spent_amount / project.budget) * 100
+                text += f"{status_emoji} {project.name}\n💰 {project.budget:,.0f}₽ | 💸 {project.spent_amount:,.0f}₽ | 📊 {progress:.0f}%\n\n"
             else:
-                # Остальные роли видят свои задачи
-                tasks = await sync_to_async(lambda: list(ExpenseItem.objects.filter(
-                    Q(created_by=user) | Q(assigned_to=user)
-                ).order_by('-created_at')[:15]))()
-            
-            if not tasks:
-                role_text = {
-                    'admin': 'администратор',
-                    'foreman': 'прораб',
-                    'warehouse_keeper': 'кладовщик',
-                    'supplier': 'снабженец',
-                    'contractor': 'подрядчик'
-                }.get(user_role, 'пользователь')
-                
-                await self.send_message(update, f"📭 У вас как {role_text} пока нет задач.")
-                return
-            
-            user_role_display = await sync_to_async(lambda: user.get_role_display())()
-            text = f"📋 Задачи ({user_role_display}):\n\n"
-            keyboard = []
+                text += f"{status_emoji} {project.name}\n💰 {project.budget:,.0f}₽ | 💸 {project.spent_amount:,.0f}₽\n\n"
             
-            # Подготавливаем данные для всех задач
-            task_data = []
-            for task in tasks:
-                try:
-                    task_status = task.status
-                except:
-                    task_status = 'unknown'
-                
-                status_emoji = {
-                    'new': '🆕',
-                    'todo': '📝',
-                    'in_progress': '🚧',
-                    'review': '👀',
-                    'done': '✅',
-                    'cancelled': '❌'
-                }.get(task_status, '❓')
-                
-                # Получаем информацию о проекте
-                project_name = "Без проекта"
-                if hasattr(task, 'project') and task.project:
-                    try:
-                        project_name = task.project.name[:20] + "..." if len(task.project.name) > 20 else task.project.name
-                    except:
-                        project_name = "Проект"
-                
-                # Определяем роль в задаче
-                task_role = "👤 Участник"
-                if task.created_by == user:
-                    task_role = "👑 Создатель"
-                elif hasattr(task, 'assigned_to') and task.assigned_to == user:
-                    task_role = "🎯 Исполнитель"
-                
-                task_data.append({
-                    'task': task,
-                    'status_emoji': status_emoji,
-                    'project_name': project_name,
-                    'task_role': task_role
-                })
-            
-            # Теперь обрабатываем данные асинхронно
-            for data in task_data:
-                task = data['task']
-                status_emoji = data['status_emoji']
-                project_name = data['project_name']
-                task_role = data['task_role']
-                
-                task_status_display = await sync_to_async(lambda: task.get_status_display())()
-                task_created_date = await sync_to_async(lambda: task.created_at.strftime('%d.%m.%Y'))()
-                
-                task_description = await sync_to_async(lambda: task.description)()
-                task_amount = await sync_to_async(lambda: task.amount)()
-                task_id = await sync_to_async(lambda: task.id)()
-                
-                text += f"{status_emoji} {task_description[:35]}{'...' if len(task_description) > 35 else ''}\n"
-                text += f"🏗️ {project_name} | 💰 {task_amount:,.0f}₽ | {task_status_display}\n\n"
-                
-                keyboard.append([InlineKeyboardButton(
-                    f"{status_emoji} {task_description[:25]}{'...' if len(task_description) > 25 else ''}",
-                    callback_data=f"task_{task_id}"
-                )])
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await self.send_message(update, text, reply_markup=reply_markup)
+            keyboard.append([(
+                f"📋 {project.name[:30]}{'...' if len(project.name) > 30 else ''}",
+                f"project_{project.id}"
+            )])
+        
+        keyboard.extend(self.paging_buttons(page, PROJECTS_PAGING_PREFIX))
+        rendered = {'text': text, 'keyboard': keyboard}
+        if cursor:
+            set_cached_page(rendered, *cache_parts)
+        return rendered
+    
+    async def tasks_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE, cursor=None, direction=NEXT):
+        """Команда /tasks - показать задачи пользователя"""
+        try:
+            rendered = await db_async(self.render_tasks_page)(update.effective_user.id, cursor, direction)
+            await self.send_page(update, rendered, edit=cursor is not None)
             
         except TelegramUser.DoesNotExist:
             await self.send_message(update, "❌ Сначала авторизуйтесь в веб-приложении.")
@@ -557,30 +509,101 @@ class ConstructionBot:
             logger.error(f"Ошибка в tasks_command: {e}")
             await self.send_message(update, "❌ Произошла ошибка при получении задач.")
     
+    def render_tasks_page(self, telegram_id, cursor=None, direction=NEXT):
+        """Страница списка задач пользователя (выполняется в пуле запросов)"""
+        cache_parts = ('tasks', telegram_id, direction, cursor)
+        if cursor:
+            rendered = get_cached_page(*cache_parts)
+            if rendered is not None:
+                return rendered
+        
+        user = TelegramUser.objects.select_related('user').get(telegram_id=telegram_id).user
+        
+        # Задачи в зависимости от роли
+        if user.role == 'admin':
+            # Администратор видит все задачи
+            tasks = ExpenseItem.objects.all()
+        elif user.role == 'foreman':
+            # Прораб видит задачи своих проектов
+            tasks = ExpenseItem.objects.filter(Q(project__foreman=user) | Q(project__created_by=user))
+        else:
+            # Остальные роли видят свои задачи
+            tasks = ExpenseItem.objects.filter(Q(created_by=user) | Q(assigned_to=user))
+        
+        page = fetch_page(tasks.select_related('project'), TASKS_PAGE_SIZE, cursor, direction)
+        
+        if not page.items:
+            role_text = ROLE_NAMES.get(user.role, 'пользователь')
+            return {'text': f"📭 У вас как {role_text} пока нет задач.", 'keyboard': []}
+        
+        text = f"📋 Задачи ({user.get_role_display()}):\n\n"
+        keyboard = []
+        
+        for task in page.items:
+            status_emoji = TASK_STATUS_EMOJI.get(task.status, '❓')
+            project_name = task.project.name[:20] + "..." if len(task.project.name) > 20 else task.project.name
+            
+            text += f"{status_emoji} {task.description[:35]}{'...' if len(task.description) > 35 else ''}\n"
+            text += f"🏗️ {project_name} | 💰 {task.amount:,.0f}₽ | {task.get_status_display()}\n\n"
+            
+            keyboard.append([(
+                f"{status_emoji} {task.description[:25]}{'...' if len(task.description) > 25 else ''}",
+                f"task_{task.id}"
+            )])
+        
+        keyboard.extend(self.paging_buttons(page, TASKS_PAGING_PREFIX))
+        rendered = {'text': text, 'keyboard': keyboard}
+        if cursor:
+            set_cached_page(rendered, *cache_parts)
+        return rendered
+    
+    def paging_buttons(self, page, prefix):
+        """Кнопки «назад/далее» с курсором страницы в callback_data"""
+        row = []
+        if page.has_prev:
+            row.append(("⬅️ Назад", build_callback(prefix, PREV, page.first_cursor)))
+        if page.has_next:
+            row.append(("Далее ➡️", build_callback(prefix, NEXT, page.last_cursor)))
+        return [row] if row else []
+    
+    async def send_page(self, update, rendered, edit=False):
+        """Отправка страницы списка; при листании сообщение редактируется на месте"""
+        reply_markup = None
+        if rendered['keyboard']:
+            reply_markup = InlineKeyboardMarkup([
+                [InlineKeyboardButton(label, callback_data=data) for label, data in row]
+                for row in rendered['keyboard']
+            ])
+        
+        if edit and update.callback_query:
+            await update.callback_query.edit_message_text(rendered['text'], reply_markup=reply_markup)
+        else:
+            await self.send_message(update, rendered['text'], reply_markup=reply_markup)
+    
     async def show_project_details(self, update: Update, context: ContextTypes.DEFAULT_TYPE, project_id: str):
         """Показать детали проекта"""
         try:
             print(f"[PROJECT_DETAILS] Получен project_id: {project_id}")
-            telegram_user = await sync_to_async(TelegramUser.objects.get)(telegram_id=update.effective_user.id)
-            user = await sync_to_async(lambda: telegram_user.user)()
+            telegram_user = await db_async(TelegramUser.objects.get)(telegram_id=update.effective_user.id)
+            user = await db_async(lambda: telegram_user.user)()
             
             # Получаем проект
-            project = await sync_to_async(Project.objects.get)(id=project_id)
+            project = await db_async(Project.objects.get)(id=project_id)
             
             # Проверяем доступ к проекту
             has_access = False
-            user_role = await sync_to_async(lambda: user.role)()
+            user_role = await db_async(lambda: user.role)()
             
             # Администратор имеет доступ ко всем проектам
             if user_role == 'admin':
                 has_access = True
             else:
-                project_created_by = await sync_to_async(lambda: project.created_by)()
-                project_foreman = await sync_to_async(lambda: project.foreman)()
+                project_created_by = await db_async(lambda: project.created_by)()
+                project_foreman = await db_async(lambda: project.foreman)()
                 
                 if project_created_by == user or project_foreman == user:
                     has_access = True
-                elif await sync_to_async(ProjectMember.objects.filter(project=project, user=user).exists)():
+                elif await db_async(ProjectMember.objects.filter(project=project, user=user).exists)():
                     has_access = True
             
             if not has_access:
@@ -588,8 +611,8 @@ class ConstructionBot:
                 return
             
             # Получаем статистику проекта
-            total_tasks = await sync_to_async(ExpenseItem.objects.filter(project=project).count)()
-            completed_tasks = await sync_to_async(ExpenseItem.objects.filter(project=project, status='done').count)()
+            total_tasks = await db_async(ExpenseItem.objects.filter(project=project).count)()
+            completed_tasks = await db_async(ExpenseItem.objects.filter(project=project, status='done').count)()
             
             try:
                 project_status = project.status
@@ -604,13 +627,13 @@ class ConstructionBot:
                 'cancelled': '❌'
             }.get(project_status, '❓')
             
-            project_status_display = await sync_to_async(lambda: project.get_status_display())()
-            foreman_name = await sync_to_async(lambda: project.foreman.get_full_name() if project.foreman else 'Не назначен')()
+            project_status_display = await db_async(lambda: project.get_status_display())()
+            foreman_name = await db_async(lambda: project.foreman.get_full_name() if project.foreman else 'Не назначен')()
             
-            project_name = await sync_to_async(lambda: project.name)()
-            project_budget = await sync_to_async(lambda: project.budget)()
-            project_spent = await sync_to_async(lambda: project.spent_amount)()
-            project_description = await sync_to_async(lambda: project.description)()
+            project_name = await db_async(lambda: project.name)()
+            project_budget = await db_async(lambda: project.budget)()
+            project_spent = await db_async(lambda: project.spent_amount)()
+            project_description = await db_async(lambda: project.description)()
             
             if project_budget > 0:
                 progress = (project_spent / project_budget) * 100
@@ -637,85 +660,13 @@ class ConstructionBot:
             logger.error(f"Ошибка в show_project_details: {e}")
             await self.send_message(update, "❌ Произошла ошибка при получении проекта.")
     
-    async def show_project_tasks(self, update: Update, context: ContextTypes.DEFAULT_TYPE, project_id: str):
+    async def show_project_tasks(self, update: Update, context: ContextTypes.DEFAULT_TYPE, project_id, cursor=None, direction=NEXT):
         """Показать задачи проекта"""
         try:
-            telegram_user = await sync_to_async(TelegramUser.objects.get)(telegram_id=update.effective_user.id)
-            user = await sync_to_async(lambda: telegram_user.user)()
-            
-            # Получаем проект
-            project = await sync_to_async(Project.objects.get)(id=project_id)
-            
-            # Проверяем доступ к проекту
-            user_role = await sync_to_async(lambda: user.role)()
-            has_access = False
-            
-            # Администратор имеет доступ ко всем проектам
-            if user_role == 'admin':
-                has_access = True
-            else:
-                project_created_by = await sync_to_async(lambda: project.created_by)()
-                project_foreman = await sync_to_async(lambda: project.foreman)()
-                
-                if project_created_by == user or project_foreman == user:
-                    has_access = True
-                elif await sync_to_async(ProjectMember.objects.filter(project=project, user=user).exists)():
-                    has_access = True
-            
-            if not has_access:
-                await self.send_message(update, "❌ У вас нет доступа к этому проекту.")
-                return
-            
-            # Получаем задачи проекта
-            tasks = await sync_to_async(list)(ExpenseItem.objects.filter(project=project).order_by('-created_at')[:10])
-            
-            project_name = await sync_to_async(lambda: project.name)()
-            
-            if not tasks:
-                await self.send_message(update, f"📭 В проекте '{project_name}' пока нет задач.")
-                return
-            
-            text = f"📋 Задачи: {project_name}\n\n"
-            keyboard = []
-            
-            for task in tasks:
-                try:
-                    task_status = task.status
-                except:
-                    task_status = 'unknown'
-                
-                status_emoji = {
-                    'new': '🆕',
-                    'todo': '📝',
-                    'in_progress': '🚧',
-                    'review': '👀',
-                    'done': '✅',
-                    'cancelled': '❌'
-                }.get(task_status, '❓')
-                
-                task_status_display = await sync_to_async(lambda: task.get_status_display())()
-                task_creator_name = await sync_to_async(lambda: task.created_by.get_full_name())()
-                
-                try:
-                    task_description = task.description
-                    task_amount = task.amount
-                    task_id = task.id
-                except:
-                    task_description = "Задача"
-                    task_amount = 0
-                    task_id = "unknown"
-                
-                text += f"{status_emoji} {task_description[:40]}{'...' if len(task_description) > 40 else ''}\n"
-                text += f"💰 {task_amount:,.0f}₽ | {task_status_display} | 👤 {task_creator_name}\n\n"
-                
-                keyboard.append([InlineKeyboardButton(
-                    f"{status_emoji} {task_description[:25]}{'...' if len(task_description) > 25 else ''}",
-                    callback_data=f"task_{task_id}"
-                )])
-            
-            keyboard.append([InlineKeyboardButton("🔙 Назад к проекту", callback_data=f"project_{project_id}")])
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await self.send_message(update, text, reply_markup=reply_markup)
+            rendered = await db_async(self.render_project_tasks_page)(
+                update.effective_user.id, project_id, cursor, direction
+            )
+            await self.send_page(update, rendered, edit=cursor is not None)
             
         except Project.DoesNotExist:
             await self.send_message(update, "❌ Проект не найден.")
@@ -723,30 +674,80 @@ class ConstructionBot:
             logger.error(f"Ошибка в show_project_tasks: {e}")
             await self.send_message(update, "❌ Произошла ошибка при получении задач проекта.")
     
+    def render_project_tasks_page(self, telegram_id, project_id, cursor=None, direction=NEXT):
+        """Страница задач проекта (выполняется в пуле запросов)"""
+        cache_parts = ('project_tasks', telegram_id, project_id, direction, cursor)
+        if cursor:
+            rendered = get_cached_page(*cache_parts)
+            if rendered is not None:
+                return rendered
+        
+        user = TelegramUser.objects.select_related('user').get(telegram_id=telegram_id).user
+        project = Project.objects.get(id=project_id)
+        
+        # Проверяем доступ к проекту
+        has_access = (
+            user.role == 'admin' or
+            project.created_by_id == user.id or
+            project.foreman_id == user.id or
+            ProjectMember.objects.filter(project=project, user=user).exists()
+        )
+        if not has_access:
+            return {'text': "❌ У вас нет доступа к этому проекту.", 'keyboard': []}
+        
+        tasks = ExpenseItem.objects.filter(project=project).select_related('created_by')
+        page = fetch_page(tasks, PROJECT_TASKS_PAGE_SIZE, cursor, direction)
+        
+        if not page.items:
+            return {'text': f"📭 В проекте '{project.name}' пока нет задач.", 'keyboard': []}
+        
+        text = f"📋 Задачи: {project.name}\n\n"
+        keyboard = []
+        
+        for task in page.items:
+            status_emoji = TASK_STATUS_EMOJI.get(task.status, '❓')
+            
+            text += f"{status_emoji} {task.description[:40]}{'...' if len(task.description) > 40 else ''}\n"
+            text += f"💰 {task.amount:,.0f}₽ | {task.get_status_display()} | 👤 {task.created_by.get_full_name()}\n\n"
+            
+            keyboard.append([(
+                f"{status_emoji} {task.description[:25]}{'...' if len(task.description) > 25 else ''}",
+                f"task_{task.id}"
+            )])
+        
+        keyboard.extend(self.paging_buttons(page, f"{PROJECT_TASKS_PAGING_PREFIX}{encode_uuid(project.id)}"))
+        keyboard.append([("🔙 Назад к проекту", f"project_{project.id}")])
+        rendered = {'text': text, 'keyboard': keyboard}
+        if cursor:
+            set_cached_page(rendered, *cache_parts)
+        return rendered
+    
     async def show_project_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE, project_id: str):
         """Показать статистику проекта"""
         try:
-            telegram_user = await sync_to_async(TelegramUser.objects.get)(telegram_id=update.effective_user.id)
-            user = await sync_to_async(lambda: telegram_user.user)()
+            telegram_user = await db_async(TelegramUser.objects.get)(telegram_id=update.effective_user.id)
+            user = await db_async(lambda: telegram_user.user)()
             
             # Получаем проект
-            project = await sync_to_async(Project.objects.get)(id=project_id)
-            
-            # Получаем статистику
-            total_tasks = await sync_to_async(ExpenseItem.objects.filter(project=project).count)()
-            completed_tasks = await sync_to_async(ExpenseItem.objects.filter(project=project, status='done').count)()
-            pending_tasks = await sync_to_async(ExpenseItem.objects.filter(project=project, status='todo').count)()
-            in_progress_tasks = await sync_to_async(ExpenseItem.objects.filter(project=project, status='in_progress').count)()
-            
-            # Общая сумма задач
-            total_amount = await sync_to_async(ExpenseItem.objects.filter(project=project).aggregate(
-                total=models.Sum('amount')
-            ))()
-            total_amount = total_amount['total'] or 0
+            project = await db_async(Project.objects.get)(id=project_id)
+            
+            # Получаем статистику одним агрегирующим запросом
+            stats = await db_async(ExpenseItem.objects.filter(project=project).aggregate)(
+                total_tasks=Count('id'),
+                completed_tasks=Count('id', filter=Q(status='done')),
+                pending_tasks=Count('id', filter=Q(status='todo')),
+                in_progress_tasks=Count('id', filter=Q(status='in_progress')),
+                total_amount=Sum('amount')
+            )
+            total_tasks = stats['total_tasks']
+            completed_tasks = stats['completed_tasks']
+            pending_tasks = stats['pending_tasks']
+            in_progress_tasks = stats['in_progress_tasks']
+            total_amount = stats['total_amount'] or 0
             
-            project_name = await sync_to_async(lambda: project.name)()
-            project_budget = await sync_to_async(lambda: project.budget)()
-            project_spent = await sync_to_async(lambda: project.spent_amount)()
+            project_name = await db_async(lambda: project.name)()
+            project_budget = await db_async(lambda: project.budget)()
+            project_spent = await db_async(lambda: project.spent_amount)()
             
             text = f"📊 Статистика проекта '{project_name}':\n\n"
             text += f"📋 Всего задач: {total_tasks}\n"
@@ -778,7 +779,7 @@ class ConstructionBot:
     async def stages_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Команда /stages - показать этапы строительства"""
         try:
-            stages = await sync_to_async(list)(ConstructionStage.objects.filter(is_active=True).order_by('order'))
+            stages = await db_async(list)(ConstructionStage.objects.filter(is_active=True).order_by('order'))
             
             if not stages:
                 await self.send_message(update, "📭 Этапы строительства не настроены.")
@@ -801,11 +802,11 @@ class ConstructionBot:
     async def create_task_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Команда /create_task - создать новую задачу"""
         try:
-            telegram_user = await sync_to_async(TelegramUser.objects.get)(telegram_id=update.effective_user.id)
-            user = await sync_to_async(lambda: telegram_user.user)()
+            telegram_user = await db_async(TelegramUser.objects.get)(telegram_id=update.effective_user.id)
+            user = await db_async(lambda: telegram_user.user)()
             
             # Получаем проекты через метод get_accessible_projects()
-            projects = await sync_to_async(list)(user.get_accessible_projects().order_by('-created_at')[:10])
+            projects = await db_async(list)(user.get_accessible_projects().order_by('-created_at')[:10])
             
             if not projects:
                 await self.send_message(update, "❌ У вас нет проектов для создания задач.")
@@ -844,7 +845,9 @@ class ConstructionBot:
         data = query.data
         print(f"[CALLBACK] Получен callback: {data}")
         
-        if data == "my_tasks":
+        if data.startswith(PAGING_PREFIXES):
+            await self.handle_paging(update, context, data)
+        elif data == "my_tasks":
             # Создаем мок объект update для команд
             mock_update = Update(update_id=update.update_id, callback_query=query)
             await self.tasks_command(mock_update, context)
@@ -881,11 +884,82 @@ class ConstructionBot:
             mock_update = Update(update_id=update.update_id, callback_query=query)
             await self.show_task_details(mock_update, context, task_id)
     
+    async def handle_paging(self, update: Update, context: ContextTypes.DEFAULT_TYPE, data: str):
+        """Листание списков: callback_data вида <prefix>:<направление>:<курсор>"""
+        prefix, direction, cursor = parse_callback(data)
+        mock_update = Update(update_id=update.update_id, callback_query=update.callback_query)
+        
+        if prefix == PROJECTS_PAGING_PREFIX:
+            await self.projects_command(mock_update, context, cursor, direction)
+        elif prefix == TASKS_PAGING_PREFIX:
+            await self.tasks_command(mock_update, context, cursor, direction)
+        elif prefix.startswith(PROJECT_TASKS_PAGING_PREFIX):
+            project_id = decode_uuid(prefix[len(PROJECT_TASKS_PAGING_PREFIX):])
+            await self.show_project_tasks(mock_update, context, str(project_id), cursor, direction)
+    
+    async def inline_query(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Inline-поиск проектов и задач пользователя"""
+        inline_query = update.inline_query
+        started_at = time.monotonic()
+        
+        try:
+            results = await db_async(search_projects_and_tasks)(inline_query.from_user.id, inline_query.query)
+        except Exception as e:
+            logger.error(f"Ошибка в inline_query: {e}")
+            results = []
+        
+        if results is None:
+            await inline_query.answer(
+                [],
+                cache_time=INLINE_CACHE_TIME,
+                is_personal=True,
+                button=InlineQueryResultsButton("🔐 Авторизуйтесь в боте", start_parameter="inline")
+            )
+            return
+        
+        # Постраничная выдача: offset - позиция в списке результатов
+        try:
+            offset = int(inline_query.offset or 0)
+        except ValueError:
+            offset = 0
+        page = results[offset:offset + INLINE_PAGE_SIZE]
+        next_offset = str(offset + INLINE_PAGE_SIZE) if offset + INLINE_PAGE_SIZE < len(results) else ''
+        
+        articles = []
+        for result in page:
+            if result['kind'] == 'project':
+                title = f"🏗️ {result['title']}"
+                description = f"💰 {result['amount']:,.0f}₽ | 💸 {result['spent']:,.0f}₽"
+                text = f"🏗️ {result['title']}\n💰 {result['amount']:,.0f}₽ | 💸 {result['spent']:,.0f}₽"
+            else:
+                title = f"📋 {result['title']}"
+                description = f"🏗️ {result['project_name']} | 💰 {result['amount']:,.0f}₽"
+                text = f"📋 {result['title']}\n🏗️ {result['project_name']}\n💰 {result['amount']:,.0f}₽"
+            if result['description']:
+                text += f"\n📝 {result['description']}"
+            
+            articles.append(InlineQueryResultArticle(
+                id=f"{result['kind']}_{result['id']}",
+                title=title,
+                description=description,
+                input_message_content=InputTextMessageContent(text)
+            ))
+        
+        await inline_query.answer(
+            articles,
+            cache_time=INLINE_CACHE_TIME,
+            is_personal=True,
+            next_offset=next_offset
+        )
+        
+        elapsed_ms = (time.monotonic() - started_at) * 1000
+        if elapsed_ms > INLINE_SLOW_MS:
+            logger.warning(f"Медленный inline-ответ: {elapsed_ms:.0f} мс, запрос '{inline_query.query}'")
     
     async def show_task_details(self, update: Update, context: ContextTypes.DEFAULT_TYPE, task_id):
         """Показать детали задачи"""
         try:
-            task = await sync_to_async(ExpenseItem.objects.get)(id=task_id)
+            task = await db_async(ExpenseItem.objects.get)(id=task_id)
             
             try:
                 task_status = task.status
@@ -897,17 +971,17 @@ class ConstructionBot:
                 'review': '👀', 'done': '✅', 'cancelled': '❌'
             }.get(task_status, '📝')
             
-            task_status_display = await sync_to_async(lambda: task.get_status_display())()
-            task_creator_name = await sync_to_async(lambda: task.created_by.get_full_name())()
-            task_assigned_name = await sync_to_async(lambda: task.assigned_to.get_full_name() if task.assigned_to else None)()
+            task_status_display = await db_async(lambda: task.get_status_display())()
+            task_creator_name = await db_async(lambda: task.created_by.get_full_name())()
+            task_assigned_name = await db_async(lambda: task.assigned_to.get_full_name() if task.assigned_to else None)()
             
-            task_project_name = await sync_to_async(lambda: task.project.name)()
-            task_stage_name = await sync_to_async(lambda: task.stage.name if task.stage else None)()
+            task_project_name = await db_async(lambda: task.project.name)()
+            task_stage_name = await db_async(lambda: task.stage.name if task.stage else None)()
             
-            task_title = await sync_to_async(lambda: task.title)()
-            task_created_date = await sync_to_async(lambda: task.created_at.strftime('%d.%m.%Y %H:%M'))()
-            task_amount = await sync_to_async(lambda: task.amount)()
-            task_description = await sync_to_async(lambda: task.description)()
+            task_title = await db_async(lambda: task.title)()
+            task_created_date = await db_async(lambda: task.created_at.strftime('%d.%m.%Y %H:%M'))()
+            task_amount = await db_async(lambda: task.amount)()
+            task_description = await db_async(lambda: task.description)()
             
             text = f"{status_emoji} {task_title}\n"
             text += f"📊 {task_status_display} | 💰 {task_amount:,.0f}₽\n"
@@ -923,7 +997,7 @@ class ConstructionBot:
             if task_stage_name:
                 text += f"🏗️ Этап: {task_stage_name}\n"
             
-            task_project_id = await sync_to_async(lambda: task.project.id)()
+            task_project_id = await db_async(lambda: task.project.id)()
             keyboard = [
                 [InlineKeyboardButton("🔙 Назад к задачам", callback_data="my_tasks")],
                 [InlineKeyboardButton("🏗️ Проект", callback_data=f"project_{task_project_id}")]
@@ -941,14 +1015,14 @@ class ConstructionBot:
     async def start_create_task(self, update: Update, context: ContextTypes.DEFAULT_TYPE, project_id):
         """Начать создание задачи"""
         try:
-            project = await sync_to_async(Project.objects.get)(id=project_id)
+            project = await db_async(Project.objects.get)(id=project_id)
             
             # Сохраняем project_id в контексте
             context.user_data['creating_task'] = {
                 'project_id': project_id
             }
             
-            project_name = await sync_to_async(lambda: project.name)()
+            project_name = await db_async(lambda: project.name)()
             text = f"➕ Создание задачи для проекта: {project_name}\n\n"
             text += "📝 Напишите задачу в любом формате:\n"
             text += "• Название задачи. Описание. 1000₽\n"
@@ -995,166 +1069,24 @@ class ConstructionBot:
     
     def parse_task_message(self, text: str) -> list:
         """Умное извлечение информации о задачах из сообщения"""
-        import re
-        
-        # Проверяем, есть ли нумерованный список задач
-        numbered_tasks = re.findall(r'^\s*\d+\.\s*(.+)$', text, re.MULTILINE)
-        
-        if numbered_tasks:
-            # Создаем отдельные задачи для каждого пункта
-            tasks = []
-            for task_text in numbered_tasks:
-                task_data = self.parse_single_task(task_text.strip())
-                tasks.append(task_data)
-            
-            # Ограничиваем количество задач (максимум 20)
-            if len(tasks) > 20:
-                tasks = tasks[:20]
-            
-            return tasks
-        else:
-            # Обрабатываем как одну задачу
-            return [self.parse_single_task(text)]
+        return parse_task_message(text)
     
     def parse_single_task(self, text: str) -> dict:
         """Извлечение информации об одной задаче"""
-        import re
-        
-        # Инициализируем данные
-        task_data = {
-            'title': '',
-            'description': '',
-            'amount': 0.0
-        }
-        
-        # Ищем сумму в тексте (различные форматы)
-        amount_patterns = [
-            r'(\d+(?:\.\d+)?)\s*₽',  # 1000₽
-            r'(\d+(?:\.\d+)?)\s*руб',  # 1000 руб
-            r'(\d+(?:\.\d+)?)\s*рублей',  # 1000 рублей
-            r'(\d+(?:\.\d+)?)\s*р',  # 1000р
-            r'(\d+(?:\.\d+)?)\s*тыс',  # 1000 тыс
-            r'(\d+(?:\.\d+)?)\s*тысяч',  # 1000 тысяч
-            r'(\d+(?:\.\d+)?)\s*к',  # 1000к
-        ]
-        
-        amount = 0.0
-        for pattern in amount_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                amount = float(match.group(1))
-                # Если это тысячи, умножаем на 1000
-                if 'тыс' in pattern or 'тысяч' in pattern or 'к' in pattern:
-                    amount *= 1000
-                break
-        
-        task_data['amount'] = amount
-        
-        # Убираем сумму из текста для извлечения названия и описания
-        clean_text = text
-        for pattern in amount_patterns:
-            clean_text = re.sub(pattern, '', clean_text, flags=re.IGNORECASE)
-        
-        # Ищем название задачи (обычно в начале или после ключевых слов)
-        title_patterns = [
-            r'^([^.!?]+)[.!?]',  # До первой точки
-            r'задача[:\s]+([^.!?]+)',  # После "задача:"
-            r'нужно[:\s]+([^.!?]+)',  # После "нужно:"
-            r'сделать[:\s]+([^.!?]+)',  # После "сделать:"
-        ]
-        
-        title = ''
-        for pattern in title_patterns:
-            match = re.search(pattern, clean_text, re.IGNORECASE)
-            if match:
-                title = match.group(1).strip()
-                break
-        
-        # Если название не найдено, берем первые слова
-        if not title:
-            words = clean_text.split()
-            if len(words) > 0:
-                title = ' '.join(words[:5])  # Первые 5 слов
-        
-        task_data['title'] = title
-        
-        # Описание - остальной текст
-        if title and title in clean_text:
-            description = clean_text.replace(title, '').strip()
-        else:
-            description = clean_text.strip()
-        
-        # Очищаем описание от лишних символов
-        description = re.sub(r'[^\w\s.,!?-]', '', description)
-        task_data['description'] = description
-        
-        return task_data
+        return parse_single_task(text)
     
     async def create_task_smart(self, update: Update, context: ContextTypes.DEFAULT_TYPE, project_id: str, tasks_data: list):
         """Умное создание задач"""
         try:
-            # Получаем пользователя
-            telegram_user = await sync_to_async(TelegramUser.objects.get)(telegram_id=update.effective_user.id)
-            user = await sync_to_async(lambda: telegram_user.user)()
-            
-            # Получаем проект
-            project = await sync_to_async(Project.objects.get)(id=project_id)
-            
-            # Получаем первую колонку проекта (колонка "Новые")
-            from kanban.models import KanbanColumn
-            column = await sync_to_async(KanbanColumn.objects.filter(board__project=project).first)()
-            
-            if not column:
-                # Создаем колонку если её нет
-                from kanban.models import KanbanBoard
-                board, created = await sync_to_async(KanbanBoard.objects.get_or_create)(
-                    project=project,
-                    defaults={'created_by': user}
-                )
-                column = await sync_to_async(KanbanColumn.objects.create)(
-                    board=board,
-                    name="Новые",
-                    order=0
-                )
-            
-            created_tasks = []
-            
-            # Создаем задачи
-            for task_data in tasks_data:
-                task = await sync_to_async(ExpenseItem.objects.create)(
-                    title=task_data['title'],
-                    description=task_data['description'],
-                    amount=task_data['amount'],
-                    project=project,
-                    column=column,
-                    created_by=user,
-                    status='new'
-                )
-                created_tasks.append(task)
-            
-            # Обрабатываем вложения (прикрепляем к первой задаче)
+            # Вложения прикрепляются к первой задаче; ждем загрузки, если она еще идет
             attachments = context.user_data['creating_task'].get('attachments', [])
-            if attachments and created_tasks:
-                # Сохраняем информацию о вложениях в описании первой задачи
-                attachment_info = []
-                for attachment in attachments:
-                    if attachment['type'] == 'photo':
-                        attachment_info.append(f"📸 {attachment['filename']}")
-                    elif attachment['type'] == 'document':
-                        attachment_info.append(f"📎 {attachment['original_filename']}")
-                
-                if attachment_info:
-                    # Обновляем описание первой задачи с информацией о вложениях
-                    first_task = created_tasks[0]
-                    updated_description = first_task.description
-                    if updated_description:
-                        updated_description += f"\n\nВложения:\n" + "\n".join(attachment_info)
-                    else:
-                        updated_description = "Вложения:\n" + "\n".join(attachment_info)
-                    
-                    # Обновляем задачу
-                    first_task.description = updated_description
-                    await sync_to_async(first_task.save)()
+            media_list = []
+            if attachments:
+                media_list = await get_media_ingestor().wait([a['file_unique_id'] for a in attachments])
+            
+            created_tasks = await db_async(self.create_tasks_bulk)(
+                update.effective_user.id, project_id, tasks_data, media_list
+            )
             
             # Очищаем данные создания задачи
             del context.user_data['creating_task']
@@ -1189,6 +1121,64 @@ class ConstructionBot:
             logger.error(f"Ошибка в create_task_smart: {e}")
             await self.send_message(update, "❌ Произошла ошибка при создании задач.")
     
+    def get_intake_column(self, project, user):
+        """Первая колонка доски проекта, куда попадают задачи из бота"""
+        column = KanbanColumn.objects.filter(board__project=project).first()
+        
+        if not column:
+            # Создаем колонку если её нет
+            board, created = KanbanBoard.objects.get_or_create(
+                project=project,
+                defaults={'created_by': user}
+            )
+            column = KanbanColumn.objects.create(
+                board=board,
+                name="Новые",
+                position=0
+            )
+        return column
+    
+    def create_tasks_bulk(self, telegram_id, project_id, tasks_data, media_list):
+        """Создание задач из сообщения одной транзакцией
+        
+        Задачи, записи истории и документы вложений вставляются через
+        bulk_create. save() при этом не вызывается, поэтому статус из типа
+        колонки и текст для поиска проставляются здесь же.
+        """
+        user = TelegramUser.objects.select_related('user').get(telegram_id=telegram_id).user
+        project = Project.objects.get(id=project_id)
+        
+        with transaction.atomic():
+            column = self.get_intake_column(project, user)
+            tasks = ExpenseItem.objects.bulk_create([
+                ExpenseItem(
+                    title=task_data['title'][:200],
+                    description=task_data['description'],
+                    search_text=ExpenseItem.build_search_text(task_data['title'][:200], task_data['description']),
+                    amount=task_data['amount'],
+                    project=project,
+                    column=column,
+                    created_by=user,
+                    status=column.column_type
+                )
+                for task_data in tasks_data
+            ])
+            
+            ExpenseHistory.objects.bulk_create([
+                ExpenseHistory(
+                    expense_item=task,
+                    user=user,
+                    action='created',
+                    new_value=f"Создан элемент расхода на сумму {task.amount} ₽ (Telegram)"
+                )
+                for task in tasks
+            ])
+            
+            if tasks and media_list:
+                self.link_attachments(tasks[0], user, media_list)
+        
+        return tasks
+    
     async def handle_photo_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка фото для создания задач"""
         try:
@@ -1202,40 +1192,17 @@ class ConstructionBot:
             if not project_id:
                 return
             
-            # Получаем фото
-            photo = update.message.photo[-1]  # Берем самое большое фото
-            file_id = photo.file_id
-            
-            # Скачиваем фото
-            file = await context.bot.get_file(file_id)
-            file_path = file.file_path
-            
-            # Создаем уникальное имя файла
-            import os
-            import uuid
-            from datetime import datetime
-            
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            unique_id = str(uuid.uuid4())[:8]
-            filename = f"task_photo_{timestamp}_{unique_id}.jpg"
-            
-            # Путь для сохранения
-            media_dir = "media/expense_photos"
-            os.makedirs(media_dir, exist_ok=True)
-            local_path = os.path.join(media_dir, filename)
-            
-            # Скачиваем файл
-            await file.download_to_drive(local_path)
-            
-            # Сохраняем информацию о файле в контексте
-            if 'attachments' not in context.user_data['creating_task']:
-                context.user_data['creating_task']['attachments'] = []
+            # Берем самое большое фото и ставим его в очередь загрузки
+            photo = update.message.photo[-1]
+            filename = f"photo_{photo.file_unique_id}.jpg"
+            get_media_ingestor().schedule(
+                context.application, photo.file_id, photo.file_unique_id, 'photo', filename, 'image/jpeg'
+            )
             
-            context.user_data['creating_task']['attachments'].append({
+            is_new_attachment = self.add_attachment(creating_task, {
                 'type': 'photo',
-                'file_path': local_path,
-                'filename': filename,
-                'file_id': file_id
+                'file_unique_id': photo.file_unique_id,
+                'filename': filename
             })
             
             # Проверяем, есть ли текст в подписи к фото
@@ -1244,7 +1211,7 @@ class ConstructionBot:
                 # Если есть текст в подписи, обрабатываем его как задачи
                 tasks_data = self.parse_task_message(caption)
                 await self.create_task_smart(update, context, project_id, tasks_data)
-            else:
+            elif is_new_attachment and self.is_first_in_album(creating_task, update.message):
                 await self.send_message(update, f"📸 Фото добавлено к задаче!\n\n📝 Теперь напишите описание задачи:")
             
         except Exception as e:
@@ -1264,51 +1231,58 @@ class ConstructionBot:
             if not project_id:
                 return
             
-            # Получаем документ
+            # Ставим документ в очередь загрузки
             document = update.message.document
-            file_id = document.file_id
-            filename = document.file_name
-            
-            # Скачиваем файл
-            file = await context.bot.get_file(file_id)
-            file_path = file.file_path
-            
-            # Создаем уникальное имя файла
-            import os
-            import uuid
-            from datetime import datetime
-            
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            unique_id = str(uuid.uuid4())[:8]
-            file_extension = os.path.splitext(filename)[1]
-            new_filename = f"task_file_{timestamp}_{unique_id}{file_extension}"
-            
-            # Путь для сохранения
-            media_dir = "media/expense_photos"
-            os.makedirs(media_dir, exist_ok=True)
-            local_path = os.path.join(media_dir, new_filename)
-            
-            # Скачиваем файл
-            await file.download_to_drive(local_path)
-            
-            # Сохраняем информацию о файле в контексте
-            if 'attachments' not in context.user_data['creating_task']:
-                context.user_data['creating_task']['attachments'] = []
+            filename = document.file_name or f"file_{document.file_unique_id}"
+            get_media_ingestor().schedule(
+                context.application, document.file_id, document.file_unique_id, 'document',
+                filename, document.mime_type or ''
+            )
             
-            context.user_data['creating_task']['attachments'].append({
+            is_new_attachment = self.add_attachment(creating_task, {
                 'type': 'document',
-                'file_path': local_path,
-                'filename': new_filename,
-                'original_filename': filename,
-                'file_id': file_id
+                'file_unique_id': document.file_unique_id,
+                'original_filename': filename
             })
             
-            await self.send_message(update, f"📎 Файл '{filename}' добавлен к задаче!\n\n📝 Теперь напишите описание задачи:")
+            if is_new_attachment and self.is_first_in_album(creating_task, update.message):
+                await self.send_message(update, f"📎 Файл '{filename}' добавлен к задаче!\n\n📝 Теперь напишите описание задачи:")
             
         except Exception as e:
             logger.error(f"Ошибка в handle_document_message: {e}")
             await self.send_message(update, "❌ Произошла ошибка при обработке файла.")
     
+    def add_attachment(self, creating_task, attachment):
+        """Добавить вложение к создаваемой задаче; повторно присланный файл не дублируется"""
+        attachments = creating_task.setdefault('attachments', [])
+        if any(a['file_unique_id'] == attachment['file_unique_id'] for a in attachments):
+            return False
+        attachments.append(attachment)
+        return True
+    
+    def is_first_in_album(self, creating_task, message):
+        """На альбом (media group) отвечаем одним сообщением, а не на каждый файл"""
+        if not message.media_group_id:
+            return True
+        if creating_task.get('media_group_id') == message.media_group_id:
+            return False
+        creating_task['media_group_id'] = message.media_group_id
+        return True
+    
+    def link_attachments(self, task, user, media_list):
+        """Привязать загруженные файлы к задаче как документы"""
+        ExpenseDocument.objects.bulk_create([
+            ExpenseDocument(
+                expense_item=task,
+                name=media.original_name or os.path.basename(media.file.name),
+                file=media.file.name,
+                file_type='photo' if media.is_image else 'other',
+                uploaded_by=user,
+                file_size=media.file_size
+            )
+            for media in media_list
+        ])
+    
     async def create_task_from_data(self, update: Update, context: ContextTypes.DEFAULT_TYPE, project_id: str):
         """Создание задачи из собранных данных"""
         try:
@@ -1318,31 +1292,17 @@ class ConstructionBot:
             amount = creating_task.get('amount', 0.0)
             
             # Получаем пользователя
-            telegram_user = await sync_to_async(TelegramUser.objects.get)(telegram_id=update.effective_user.id)
-            user = await sync_to_async(lambda: telegram_user.user)()
+            telegram_user = await db_async(TelegramUser.objects.get)(telegram_id=update.effective_user.id)
+            user = await db_async(lambda: telegram_user.user)()
             
             # Получаем проект
-            project = await sync_to_async(Project.objects.get)(id=project_id)
+            project = await db_async(Project.objects.get)(id=project_id)
             
             # Получаем первую колонку проекта (колонка "Новые")
-            from kanban.models import KanbanColumn
-            column = await sync_to_async(KanbanColumn.objects.filter(board__project=project).first)()
-            
-            if not column:
-                # Создаем колонку если её нет
-                from kanban.models import KanbanBoard
-                board, created = await sync_to_async(KanbanBoard.objects.get_or_create)(
-                    project=project,
-                    defaults={'created_by': user}
-                )
-                column = await sync_to_async(KanbanColumn.objects.create)(
-                    board=board,
-                    name="Новые",
-                    order=0
-                )
+            column = await db_async(self.get_intake_column)(project, user)
             
             # Создаем задачу
-            task = await sync_to_async(ExpenseItem.objects.create)(
+            task = await db_async(ExpenseItem.objects.create)(
                 title=title,
                 description=description,
                 amount=amount,
@@ -1404,13 +1364,36 @@ class ConstructionBot:
             await update.message.reply_text("🔧 Выберите тип задачи:", reply_markup=reply_markup)
     
     def run(self):
-        """Запуск бота"""
+        """Запуск бота: веб-хук, если задан TELEGRAM_WEBHOOK_URL, иначе polling"""
         logger.info("Запуск Construction Bot...")
         try:
-            self.application.run_polling()
+            if settings.TELEGRAM_WEBHOOK_URL:
+                self.run_webhook()
+            else:
+                self.application.run_polling()
         except Exception as e:
             logger.error(f"Ошибка запуска бота: {e}")
             raise
+    
+    def run_webhook(self):
+        """Запуск встроенного веб-сервера для приема обновлений через веб-хук"""
+        from urllib.parse import urlparse
+        
+        webhook_url = settings.TELEGRAM_WEBHOOK_URL
+        url_path = urlparse(webhook_url).path.strip('/') or 'telegram/webhook'
+        
+        logger.info(
+            f"Режим веб-хука: {webhook_url} "
+            f"(порт {settings.TELEGRAM_WEBHOOK_PORT}, обработчиков {settings.TELEGRAM_BOT_WORKERS})"
+        )
+        self.application.run_webhook(
+            listen=settings.TELEGRAM_WEBHOOK_LISTEN,
+            port=settings.TELEGRAM_WEBHOOK_PORT,
+            url_path=url_path,
+            webhook_url=webhook_url,
+            secret_token=settings.TELEGRAM_WEBHOOK_SECRET or None,
+            max_connections=settings.TELEGRAM_BOT_WORKERS,
+        )
 
 
 # Создаем глобальный экземпляр бота
@@ -0,0 +1,134 @@
+# Пул потоков для запросов к базе данных из обработчиков бота
+import asyncio
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseMetrics:
+    """Метрики пула: ожидание в очереди и время выполнения запросов"""
+
+    def __init__(self, log_every=500):
+        self.log_every = log_every
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = 0
+            self.errors = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+            self.exec_total = 0.0
+            self.exec_max = 0.0
+
+    def record(self, wait, execution, failed=False):
+        with self._lock:
+            self.calls += 1
+            self.errors += int(failed)
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            self.exec_total += execution
+            self.exec_max = max(self.exec_max, execution)
+            should_log = self.log_every and self.calls % self.log_every == 0
+        if should_log:
+            logger.info(f"[DB] {self.as_text()}")
+
+    def snapshot(self):
+        """Текущие значения метрик в миллисекундах"""
+        with self._lock:
+            calls = self.calls or 1
+            return {
+                'calls': self.calls,
+                'errors': self.errors,
+                'wait_avg_ms': round(self.wait_total / calls * 1000, 2),
+                'wait_max_ms': round(self.wait_max * 1000, 2),
+                'exec_avg_ms': round(self.exec_total / calls * 1000, 2),
+                'exec_max_ms': round(self.exec_max * 1000, 2),
+            }
+
+    def as_text(self):
+        data = self.snapshot()
+        return (
+            f"запросов {data['calls']} (ошибок {data['errors']}), "
+            f"ожидание {data['wait_avg_ms']} мс (макс. {data['wait_max_ms']}), "
+            f"выполнение {data['exec_avg_ms']} мс (макс. {data['exec_max_ms']})"
+        )
+
+
+class BotDatabaseExecutor:
+    """Ограниченный пул потоков для ORM-запросов бота
+
+    Каждый поток держит собственное соединение с базой, поэтому медленный
+    запрос одного чата не блокирует остальных (в отличие от
+    sync_to_async с thread_sensitive=True, где все запросы идут через один
+    поток). Время жизни соединений определяется CONN_MAX_AGE: перед и после
+    каждого вызова выполняется close_old_connections, как в цикле запроса Django.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.metrics = DatabaseMetrics()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix='bot-db'
+        )
+
+    def _call(self, func, args, kwargs, submitted_at):
+        started_at = time.monotonic()
+        failed = False
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            close_old_connections()
+            self.metrics.record(
+                started_at - submitted_at,
+                time.monotonic() - started_at,
+                failed
+            )
+
+    async def run(self, func, *args, **kwargs):
+        """Выполнить синхронную функцию в пуле и дождаться результата"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            self._call, func, args, kwargs, time.monotonic()
+        )
+
+    def shutdown(self):
+        """Остановить пул, дождавшись выполняющихся запросов"""
+        self._executor.shutdown(wait=True)
+        logger.info(f"[DB] Пул остановлен: {self.metrics.as_text()}")
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_db_executor():
+    """Пул запросов бота (создается при первом обращении)"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = BotDatabaseExecutor(settings.TELEGRAM_BOT_DB_WORKERS)
+    return _executor
+
+
+def db_async(func):
+    """Замена sync_to_async для обработчиков бота: выполнение в пуле запросов"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await get_db_executor().run(func, *args, **kwargs)
+    return wrapper
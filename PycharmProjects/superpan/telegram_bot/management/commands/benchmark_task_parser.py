@@ -0,0 +1,53 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+from telegram_bot.parsing import parse_task_message
+
+CORPUS_PATH = Path(__file__).resolve().parents[2] / 'benchmarks' / 'task_messages.txt'
+
+
+def load_corpus(path):
+    """Сообщения корпуса: разделитель "---", строки-комментарии с "#" пропускаются"""
+    text = '\n'.join(
+        line for line in path.read_text(encoding='utf-8').splitlines()
+        if not line.startswith('#')
+    )
+    return [message.strip() for message in text.split('\n---\n') if message.strip()]
+
+
+class Command(BaseCommand):
+    help = 'Замер скорости разбора сообщений бота в задачи на корпусе реальных сообщений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus', default=str(CORPUS_PATH), help='Файл с сообщениями')
+        parser.add_argument('--iterations', type=int, default=1000, help='Сколько раз разобрать корпус')
+        parser.add_argument('--show', action='store_true', help='Вывести результат разбора каждого сообщения')
+
+    def handle(self, *args, **options):
+        messages = load_corpus(Path(options['corpus']))
+        iterations = options['iterations']
+
+        if options['show']:
+            for message in messages:
+                self.stdout.write(message)
+                for task in parse_task_message(message):
+                    self.stdout.write(f"  → {task['title']!r} | {task['description']!r} | {task['amount']}")
+                self.stdout.write('')
+
+        tasks_count = sum(len(parse_task_message(message)) for message in messages)
+
+        started_at = time.perf_counter()
+        for _ in range(iterations):
+            for message in messages:
+                parse_task_message(message)
+        elapsed = time.perf_counter() - started_at
+
+        parsed = len(messages) * iterations
+        self.stdout.write(
+            f'Сообщений в корпусе: {len(messages)}, задач: {tasks_count}, итераций: {iterations}'
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'{parsed / elapsed:,.0f} сообщений/с, {elapsed / parsed * 1_000_000:.1f} мкс на сообщение'
+        ))
@@ -0,0 +1,206 @@
+"""
+Нагрузочная проверка приема обновлений через веб-хук на локальном поддельном Telegram
+Использование:
+    python manage.py benchmark_webhook_workers
+    python manage.py benchmark_webhook_workers --workers 1 2 4 8 16 --updates 2000 --chats 200 --latency 50
+
+Поднимает локальный сервер, отвечающий на методы Bot API с задержкой
+--latency мс (как сетевой запрос к настоящему Telegram), и для каждого
+числа обработчиков запускает Application с BoundedUpdateQueue и
+ChatOrderedUpdateProcessor в режиме веб-хука. Обновления отправляются
+POST-запросами на веб-хук (сообщения одного чата - по очереди, как их
+доставляет Telegram), обработчик отвечает на каждое сообщение через
+поддельный сервер. Для каждого числа обработчиков выводится пропускная
+способность; проверяется, что сообщения каждого чата обработаны по
+порядку и что Application останавливается после обработки очереди.
+"""
+import asyncio
+import json
+import logging
+import socket
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import httpx
+from django.core.management.base import BaseCommand, CommandError
+from telegram.ext import Application, MessageHandler, filters
+
+from telegram_bot.updates import BoundedUpdateQueue, ChatOrderedUpdateProcessor
+
+TOKEN = '123456:LOAD'
+
+# Сколько секунд ждать остановки Application после обработки всех обновлений
+STOP_TIMEOUT = 30
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class FakeBotApi(ThreadingHTTPServer):
+    """Поддельный сервер Bot API: отвечает на методы бота после задержки latency секунд"""
+
+    daemon_threads = True
+
+    def __init__(self, latency):
+        super().__init__(('127.0.0.1', free_port()), FakeBotApiHandler)
+        self.latency = latency
+        self.message_id = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/bot'
+
+
+class FakeBotApiHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        method = self.path.rsplit('/', 1)[-1]
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode('utf-8', 'replace')
+        params = {key: values[0] for key, values in parse_qs(body).items()}
+
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Load', 'username': 'load_bot'}
+        elif method == 'sendMessage':
+            time.sleep(self.server.latency)
+            with self.server.lock:
+                self.server.message_id += 1
+                message_id = self.server.message_id
+            result = {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': int(params.get('chat_id', 1)), 'type': 'private'},
+                'text': params.get('text', ''),
+            }
+        else:
+            result = True
+
+        payload = json.dumps({'ok': True, 'result': result}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_update(update_id, chat_id, number):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Load'},
+            'text': str(number),
+        },
+    }
+
+
+class Command(BaseCommand):
+    help = 'Пропускная способность приема обновлений через веб-хук в зависимости от числа обработчиков'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16], help='Числа обработчиков')
+        parser.add_argument('--updates', type=int, default=2000, help='Обновлений в одном прогоне')
+        parser.add_argument('--chats', type=int, default=200, help='Число чатов')
+        parser.add_argument('--latency', type=float, default=50, help='Задержка ответа Bot API, мс')
+        parser.add_argument('--queue-size', type=int, default=256, help='Лимит очереди обновлений')
+        parser.add_argument('--connections', type=int, default=100, help='Одновременных запросов к веб-хуку')
+
+    def handle(self, *args, **options):
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+        api = FakeBotApi(options['latency'] / 1000)
+        threading.Thread(target=api.serve_forever, name='fake-bot-api', daemon=True).start()
+        self.stdout.write(
+            f"Поддельный Bot API: {api.base_url}, задержка {options['latency']:g} мс; "
+            f"обновлений {options['updates']}, чатов {options['chats']}"
+        )
+
+        try:
+            baseline = None
+            for workers in options['workers']:
+                elapsed = asyncio.run(self.run_once(api, max(workers, 1), options))
+                rate = options['updates'] / elapsed
+                baseline = baseline or rate
+                self.stdout.write(
+                    f'  обработчиков {workers:>3}: {rate:8.0f} обновлений/с за {elapsed:.2f} с '
+                    f'(×{rate / baseline:.1f})'
+                )
+        finally:
+            api.shutdown()
+            api.server_close()
+
+        self.stdout.write(self.style.SUCCESS('Порядок сообщений в чатах сохранен, остановка после обработки очереди'))
+
+    async def run_once(self, api, workers, options):
+        """Один прогон: отправить все обновления на веб-хук и дождаться их обработки, вернуть время"""
+        total = options['updates']
+        chats = max(min(options['chats'], total), 1)
+        processed = defaultdict(list)
+        all_done = asyncio.Event()
+        handled = 0
+
+        async def reply(update, context):
+            nonlocal handled
+            processed[update.effective_chat.id].append(int(update.message.text))
+            await update.message.reply_text('ok')
+            handled += 1
+            if handled == total:
+                all_done.set()
+
+        update_queue = BoundedUpdateQueue(maxsize=options['queue_size'], max_in_flight=workers)
+        application = (
+            Application.builder()
+            .token(TOKEN)
+            .base_url(api.base_url)
+            .update_queue(update_queue)
+            .concurrent_updates(ChatOrderedUpdateProcessor(workers, update_queue))
+            .build()
+        )
+        application.add_handler(MessageHandler(filters.TEXT, reply))
+
+        port = free_port()
+        webhook_url = f'http://127.0.0.1:{port}/hook'
+        await application.initialize()
+        await application.updater.start_webhook(
+            listen='127.0.0.1', port=port, url_path='hook', webhook_url=webhook_url, max_connections=workers
+        )
+        await application.start()
+
+        # Сообщения чата отправляются по одному: следующее - после ответа веб-хука
+        per_chat = defaultdict(list)
+        for update_id in range(total):
+            per_chat[update_id % chats].append(update_id)
+
+        limits = httpx.Limits(max_connections=options['connections'])
+        started_at = time.perf_counter()
+        async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+            async def send_chat(chat_index, update_ids):
+                for number, update_id in enumerate(update_ids):
+                    response = await client.post(webhook_url, json=make_update(update_id, 1000 + chat_index, number))
+                    response.raise_for_status()
+
+            await asyncio.gather(*(send_chat(index, ids) for index, ids in per_chat.items()))
+            await asyncio.wait_for(all_done.wait(), timeout=STOP_TIMEOUT + total)
+        elapsed = time.perf_counter() - started_at
+
+        try:
+            await asyncio.wait_for(application.updater.stop(), STOP_TIMEOUT)
+            await asyncio.wait_for(application.stop(), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise CommandError(f'Application не остановился за {STOP_TIMEOUT} с ({workers} обработчиков)')
+        await application.shutdown()
+
+        for chat_id, numbers in processed.items():
+            if numbers != sorted(numbers):
+                raise CommandError(f'Чат {chat_id}: сообщения обработаны не по порядку ({workers} обработчиков)')
+        return elapsed
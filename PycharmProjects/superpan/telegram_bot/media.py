@@ -0,0 +1,186 @@
+# Прием фото и документов из Telegram в файловое хранилище Django
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, close_old_connections
+from django.utils import timezone
+
+from telegram_bot.db import get_db_executor
+from telegram_bot.models import TelegramMedia
+
+logger = logging.getLogger(__name__)
+
+# Размер блока при хешировании и копировании в хранилище
+CHUNK_SIZE = 64 * 1024
+
+# Файл до этого размера держится в памяти, больше - во временном файле
+SPOOL_MAX_SIZE = 1024 * 1024
+
+THUMBNAIL_SIZE = (320, 320)
+
+
+def _hash_file(fileobj):
+    """SHA-256 содержимого файла, читаемого блоками"""
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def _storage_name(media_type, original_name):
+    extension = os.path.splitext(original_name)[1].lower() or ('.jpg' if media_type == 'photo' else '')
+    return timezone.now().strftime('telegram_media/%Y/%m/') + f"{uuid.uuid4().hex}{extension}"
+
+
+class MediaIngestor:
+    """Загрузка файлов из Telegram с дедупликацией и фоновыми миниатюрами
+
+    Обработчик сообщения только ставит файл в очередь (schedule) и сразу
+    отвечает пользователю, поэтому альбом из 20 фото не задерживает
+    обработку остальных обновлений. Файл скачивается во временный буфер
+    (в памяти до SPOOL_MAX_SIZE, дальше на диске), хешируется и копируется
+    в default_storage блоками. Одновременные загрузки одного file_unique_id
+    объединяются в одну.
+    """
+
+    def __init__(self, max_workers):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix='bot-media'
+        )
+        self._in_flight = {}
+
+    def schedule(self, application, file_id, file_unique_id, media_type, original_name='', mime_type=''):
+        """Поставить файл в очередь загрузки, не дожидаясь результата"""
+        if file_unique_id not in self._in_flight:
+            task = application.create_task(
+                self._ingest(application.bot, file_id, file_unique_id, media_type, original_name, mime_type),
+                name=f"media:{file_unique_id}"
+            )
+            self._in_flight[file_unique_id] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(file_unique_id, None))
+        return self._in_flight[file_unique_id]
+
+    async def wait(self, file_unique_ids):
+        """Дождаться загрузки файлов и вернуть их записи (ненайденные пропускаются)"""
+        pending = [self._in_flight[uid] for uid in file_unique_ids if uid in self._in_flight]
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        media = await get_db_executor().run(
+            lambda: {m.file_unique_id: m for m in TelegramMedia.objects.filter(file_unique_id__in=file_unique_ids)}
+        )
+        return [media[uid] for uid in file_unique_ids if uid in media]
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def _ingest(self, bot, file_id, file_unique_id, media_type, original_name, mime_type):
+        db = get_db_executor()
+        try:
+            existing = await db.run(
+                TelegramMedia.objects.filter(file_unique_id=file_unique_id).first
+            )
+            if existing:
+                return existing
+
+            telegram_file = await bot.get_file(file_id)
+            buffer = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+            try:
+                await telegram_file.download_to_memory(buffer)
+                file_size = buffer.tell()
+                sha256 = await self._run(_hash_file, buffer)
+
+                # Такое же содержимое уже есть в хранилище - ссылаемся на него
+                same_content = await db.run(
+                    TelegramMedia.objects.filter(sha256=sha256).first
+                )
+                if same_content:
+                    file_name = same_content.file.name
+                    thumbnail_name = same_content.thumbnail.name
+                else:
+                    file_name = await self._run(
+                        default_storage.save,
+                        _storage_name(media_type, original_name),
+                        File(buffer)
+                    )
+                    thumbnail_name = ''
+            finally:
+                buffer.close()
+
+            try:
+                media = await db.run(
+                    TelegramMedia.objects.create,
+                    file_unique_id=file_unique_id,
+                    sha256=sha256,
+                    media_type=media_type,
+                    file=file_name,
+                    thumbnail=thumbnail_name,
+                    original_name=original_name,
+                    mime_type=mime_type,
+                    file_size=file_size
+                )
+            except IntegrityError:
+                # Тот же файл параллельно сохранил другой процесс бота
+                return await db.run(TelegramMedia.objects.get, file_unique_id=file_unique_id)
+
+            if media.is_image and not same_content:
+                self._executor.submit(self._make_thumbnail, media.pk, sha256, file_name)
+            return media
+
+        except Exception as e:
+            logger.error(f"Ошибка загрузки файла {file_unique_id} из Telegram: {e}")
+            raise
+
+    def _make_thumbnail(self, media_id, sha256, file_name):
+        """Создать миниатюру (выполняется в пуле bot-media)"""
+        from PIL import Image, ImageOps
+
+        try:
+            with default_storage.open(file_name, 'rb') as source:
+                image = ImageOps.exif_transpose(Image.open(source))
+                image.thumbnail(THUMBNAIL_SIZE)
+                output = io.BytesIO()
+                image.convert('RGB').save(output, format='JPEG', quality=85)
+
+            thumbnail_name = default_storage.save(
+                f"telegram_media/thumbs/{uuid.uuid4().hex}.jpg",
+                ContentFile(output.getvalue())
+            )
+            # Миниатюра общая для всех записей с тем же содержимым
+            TelegramMedia.objects.filter(sha256=sha256, thumbnail='').update(thumbnail=thumbnail_name)
+        except Exception as e:
+            logger.warning(f"Не удалось создать миниатюру для файла {media_id}: {e}")
+        finally:
+            close_old_connections()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+_ingestor = None
+_ingestor_lock = threading.Lock()
+
+
+def get_media_ingestor():
+    """Загрузчик файлов бота (создается при первом обращении)"""
+    global _ingestor
+    if _ingestor is None:
+        with _ingestor_lock:
+            if _ingestor is None:
+                _ingestor = MediaIngestor(settings.TELEGRAM_MEDIA_WORKERS)
+    return _ingestor
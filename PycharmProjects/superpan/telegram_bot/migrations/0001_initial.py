@@ -0,0 +1,30 @@
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BotState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('user', 'Данные пользователя'), ('chat', 'Данные чата'), ('conversation', 'Состояние диалога')], max_length=20, verbose_name='Тип')),
+                ('key', models.CharField(max_length=255, verbose_name='Ключ')),
+                ('data', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='Данные')),
+                ('version', models.PositiveIntegerField(default=1, verbose_name='Версия')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+            ],
+            options={
+                'verbose_name': 'Состояние бота',
+                'verbose_name_plural': 'Состояния бота',
+                'db_table': 'telegram_bot_state',
+                'unique_together': {('kind', 'key')},
+            },
+        ),
+    ]
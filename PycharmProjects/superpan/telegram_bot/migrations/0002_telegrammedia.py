@@ -0,0 +1,32 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telegram_bot', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TelegramMedia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_unique_id', models.CharField(max_length=100, unique=True, verbose_name='Telegram file_unique_id')),
+                ('sha256', models.CharField(db_index=True, max_length=64, verbose_name='SHA-256')),
+                ('media_type', models.CharField(choices=[('photo', 'Фотография'), ('document', 'Документ')], max_length=20, verbose_name='Тип')),
+                ('file', models.FileField(upload_to='telegram_media/%Y/%m/', verbose_name='Файл')),
+                ('thumbnail', models.FileField(blank=True, upload_to='telegram_media/thumbs/', verbose_name='Миниатюра')),
+                ('original_name', models.CharField(blank=True, max_length=255, verbose_name='Исходное имя файла')),
+                ('mime_type', models.CharField(blank=True, max_length=100, verbose_name='MIME-тип')),
+                ('file_size', models.PositiveIntegerField(default=0, verbose_name='Размер файла')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Загружен')),
+            ],
+            options={
+                'verbose_name': 'Файл из Telegram',
+                'verbose_name_plural': 'Файлы из Telegram',
+                'db_table': 'telegram_bot_media',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,68 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+
+class BotState(models.Model):
+    """Сохраненное состояние бота (user_data, chat_data, диалоги)
+
+    Одна запись на пользователя, чат или ключ диалога, поэтому несколько
+    процессов бота пишут независимые строки. version увеличивается при
+    каждой записи и позволяет процессу понять, что его копия устарела.
+    """
+    
+    class Kind(models.TextChoices):
+        USER = 'user', _('Данные пользователя')
+        CHAT = 'chat', _('Данные чата')
+        CONVERSATION = 'conversation', _('Состояние диалога')
+    
+    kind = models.CharField(_('Тип'), max_length=20, choices=Kind.choices)
+    key = models.CharField(_('Ключ'), max_length=255)
+    data = models.JSONField(_('Данные'), default=dict, encoder=DjangoJSONEncoder)
+    version = models.PositiveIntegerField(_('Версия'), default=1)
+    updated_at = models.DateTimeField(_('Обновлено'), auto_now=True)
+
+    class Meta:
+        verbose_name = _('Состояние бота')
+        verbose_name_plural = _('Состояния бота')
+        db_table = 'telegram_bot_state'
+        unique_together = ['kind', 'key']
+
+    def __str__(self):
+        return f"{self.get_kind_display()}: {self.key} (v{self.version})"
+
+
+class TelegramMedia(models.Model):
+    """Файл, полученный ботом из Telegram
+
+    Повторно присланный (пересланный) файл определяется по file_unique_id,
+    а такой же файл с другим file_unique_id - по SHA-256 содержимого:
+    в обоих случаях новый файл в хранилище не создается.
+    """
+    
+    class MediaType(models.TextChoices):
+        PHOTO = 'photo', _('Фотография')
+        DOCUMENT = 'document', _('Документ')
+    
+    file_unique_id = models.CharField(_('Telegram file_unique_id'), max_length=100, unique=True)
+    sha256 = models.CharField(_('SHA-256'), max_length=64, db_index=True)
+    media_type = models.CharField(_('Тип'), max_length=20, choices=MediaType.choices)
+    file = models.FileField(_('Файл'), upload_to='telegram_media/%Y/%m/')
+    thumbnail = models.FileField(_('Миниатюра'), upload_to='telegram_media/thumbs/', blank=True)
+    original_name = models.CharField(_('Исходное имя файла'), max_length=255, blank=True)
+    mime_type = models.CharField(_('MIME-тип'), max_length=100, blank=True)
+    file_size = models.PositiveIntegerField(_('Размер файла'), default=0)
+    created_at = models.DateTimeField(_('Загружен'), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('Файл из Telegram')
+        verbose_name_plural = _('Файлы из Telegram')
+        db_table = 'telegram_bot_media'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return self.original_name or self.file.name
+
+    @property
+    def is_image(self):
+        return self.media_type == self.MediaType.PHOTO or self.mime_type.startswith('image/')
@@ -0,0 +1,128 @@
+# Постраничный вывод списков бота по ключу (keyset pagination)
+import base64
+import hashlib
+import uuid
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.cache import cache
+from django.db.models import Q
+
+# Ограничение Telegram на размер callback_data (байт)
+CALLBACK_DATA_LIMIT = 64
+
+# Сколько секунд хранится отрисованная страница
+PAGE_CACHE_TTL = 30
+
+# Направления перехода
+NEXT = 'n'
+PREV = 'p'
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def _to_base36(number):
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    result = ''
+    while True:
+        number, remainder = divmod(number, 36)
+        result = digits[remainder] + result
+        if not number:
+            return result
+
+
+def encode_uuid(value):
+    """UUID в 22 символа base64url"""
+    return base64.urlsafe_b64encode(value.bytes).rstrip(b'=').decode('ascii')
+
+
+def decode_uuid(value):
+    return uuid.UUID(bytes=base64.urlsafe_b64decode(value + '=='))
+
+
+def encode_cursor(created_at, pk):
+    """Курсор позиции в списке: время создания в мкс (base36) и UUID записи"""
+    delta = created_at - _EPOCH
+    micros = (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+    return f"{_to_base36(micros)}.{encode_uuid(pk)}"
+
+
+def decode_cursor(cursor):
+    micros, pk = cursor.split('.', 1)
+    micros = int(micros, 36)
+    created_at = datetime.fromtimestamp(micros // 1000000, tz=dt_timezone.utc).replace(
+        microsecond=micros % 1000000
+    )
+    return created_at, decode_uuid(pk)
+
+
+def build_callback(prefix, direction, cursor):
+    """callback_data кнопки перехода: <prefix>:<направление>:<курсор>"""
+    data = f"{prefix}:{direction}:{cursor}"
+    if len(data.encode('utf-8')) > CALLBACK_DATA_LIMIT:
+        raise ValueError(f"callback_data длиннее {CALLBACK_DATA_LIMIT} байт: {data}")
+    return data
+
+
+def parse_callback(data):
+    """Разбор callback_data кнопки перехода: (prefix, направление, курсор)"""
+    prefix, direction, cursor = data.rsplit(':', 2)
+    return prefix, direction, cursor
+
+
+class Page:
+    """Страница списка, выбранная по курсору"""
+
+    def __init__(self, items, has_prev, has_next):
+        self.items = items
+        self.has_prev = has_prev
+        self.has_next = has_next
+
+    @property
+    def first_cursor(self):
+        return encode_cursor(self.items[0].created_at, self.items[0].pk)
+
+    @property
+    def last_cursor(self):
+        return encode_cursor(self.items[-1].created_at, self.items[-1].pk)
+
+
+def fetch_page(queryset, page_size, cursor=None, direction=NEXT):
+    """Выбрать страницу из queryset, упорядоченного по (-created_at, -pk)
+
+    Вместо OFFSET используется условие по ключу последней показанной записи,
+    поэтому стоимость запроса не зависит от номера страницы.
+    """
+    if cursor is None:
+        items = list(queryset.order_by('-created_at', '-pk')[:page_size + 1])
+        return Page(items[:page_size], has_prev=False, has_next=len(items) > page_size)
+
+    created_at, pk = decode_cursor(cursor)
+    if direction == PREV:
+        items = list(
+            queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, pk__gt=pk))
+            .order_by('created_at', 'pk')[:page_size + 1]
+        )
+        has_prev = len(items) > page_size
+        items = items[:page_size]
+        items.reverse()
+        return Page(items, has_prev=has_prev, has_next=True)
+
+    items = list(
+        queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+        .order_by('-created_at', '-pk')[:page_size + 1]
+    )
+    return Page(items[:page_size], has_prev=True, has_next=len(items) > page_size)
+
+
+def _page_cache_key(*parts):
+    raw = ':'.join(str(part) for part in parts)
+    return f"bot_page:{hashlib.md5(raw.encode('utf-8')).hexdigest()}"
+
+
+def get_cached_page(*parts):
+    """Отрисованная страница (текст и кнопки) из кэша или None"""
+    return cache.get(_page_cache_key(*parts))
+
+
+def set_cached_page(rendered, *parts):
+    cache.set(_page_cache_key(*parts), rendered, PAGE_CACHE_TTL)
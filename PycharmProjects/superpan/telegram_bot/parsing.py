@@ -0,0 +1,117 @@
+# Разбор текста сообщений бота в задачи: название, описание и сумма
+import re
+from decimal import Decimal, InvalidOperation
+
+# Сколько задач создается из одного нумерованного списка
+MAX_TASKS_PER_MESSAGE = 20
+
+# Сколько слов берется в название, если в тексте нет ни точки, ни ключевого слова
+TITLE_FALLBACK_WORDS = 5
+
+NUMBERED_ITEM_RE = re.compile(r'^\s*\d+[.)]\s*(.+)$', re.MULTILINE)
+
+# Единый шаблон для разбора за один проход: сумма с единицей измерения,
+# конец предложения или ключевое слово перед названием задачи
+TOKEN_RE = re.compile(
+    r"""
+    (?<!\w)(?P<amount>\d{1,3}(?:[  ]\d{3})+(?:[.,]\d+)?|\d+(?:[.,]\d+)?)
+    \s*
+    (?P<unit>
+        (?:тысяч[аи]?|тыс\.?|к)(?:\s*(?:руб(?:лей|ля|ль)?|₽|р)\.?)?
+        |(?:руб(?:лей|ля|ль)?|₽|р)\.?
+    )
+    (?!\w)
+    |
+    (?P<end>[.!?])
+    |
+    (?<!\w)(?P<keyword>задача|нужно|сделать)[:\s]+
+    """,
+    re.IGNORECASE | re.VERBOSE
+)
+
+DESCRIPTION_CLEANUP_RE = re.compile(r'[^\w\s.,!?-]')
+MULTISPACE_RE = re.compile(r'[ \t]{2,}')
+
+THOUSAND_UNITS = ('тыс', 'к')
+
+
+def _parse_amount(number, unit):
+    number = number.replace(' ', '').replace(' ', '').replace(',', '.')
+    try:
+        amount = Decimal(number)
+    except InvalidOperation:
+        return Decimal('0')
+    if unit.lower().startswith(THOUSAND_UNITS):
+        amount *= 1000
+    return amount
+
+
+def parse_single_task(text):
+    """Извлечение названия, описания и суммы одной задачи
+
+    Текст просматривается одним проходом TOKEN_RE: первая найденная сумма
+    становится суммой задачи, все суммы вырезаются из текста, а позиции
+    конца первого предложения и ключевого слова («задача:», «нужно»,
+    «сделать») запоминаются для выделения названия.
+    """
+    amount = None
+    parts = []
+    clean_length = 0
+    last = 0
+    first_end = None
+    keyword_at = None
+    keyword_end = None
+
+    for match in TOKEN_RE.finditer(text):
+        kind = match.lastgroup
+        if kind == 'unit':
+            if amount is None:
+                amount = _parse_amount(match.group('amount'), match.group('unit'))
+            parts.append(text[last:match.start()])
+            clean_length += match.start() - last
+            last = match.end()
+            continue
+
+        position = clean_length + match.start() - last
+        if kind == 'end':
+            if first_end is None:
+                first_end = position
+            if keyword_at is not None and keyword_end is None:
+                keyword_end = position
+        elif keyword_at is None:
+            keyword_at = position + len(match.group())
+
+    parts.append(text[last:])
+    clean_text = ''.join(parts)
+
+    # Название: до первой точки, иначе после ключевого слова, иначе первые слова
+    title = ''
+    if first_end:
+        title = clean_text[:first_end].strip()
+    if not title and keyword_at is not None:
+        title = clean_text[keyword_at:keyword_end].strip()
+
+    if title:
+        description = clean_text.replace(title, '', 1)
+    else:
+        words = clean_text.split()
+        title = ' '.join(words[:TITLE_FALLBACK_WORDS])
+        description = ' '.join(words[TITLE_FALLBACK_WORDS:])
+    description = MULTISPACE_RE.sub(' ', description).strip().lstrip('.!?,- ')
+
+    return {
+        'title': title,
+        'description': DESCRIPTION_CLEANUP_RE.sub('', description),
+        'amount': amount or Decimal('0'),
+    }
+
+
+def parse_task_message(text):
+    """Разбор сообщения: нумерованный список - несколько задач, иначе одна"""
+    tasks = []
+    for match in NUMBERED_ITEM_RE.finditer(text):
+        tasks.append(parse_single_task(match.group(1).strip()))
+        if len(tasks) == MAX_TASKS_PER_MESSAGE:
+            break
+
+    return tasks or [parse_single_task(text)]
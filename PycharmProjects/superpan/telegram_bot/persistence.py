@@ -0,0 +1,299 @@
+# Хранение user_data, chat_data и состояний диалогов бота в базе данных
+import asyncio
+import copy
+import json
+import logging
+import time
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from telegram.ext import BasePersistence, PersistenceInput
+
+from telegram_bot.db import get_db_executor
+from telegram_bot.models import BotState
+
+logger = logging.getLogger(__name__)
+
+USER = BotState.Kind.USER
+CHAT = BotState.Kind.CHAT
+CONVERSATION = BotState.Kind.CONVERSATION
+
+
+def _conversation_key(name, key):
+    return f"{name}:{json.dumps(list(key))}"
+
+
+class DjangoPersistence(BasePersistence):
+    """Persistence для python-telegram-bot на таблице BotState
+
+    Application передает измененные данные раз в update_interval секунд.
+    Записи не уходят в базу по одной: они собираются в набор «грязных»
+    ключей (повторные изменения одного ключа схлопываются, неизмененные
+    данные пропускаются) и сохраняются одной транзакцией пакетами по
+    batch_size строк.
+
+    Каждый пользователь, чат и ключ диалога хранится отдельной строкой с
+    номером версии, поэтому бот можно запускать в нескольких процессах:
+    перед обработкой обновления refresh_* подгружает строку, если другой
+    процесс записал более новую версию, а при записи строка, измененная
+    другим процессом, не перезаписывается устаревшими данными.
+    """
+
+    def __init__(self, update_interval=5, batch_size=500, refresh_interval=1.0):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, callback_data=False),
+            update_interval=update_interval
+        )
+        self.batch_size = batch_size
+        self.refresh_interval = refresh_interval
+        # Версии и данные, известные этому процессу как сохраненные. Данные
+        # хранятся глубокими копиями: обработчики меняют вложенные словари
+        # user_data на месте, и общая ссылка скрыла бы такие изменения
+        self._versions = {}
+        self._saved = {}
+        self._checked_at = {}
+        # Несохраненные изменения: (kind, key) -> данные или None (удаление)
+        self._dirty = {}
+        self._flush_task = None
+        self._flush_lock = asyncio.Lock()
+
+    # Загрузка при старте
+
+    def _load(self, kind, prefix=''):
+        rows = BotState.objects.filter(kind=kind)
+        if prefix:
+            rows = rows.filter(key__startswith=prefix)
+        result = {}
+        for key, data, version in rows.values_list('key', 'data', 'version').iterator():
+            self._versions[(kind, key)] = version
+            self._saved[(kind, key)] = copy.deepcopy(data)
+            result[key] = data
+        return result
+
+    async def _load_kind(self, kind, prefix=''):
+        return await get_db_executor().run(self._load, kind, prefix)
+
+    async def get_user_data(self):
+        rows = await self._load_kind(USER)
+        return {int(key): dict(data) for key, data in rows.items()}
+
+    async def get_chat_data(self):
+        rows = await self._load_kind(CHAT)
+        return {int(key): dict(data) for key, data in rows.items()}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        prefix = f"{name}:"
+        rows = await self._load_kind(CONVERSATION, prefix)
+        return {
+            tuple(json.loads(key[len(prefix):])): data['state']
+            for key, data in rows.items()
+        }
+
+    # Изменения от Application
+
+    async def update_user_data(self, user_id, data):
+        self._mark(USER, str(user_id), data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._mark(CHAT, str(chat_id), data)
+
+    async def update_conversation(self, name, key, new_state):
+        state = None if new_state is None else {'state': new_state}
+        self._mark(CONVERSATION, _conversation_key(name, key), state)
+
+    async def drop_user_data(self, user_id):
+        self._mark(USER, str(user_id), None)
+
+    async def drop_chat_data(self, chat_id):
+        self._mark(CHAT, str(chat_id), None)
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    def _mark(self, kind, key, data):
+        state_key = (kind, key)
+        if data is None and state_key not in self._saved:
+            self._dirty.pop(state_key, None)
+            return
+        if data is not None and self._saved.get(state_key) == data:
+            # Данные не изменились с последней записи
+            self._dirty.pop(state_key, None)
+            return
+
+        # Снимок на момент вызова: дальнейшие изменения на месте попадут в следующий update_*
+        self._dirty[state_key] = copy.deepcopy(data)
+        if self._flush_task is None or self._flush_task.done():
+            # Application вызывает update_* для всех ключей одновременно:
+            # задача записи запустится после них и заберет все изменения разом
+            self._flush_task = asyncio.create_task(self._flush_dirty())
+
+    # Подгрузка изменений других процессов
+
+    async def refresh_user_data(self, user_id, user_data):
+        await self._refresh(USER, str(user_id), user_data)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        await self._refresh(CHAT, str(chat_id), chat_data)
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def _refresh(self, kind, key, data):
+        state_key = (kind, key)
+        if state_key in self._dirty:
+            # Локальные изменения еще не записаны - они новее базы
+            return
+
+        now = time.monotonic()
+        if now - self._checked_at.get(state_key, 0) < self.refresh_interval:
+            return
+        self._checked_at[state_key] = now
+
+        row = await get_db_executor().run(
+            self._load_newer, kind, key, self._versions.get(state_key, 0)
+        )
+        if row is None:
+            return
+
+        stored, version = row
+        data.clear()
+        data.update(stored)
+        self._versions[state_key] = version
+        self._saved[state_key] = copy.deepcopy(stored)
+
+    def _load_newer(self, kind, key, version):
+        return (
+            BotState.objects
+            .filter(kind=kind, key=key, version__gt=version)
+            .values_list('data', 'version')
+            .first()
+        )
+
+    # Запись
+
+    async def _flush_dirty(self):
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+
+            dirty, self._dirty = self._dirty, {}
+            expected = {state_key: self._versions.get(state_key, 0) for state_key in dirty}
+            try:
+                written = await get_db_executor().run(self._write, dirty, expected)
+            except Exception as e:
+                logger.error(f"Ошибка сохранения состояния бота: {e}")
+                # Вернем изменения в очередь, не затирая появившиеся за это время
+                for state_key, data in dirty.items():
+                    self._dirty.setdefault(state_key, data)
+                return
+
+            for state_key, version in written.items():
+                if version:
+                    self._versions[state_key] = version
+                    self._saved[state_key] = dirty[state_key]
+                else:
+                    self._versions.pop(state_key, None)
+                    self._saved.pop(state_key, None)
+
+    def _write(self, dirty, expected):
+        """Записать пакет изменений, возвращает {(kind, key): новая версия или 0}"""
+        keys_by_kind = defaultdict(list)
+        for kind, key in dirty:
+            keys_by_kind[kind].append(key)
+
+        written = {}
+        conflicts = 0
+        with transaction.atomic():
+            current = {}
+            for kind, keys in keys_by_kind.items():
+                for start in range(0, len(keys), self.batch_size):
+                    rows = BotState.objects.select_for_update().filter(
+                        kind=kind, key__in=keys[start:start + self.batch_size]
+                    )
+                    for row in rows:
+                        current[(kind, row.key)] = row
+
+            to_create, to_update, to_delete = [], [], []
+            now = timezone.now()
+            for state_key, data in dirty.items():
+                row = current.get(state_key)
+                if row is not None and row.version != expected[state_key]:
+                    # Строку изменил другой процесс: его данные новее,
+                    # они будут подгружены при следующем refresh
+                    conflicts += 1
+                    continue
+
+                if data is None:
+                    if row is not None:
+                        to_delete.append(row.pk)
+                    written[state_key] = 0
+                elif row is None:
+                    kind, key = state_key
+                    version = expected[state_key] + 1
+                    to_create.append(BotState(kind=kind, key=key, data=data, version=version))
+                    written[state_key] = version
+                else:
+                    row.data = data
+                    row.version += 1
+                    row.updated_at = now
+                    to_update.append(row)
+                    written[state_key] = row.version
+
+            if to_create:
+                conflicts += self._create(to_create, written)
+            if to_update:
+                BotState.objects.bulk_update(
+                    to_update, ['data', 'version', 'updated_at'], batch_size=self.batch_size
+                )
+            for start in range(0, len(to_delete), self.batch_size):
+                BotState.objects.filter(pk__in=to_delete[start:start + self.batch_size]).delete()
+
+        if conflicts:
+            logger.warning(f"[PERSISTENCE] Пропущено {conflicts} записей, измененных другим процессом")
+        logger.debug(
+            f"[PERSISTENCE] Сохранено: новых {len(to_create)}, "
+            f"обновлено {len(to_update)}, удалено {len(to_delete)}"
+        )
+        return written
+
+    def _create(self, rows, written):
+        """Вставить новые строки, возвращает число строк, уже созданных другим процессом
+
+        Отсутствующую строку нельзя заблокировать select_for_update, поэтому
+        другой процесс может вставить тот же ключ одновременно. Тогда пакет
+        повторяется по одной строке, и строки с конфликтом не считаются
+        записанными.
+        """
+        try:
+            with transaction.atomic():
+                BotState.objects.bulk_create(rows, batch_size=self.batch_size)
+            return 0
+        except IntegrityError:
+            pass
+
+        conflicts = 0
+        for row in rows:
+            row.pk = None
+            try:
+                with transaction.atomic():
+                    row.save(force_insert=True)
+            except IntegrityError:
+                written.pop((row.kind, row.key), None)
+                conflicts += 1
+        return conflicts
+
+    async def flush(self):
+        """Вызывается при остановке бота: записать все несохраненные изменения"""
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._flush_dirty()
@@ -0,0 +1,153 @@
+# Поиск проектов и задач для inline-режима бота
+import hashlib
+
+from django.core.cache import cache
+
+from accounts.models import TelegramUser
+from kanban.models import ExpenseItem
+
+# Время жизни кэша результатов и списка доступных проектов (сек.)
+SEARCH_CACHE_TTL = 60
+PROJECTS_CACHE_TTL = 120
+
+# Минимальная длина запроса для поиска по задачам
+MIN_QUERY_LENGTH = 2
+
+# Сколько результатов собирается на один запрос (Telegram отдает страницами)
+MAX_RESULTS = 100
+
+
+def normalize_query(query):
+    """Приведение запроса к виду, используемому в ключах кэша"""
+    return ' '.join(query.split()).casefold()
+
+
+def _results_key(telegram_id, query):
+    query_hash = hashlib.md5(query.encode('utf-8')).hexdigest()
+    return f"bot_inline:{telegram_id}:{query_hash}"
+
+
+def _projects_key(telegram_id):
+    return f"bot_inline_projects:{telegram_id}"
+
+
+def get_accessible_projects(telegram_id):
+    """Доступные пользователю проекты (кэшируются на PROJECTS_CACHE_TTL)
+
+    Возвращает None, если Telegram аккаунт не привязан к пользователю.
+    """
+    projects = cache.get(_projects_key(telegram_id))
+    if projects is not None:
+        return projects
+
+    try:
+        telegram_user = TelegramUser.objects.select_related('user').get(telegram_id=telegram_id)
+    except TelegramUser.DoesNotExist:
+        return None
+
+    projects = list(
+        telegram_user.user.get_accessible_projects()
+        .order_by('-created_at')
+        .values('id', 'name', 'description', 'status', 'budget', 'spent_amount')
+    )
+    cache.set(_projects_key(telegram_id), projects, PROJECTS_CACHE_TTL)
+    return projects
+
+
+def _project_result(project):
+    return {
+        'kind': 'project',
+        'id': str(project['id']),
+        'title': project['name'],
+        'description': (project['description'] or '')[:100],
+        'status': project['status'],
+        'amount': project['budget'],
+        'spent': project['spent_amount'],
+        'project_name': project['name'],
+        'search_text': f"{project['name']} {project['description'] or ''}".casefold(),
+    }
+
+
+def _task_result(task):
+    return {
+        'kind': 'task',
+        'id': str(task['id']),
+        'title': task['title'],
+        'description': (task['description'] or '')[:100],
+        'status': task['status'],
+        'amount': task['amount'],
+        'spent': None,
+        'project_name': task['project__name'],
+        'search_text': task['search_text'],
+    }
+
+
+def _search_database(projects, query):
+    """Поиск по базе в пределах доступных проектов
+
+    Задачи фильтруются в SQL по ExpenseItem.search_text - названию и
+    описанию в casefold, как и запрос, поэтому «цемент» находит «Цемент»
+    и в SQLite, где LIKE не различает регистр только для латиницы. Из
+    базы читается не больше лимита результатов (и одна строка сверх него,
+    чтобы понять, обрезан ли результат).
+    """
+    results = [r for r in map(_project_result, projects) if query in r['search_text']]
+
+    tasks = (
+        ExpenseItem.objects
+        .filter(project_id__in=[p['id'] for p in projects], search_text__contains=query)
+        .order_by('-created_at')
+        .values('id', 'title', 'description', 'status', 'amount', 'project__name', 'search_text')
+        [:max(MAX_RESULTS + 1 - len(results), 0)]
+    )
+    results.extend(map(_task_result, tasks))
+
+    complete = len(results) <= MAX_RESULTS
+    return results[:MAX_RESULTS], complete
+
+
+def search_projects_and_tasks(telegram_id, query):
+    """Поиск проектов и задач пользователя по строке запроса
+
+    Результаты кэшируются по паре (пользователь, запрос). Если в кэше есть
+    полный (не обрезанный лимитом) результат для более короткого префикса
+    запроса, новый результат получается фильтрацией кэша без обращения к базе:
+    все совпадения длинного запроса содержатся среди совпадений его префикса.
+
+    Возвращает None, если пользователь не авторизован.
+    """
+    query = normalize_query(query)
+
+    cached = cache.get(_results_key(telegram_id, query))
+    if cached is not None:
+        return cached['results']
+
+    projects = get_accessible_projects(telegram_id)
+    if projects is None:
+        return None
+
+    if len(query) < MIN_QUERY_LENGTH:
+        # Пустой или слишком короткий запрос: последние проекты пользователя
+        return [_project_result(p) for p in projects[:MAX_RESULTS]]
+
+    for length in range(len(query) - 1, MIN_QUERY_LENGTH - 1, -1):
+        prefix_entry = cache.get(_results_key(telegram_id, query[:length]))
+        if prefix_entry is None:
+            continue
+        if prefix_entry['complete']:
+            results = [r for r in prefix_entry['results'] if query in r['search_text']]
+            cache.set(
+                _results_key(telegram_id, query),
+                {'results': results, 'complete': True},
+                SEARCH_CACHE_TTL
+            )
+            return results
+        break
+
+    results, complete = _search_database(projects, query)
+    cache.set(
+        _results_key(telegram_id, query),
+        {'results': results, 'complete': complete},
+        SEARCH_CACHE_TTL
+    )
+    return results
@@ -0,0 +1,215 @@
+# Очередь и параллельная обработка входящих обновлений Telegram
+import asyncio
+import logging
+from collections import deque
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+def update_chat_key(update):
+    """Ключ упорядочивания: чат, а для inline-запросов - пользователь"""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return update.effective_user.id
+    return None
+
+
+class _ChatBacklog:
+    """Ожидающие обновления по чатам и очередь готовых к выдаче
+
+    Чат готов к выдаче, если у него есть ожидающие обновления и ни одно
+    его обновление сейчас не обрабатывается. Обновления без чата готовы
+    сразу. Прочие объекты очереди (сигнал остановки Application и т.п.)
+    выдаются только после всех обновлений, поставленных раньше них.
+    len и bool учитывают все ожидающие элементы, available - есть ли
+    что выдать сейчас.
+    """
+
+    def __init__(self):
+        self.seq = 0
+        # ключ -> deque[(номер, обновление)]; обновление без чата - под
+        # собственным ключом (None, номер)
+        self.pending = {}
+        # Чаты в обработке или в очереди готовых
+        self.scheduled = set()
+        self.ready = deque()
+        # (номер, объект) - не обновления, в порядке постановки
+        self.deferred = deque()
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __bool__(self):
+        return self.size > 0
+
+    def _deferred_released(self):
+        if not self.deferred:
+            return False
+        seq = self.deferred[0][0]
+        return all(updates[0][0] > seq for updates in self.pending.values())
+
+    def available(self):
+        return bool(self.ready) or self._deferred_released()
+
+    def put(self, item):
+        self.seq += 1
+        self.size += 1
+        if not isinstance(item, Update):
+            self.deferred.append((self.seq, item))
+            return
+        key = update_chat_key(item)
+        if key is None:
+            key = (None, self.seq)
+            self.pending[key] = deque([(self.seq, item)])
+            self.ready.append(key)
+            return
+        self.pending.setdefault(key, deque()).append((self.seq, item))
+        if key not in self.scheduled:
+            self.scheduled.add(key)
+            self.ready.append(key)
+
+    def get(self):
+        self.size -= 1
+        if self._deferred_released():
+            return self.deferred.popleft()[1]
+        key = self.ready.popleft()
+        updates = self.pending[key]
+        _, update = updates.popleft()
+        if not updates:
+            del self.pending[key]
+        return update
+
+    def done(self, update):
+        """Обработка обновления завершена: следующее обновление чата готово к выдаче"""
+        key = update_chat_key(update)
+        if key is None:
+            return
+        if key in self.pending:
+            self.ready.append(key)
+        else:
+            self.scheduled.discard(key)
+
+
+class BoundedUpdateQueue(asyncio.Queue):
+    """Ограниченная очередь обновлений бота с выдачей по чатам
+
+    maxsize ограничивает число обновлений, ожидающих в очереди: когда она
+    заполнена, обработчик веб-хука ждет места в очереди и не отвечает
+    Telegram, так что обновления не принимаются быстрее, чем
+    обрабатываются. max_in_flight ограничивает число обновлений, уже
+    взятых из очереди, но еще не обработанных.
+
+    Обновления одного чата выдаются по одному: следующее - только после
+    release предыдущего, а пока чат занят, из очереди выдаются обновления
+    других чатов. Поэтому место в обработке никогда не ждет блокировки
+    чата, и поток сообщений из одного чата не задерживает остальные.
+    empty и qsize учитывают и обновления занятых чатов, а сигнал
+    остановки Application выдается после всех них - остановка дожидается
+    обработки очереди.
+    """
+
+    def __init__(self, maxsize: int, max_in_flight: int):
+        super().__init__(maxsize=maxsize)
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._available = asyncio.Event()
+
+    def _init(self, maxsize):
+        self._queue = _ChatBacklog()
+
+    def _put(self, item):
+        self._queue.put(item)
+        if self._queue.available():
+            self._available.set()
+
+    def _get(self):
+        return self._queue.get()
+
+    def get_nowait(self):
+        if not self._queue.available():
+            raise asyncio.QueueEmpty
+        return super().get_nowait()
+
+    async def get(self):
+        await self._in_flight.acquire()
+        try:
+            while not self._queue.available():
+                self._available.clear()
+                await self._available.wait()
+            item = self.get_nowait()
+        except BaseException:
+            self._in_flight.release()
+            raise
+        if not isinstance(item, Update):
+            # Место в обработке занимают только обновления: остальные
+            # объекты (сигнал остановки) не возвращаются через release
+            self._in_flight.release()
+        return item
+
+    def release(self, update):
+        """Освободить место после завершения обработки обновления"""
+        if not isinstance(update, Update):
+            return
+        self._queue.done(update)
+        if self._queue.available():
+            self._available.set()
+        self._in_flight.release()
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Пул обработчиков обновлений с сохранением порядка внутри чата
+
+    Обновления разных чатов обрабатываются параллельно (не более
+    max_concurrent_updates одновременно), а обновления одного чата -
+    строго в порядке поступления.
+    """
+
+    def __init__(self, max_concurrent_updates: int, update_queue: BoundedUpdateQueue = None):
+        super().__init__(max_concurrent_updates)
+        self.update_queue = update_queue
+        self._chat_locks = {}
+        self._chat_waiters = {}
+
+    @staticmethod
+    def get_chat_key(update):
+        return update_chat_key(update)
+
+    async def process_update(self, update, coroutine):
+        try:
+            key = self.get_chat_key(update)
+            if key is None:
+                await super().process_update(update, coroutine)
+                return
+
+            # С BoundedUpdateQueue обновления чата приходят по одному и
+            # блокировка свободна; без нее она сохраняет порядок в чате
+            lock = self._chat_locks.get(key)
+            if lock is None:
+                lock = self._chat_locks[key] = asyncio.Lock()
+            self._chat_waiters[key] = self._chat_waiters.get(key, 0) + 1
+            try:
+                async with lock:
+                    await super().process_update(update, coroutine)
+            finally:
+                self._chat_waiters[key] -= 1
+                if not self._chat_waiters[key]:
+                    del self._chat_waiters[key]
+                    del self._chat_locks[key]
+        finally:
+            if self.update_queue is not None:
+                self.update_queue.release(update)
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -1,6 +1,9 @@
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import WarehouseCategory, WarehouseItem, WarehouseTransaction, ProjectEquipment
+from .models import (
+    WarehouseCategory, WarehouseLocation, WarehouseItem, StockBalance, WarehouseDocument, WarehouseTransaction,
+    WarehouseStockSnapshot, StockLot, ReorderSuggestion, ProjectEquipment
+)
 
 @admin.register(WarehouseCategory)
 class WarehouseCategoryAdmin(admin.ModelAdmin):
@@ -9,6 +12,24 @@ class WarehouseCategoryAdmin(admin.ModelAdmin):
     search_fields = ['name', 'description']
     ordering = ['name']
 
+@admin.register(WarehouseLocation)
+class WarehouseLocationAdmin(admin.ModelAdmin):
+    list_display = ['name', 'location_type', 'project', 'address', 'is_active', 'created_at']
+    list_filter = ['location_type', 'is_active']
+    search_fields = ['name', 'address', 'project__name']
+    ordering = ['location_type', 'name']
+
+@admin.register(StockBalance)
+class StockBalanceAdmin(admin.ModelAdmin):
+    list_display = ['item', 'location', 'quantity', 'updated_at']
+    list_filter = ['location']
+    search_fields = ['item__name', 'location__name']
+    ordering = ['location__name', 'item__name']
+    readonly_fields = ['item', 'location', 'quantity', 'updated_at']
+
+    def has_add_permission(self, request):
+        return False
+
 @admin.register(WarehouseItem)
 class WarehouseItemAdmin(admin.ModelAdmin):
     list_display = [
@@ -40,23 +61,48 @@ class WarehouseItemAdmin(admin.ModelAdmin):
         }),
     )
 
+class WarehouseDocumentLineInline(admin.TabularInline):
+    model = WarehouseTransaction
+    fields = ['item', 'quantity', 'quantity_delta', 'balance_after', 'price', 'total_amount', 'description']
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+@admin.register(WarehouseDocument)
+class WarehouseDocumentAdmin(admin.ModelAdmin):
+    list_display = [
+        'id', 'document_type', 'number', 'document_date', 'location', 'counterparty',
+        'project', 'lines_count', 'total_amount', 'created_at', 'created_by'
+    ]
+    list_filter = ['document_type', 'created_at', 'project']
+    search_fields = ['number', 'counterparty', 'description']
+    ordering = ['-created_at']
+    readonly_fields = ['document_type', 'lines_count', 'total_amount', 'created_at', 'created_by']
+    inlines = [WarehouseDocumentLineInline]
+
 @admin.register(WarehouseTransaction)
 class WarehouseTransactionAdmin(admin.ModelAdmin):
     list_display = [
-        'item', 'transaction_type', 'quantity', 'price', 
-        'total_amount', 'project', 'created_at', 'created_by'
+        'item', 'transaction_type', 'quantity', 'quantity_delta', 'balance_after', 'price', 
+        'total_amount', 'location', 'to_location', 'project', 'created_at', 'created_by'
     ]
-    list_filter = ['transaction_type', 'created_at', 'project']
+    list_filter = ['transaction_type', 'created_at', 'location', 'project']
     search_fields = ['item__name', 'description', 'reference_number']
     ordering = ['-created_at']
-    readonly_fields = ['total_amount', 'created_at']
+    readonly_fields = ['total_amount', 'quantity_delta', 'balance_after', 'cost_amount', 'created_at']
     
     fieldsets = (
         ('Основная информация', {
-            'fields': ('item', 'transaction_type', 'quantity', 'price', 'total_amount')
+            'fields': ('item', 'transaction_type', 'location', 'to_location', 'quantity', 'price', 'total_amount')
+        }),
+        ('Проводка', {
+            'fields': ('quantity_delta', 'balance_after', 'cost_amount')
         }),
         ('Связи', {
-            'fields': ('project', 'created_by')
+            'fields': ('project', 'document', 'created_by')
         }),
         ('Дополнительно', {
             'fields': ('description', 'reference_number')
@@ -67,6 +113,44 @@ class WarehouseTransactionAdmin(admin.ModelAdmin):
         }),
     )
 
+@admin.register(StockLot)
+class StockLotAdmin(admin.ModelAdmin):
+    list_display = ['item', 'received_at', 'quantity', 'remaining_quantity', 'unit_cost']
+    list_filter = ['received_at']
+    search_fields = ['item__name']
+    ordering = ['item__name', 'received_at']
+    readonly_fields = ['transaction', 'item', 'received_at', 'quantity', 'remaining_quantity', 'unit_cost']
+
+    def has_add_permission(self, request):
+        return False
+
+@admin.register(WarehouseStockSnapshot)
+class WarehouseStockSnapshotAdmin(admin.ModelAdmin):
+    list_display = ['item', 'period_end', 'quantity', 'created_at']
+    list_filter = ['period_end']
+    search_fields = ['item__name']
+    ordering = ['-period_end', 'item__name']
+    readonly_fields = ['item', 'period_end', 'quantity', 'created_at']
+
+    def has_add_permission(self, request):
+        return False
+
+@admin.register(ReorderSuggestion)
+class ReorderSuggestionAdmin(admin.ModelAdmin):
+    list_display = [
+        'item', 'current_quantity', 'daily_usage', 'days_until_stockout',
+        'reorder_point', 'suggested_quantity', 'computed_at'
+    ]
+    search_fields = ['item__name']
+    ordering = ['days_until_stockout']
+    readonly_fields = [
+        'item', 'current_quantity', 'daily_usage', 'usage_short_window', 'usage_long_window',
+        'reorder_point', 'days_until_stockout', 'stockout_date', 'suggested_quantity', 'computed_at'
+    ]
+
+    def has_add_permission(self, request):
+        return False
+
 @admin.register(ProjectEquipment)
 class ProjectEquipmentAdmin(admin.ModelAdmin):
     list_display = [
@@ -0,0 +1,263 @@
+# Оценка склада по FIFO: партии поступлений и их списание операциями;
+# себестоимость списания на проект проводится в журнал расходов проекта
+from collections import deque
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum
+from django.utils.translation import gettext_lazy as _
+
+from projects.ledger import EntryType, post_entries, post_entry
+from projects.models import ProjectLedgerEntry
+
+from .models import LotConsumption, StockLot, WarehouseItem, WarehouseTransaction
+
+ZERO = Decimal('0.00')
+CENT = Decimal('0.01')
+
+
+def charged_transactions():
+    """Операции, себестоимость которых списана на проект: уменьшение остатка с проектом"""
+    return WarehouseTransaction.objects.filter(
+        project__isnull=False, quantity_delta__lt=0, cost_amount__isnull=False
+    )
+
+
+class LotQueue:
+    """Открытые партии одного товара в порядке поступления
+
+    Поступление добавляет партию в конец очереди, списание забирает
+    количество с начала; закончившиеся партии уходят из очереди, так что
+    списание не просматривает историю товара. Если партий не хватает
+    (остаток до ведения партий), недостающее количество оценивается по
+    цене закупки товара.
+    """
+
+    def __init__(self, purchase_price):
+        self.lots = deque()
+        self.purchase_price = purchase_price
+
+    def receive(self, warehouse_transaction):
+        lot = StockLot(
+            transaction_id=warehouse_transaction.pk,
+            item_id=warehouse_transaction.item_id,
+            received_at=warehouse_transaction.created_at,
+            quantity=warehouse_transaction.quantity_delta,
+            remaining_quantity=warehouse_transaction.quantity_delta,
+            unit_cost=warehouse_transaction.price or self.purchase_price
+        )
+        self.lots.append(lot)
+        return lot, (lot.quantity * lot.unit_cost).quantize(CENT)
+
+    def consume(self, quantity):
+        """Списать quantity: [(партия, количество, стоимость)] и общая стоимость"""
+        slices = []
+        total = ZERO
+        while quantity > 0 and self.lots:
+            lot = self.lots[0]
+            taken = min(quantity, lot.remaining_quantity)
+            amount = (taken * lot.unit_cost).quantize(CENT)
+            lot.remaining_quantity -= taken
+            quantity -= taken
+            total += amount
+            slices.append((lot, taken, amount))
+            if not lot.remaining_quantity:
+                self.lots.popleft()
+        if quantity > 0:
+            total += (quantity * self.purchase_price).quantize(CENT)
+        return slices, total
+
+
+def _material_entry(warehouse_transaction, item_name, amount, entry_type, description=None):
+    return ProjectLedgerEntry(
+        project_id=warehouse_transaction.project_id,
+        warehouse_transaction_id=warehouse_transaction.pk,
+        entry_type=entry_type,
+        amount=amount,
+        description=description or f"{item_name}: {-warehouse_transaction.quantity_delta}"
+    )
+
+
+def cost_transactions(transactions):
+    """Оценить новые проведенные операции по FIFO
+
+    Операции с увеличением остатка создают партии, с уменьшением -
+    списывают открытые партии товара. Себестоимость записывается в
+    операции, списание с проектом проводится в журнал расходов проекта.
+    Открытые партии всех товаров читаются одним запросом с блокировкой,
+    запись - пакетными bulk_create/bulk_update. Вызывается в транзакции
+    проведения после сохранения операций.
+    """
+    transactions = [t for t in transactions if t.quantity_delta]
+    if not transactions:
+        return
+
+    item_ids = {t.item_id for t in transactions}
+    items = {
+        item_id: (name, purchase_price)
+        for item_id, name, purchase_price in
+        WarehouseItem.objects.filter(pk__in=item_ids).values_list('pk', 'name', 'purchase_price')
+    }
+    queues = {item_id: LotQueue(items[item_id][1]) for item_id in item_ids}
+
+    consumed_items = {t.item_id for t in transactions if t.quantity_delta < 0}
+    if consumed_items:
+        open_lots = (
+            StockLot.objects.select_for_update()
+            .filter(item_id__in=consumed_items, remaining_quantity__gt=0)
+            .order_by('item_id', 'received_at', 'transaction_id')
+        )
+        for lot in open_lots:
+            queues[lot.item_id].lots.append(lot)
+
+    new_lots = []
+    changed_lots = {}
+    consumptions = []
+    entries = []
+    for t in transactions:
+        queue = queues[t.item_id]
+        if t.quantity_delta > 0:
+            lot, t.cost_amount = queue.receive(t)
+            new_lots.append(lot)
+            continue
+
+        slices, t.cost_amount = queue.consume(-t.quantity_delta)
+        for lot, quantity, amount in slices:
+            consumptions.append(LotConsumption(transaction_id=t.pk, lot_id=lot.pk, quantity=quantity, amount=amount))
+            if not lot._state.adding:
+                changed_lots[lot.pk] = lot
+        if t.project_id and t.cost_amount:
+            entries.append(_material_entry(t, items[t.item_id][0], t.cost_amount, EntryType.MATERIALS))
+
+    StockLot.objects.bulk_create(new_lots, batch_size=500)
+    StockLot.objects.bulk_update(changed_lots.values(), ['remaining_quantity'], batch_size=500)
+    LotConsumption.objects.bulk_create(consumptions, batch_size=500)
+    WarehouseTransaction.objects.bulk_update(transactions, ['cost_amount'], batch_size=500)
+    post_entries(entries)
+
+
+def uncost_transaction(warehouse_transaction):
+    """Отменить оценку удаляемой операции
+
+    Списанное операцией количество возвращается в партии, списание на
+    проект сторнируется. Поступление, из партии которого уже списывали,
+    удалить нельзя - сначала удаляются операции списания.
+    """
+    if LotConsumption.objects.filter(lot_id=warehouse_transaction.pk).exists():
+        raise ValidationError(_('Из партии этого поступления уже списывали товар: сначала удалите операции списания'))
+
+    for lot_id, quantity in warehouse_transaction.lot_consumptions.values_list('lot_id', 'quantity'):
+        StockLot.objects.filter(pk=lot_id).update(remaining_quantity=F('remaining_quantity') + quantity)
+    warehouse_transaction.lot_consumptions.all().delete()
+
+    charged = (
+        ProjectLedgerEntry.objects.filter(warehouse_transaction_id=warehouse_transaction.pk)
+        .values_list('project_id')
+        .annotate(total=Sum('amount'))
+        .order_by()
+    )
+    for project_id, amount in charged:
+        if amount:
+            post_entry(
+                project_id, -amount, EntryType.REVERSAL,
+                description=f"Удалена операция склада: {warehouse_transaction}",
+                warehouse_transaction_id=warehouse_transaction.pk
+            )
+
+
+def revalue_items(item_ids):
+    """Переоценить товары по FIFO по всей истории операций
+
+    Партии и списания строятся заново одним проходом по операциям в
+    порядке проведения (по очереди партий на товар). Записываются только
+    операции с изменившейся себестоимостью; списания на проекты
+    выравниваются проводками на разницу с уже проведенным. Товары
+    блокируются на время переоценки. Возвращает (изменено операций,
+    изменение списаний на проекты).
+    """
+    item_ids = list(item_ids)
+    with transaction.atomic():
+        items = {
+            item_id: (name, purchase_price)
+            for item_id, name, purchase_price in
+            WarehouseItem.objects.select_for_update().filter(pk__in=item_ids).order_by('pk')
+            .values_list('pk', 'name', 'purchase_price')
+        }
+        LotConsumption.objects.filter(transaction__item_id__in=items).delete()
+        StockLot.objects.filter(item_id__in=items).delete()
+
+        charged = {}
+        for transaction_id, project_id, amount in (
+            ProjectLedgerEntry.objects.filter(warehouse_transaction__item_id__in=items)
+            .values_list('warehouse_transaction_id', 'project_id')
+            .annotate(total=Sum('amount'))
+            .order_by()
+        ):
+            charged[(transaction_id, project_id)] = amount or ZERO
+
+        queues = {item_id: LotQueue(purchase_price) for item_id, (name, purchase_price) in items.items()}
+        lots = []
+        consumptions = []
+        changed = []
+        entries = []
+        history = (
+            WarehouseTransaction.objects.filter(item_id__in=items)
+            .order_by('item_id', 'created_at', 'pk')
+            .only('pk', 'item_id', 'quantity_delta', 'price', 'project_id', 'cost_amount', 'created_at')
+        )
+        for t in history.iterator(chunk_size=2000):
+            if not t.quantity_delta:
+                continue
+            queue = queues[t.item_id]
+            if t.quantity_delta > 0:
+                lot, cost_amount = queue.receive(t)
+                lots.append(lot)
+            else:
+                slices, cost_amount = queue.consume(-t.quantity_delta)
+                consumptions.extend(
+                    LotConsumption(transaction_id=t.pk, lot_id=lot.pk, quantity=quantity, amount=amount)
+                    for lot, quantity, amount in slices
+                )
+                if t.project_id:
+                    delta = cost_amount - charged.pop((t.pk, t.project_id), ZERO)
+                    if delta:
+                        entries.append(_material_entry(
+                            t, items[t.item_id][0], delta,
+                            EntryType.ADJUSTMENT if cost_amount != delta else EntryType.MATERIALS,
+                            f"Переоценка FIFO: {items[t.item_id][0]}"
+                        ))
+            if t.cost_amount != cost_amount:
+                t.cost_amount = cost_amount
+                changed.append(t)
+
+        # Списания на проекты, которых у операций больше нет (операцию перенесли на другой проект)
+        for (transaction_id, project_id), amount in charged.items():
+            if amount:
+                entries.append(ProjectLedgerEntry(
+                    project_id=project_id,
+                    warehouse_transaction_id=transaction_id,
+                    entry_type=EntryType.REVERSAL,
+                    amount=-amount,
+                    description='Переоценка FIFO: списание перенесено'
+                ))
+
+        StockLot.objects.bulk_create(lots, batch_size=1000)
+        LotConsumption.objects.bulk_create(consumptions, batch_size=1000)
+        WarehouseTransaction.objects.bulk_update(changed, ['cost_amount'], batch_size=1000)
+        post_entries(entries)
+    return len(changed), sum((entry.amount for entry in entries), ZERO)
+
+
+def stock_value(items=None):
+    """Стоимость остатка по открытым партиям (товары - queryset items или все)"""
+    lots = StockLot.objects.filter(remaining_quantity__gt=0)
+    if items is not None:
+        lots = lots.filter(item__in=items)
+    value = lots.aggregate(
+        total=Sum(ExpressionWrapper(
+            F('remaining_quantity') * F('unit_cost'),
+            output_field=DecimalField(max_digits=20, decimal_places=4)
+        ))
+    )['total']
+    return (value or ZERO).quantize(CENT)
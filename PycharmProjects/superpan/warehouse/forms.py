@@ -1,7 +1,11 @@
 from django import forms
+from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
+from decimal import Decimal
 
-from .models import WarehouseCategory, WarehouseItem, WarehouseTransaction, ProjectEquipment
+from .models import (
+    WarehouseCategory, WarehouseItem, WarehouseLocation, WarehouseTransaction, WarehouseDocument, ProjectEquipment
+)
 
 class WarehouseCategoryForm(forms.ModelForm):
     """Форма для создания/редактирования категории склада"""
@@ -14,6 +18,19 @@ class WarehouseCategoryForm(forms.ModelForm):
             'is_active': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
         }
 
+class WarehouseLocationForm(forms.ModelForm):
+    """Форма для создания места хранения"""
+    class Meta:
+        model = WarehouseLocation
+        fields = ['name', 'location_type', 'project', 'address', 'is_active']
+        widgets = {
+            'name': forms.TextInput(attrs={'class': 'form-control', 'placeholder': _('Например: Контейнер, ЖК «Северный»')}),
+            'location_type': forms.Select(attrs={'class': 'form-select'}),
+            'project': forms.Select(attrs={'class': 'form-select'}),
+            'address': forms.TextInput(attrs={'class': 'form-control', 'placeholder': _('Адрес объекта')}),
+            'is_active': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
+        }
+
 class WarehouseItemForm(forms.ModelForm):
     """Форма для создания/редактирования товара склада"""
     class Meta:
@@ -38,6 +55,13 @@ class WarehouseItemForm(forms.ModelForm):
             'is_active': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Остаток существующего товара меняется только операциями склада
+        if self.instance.pk:
+            self.fields['current_quantity'].disabled = True
+            self.fields['current_quantity'].help_text = _('Изменяется операциями прихода, расхода и корректировки')
+
     def clean_current_quantity(self):
         quantity = self.cleaned_data.get('current_quantity')
         if quantity and quantity < 0:
@@ -64,15 +88,30 @@ class WarehouseItemForm(forms.ModelForm):
 
 class WarehouseTransactionForm(forms.ModelForm):
     """Форма для создания транзакции склада"""
+    ADJUSTMENT_DIRECTION_CHOICES = [
+        ('increase', _('Увеличить остаток')),
+        ('decrease', _('Уменьшить остаток')),
+    ]
+    
+    adjustment_direction = forms.ChoiceField(
+        label=_('Направление корректировки'),
+        choices=ADJUSTMENT_DIRECTION_CHOICES,
+        initial='increase',
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+    
     class Meta:
         model = WarehouseTransaction
         fields = [
-            'item', 'transaction_type', 'quantity', 'price', 
+            'item', 'transaction_type', 'location', 'to_location', 'quantity', 'price', 
             'project', 'description', 'reference_number'
         ]
         widgets = {
             'item': forms.Select(attrs={'class': 'form-select'}),
             'transaction_type': forms.Select(attrs={'class': 'form-select'}),
+            'location': forms.Select(attrs={'class': 'form-select'}),
+            'to_location': forms.Select(attrs={'class': 'form-select'}),
             'quantity': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01', 'min': '0.01'}),
             'price': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01', 'min': '0'}),
             'project': forms.Select(attrs={'class': 'form-select'}),
@@ -80,6 +119,15 @@ class WarehouseTransactionForm(forms.ModelForm):
             'reference_number': forms.TextInput(attrs={'class': 'form-control', 'placeholder': _('Номер документа')}),
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        locations = WarehouseLocation.objects.filter(is_active=True)
+        self.fields['location'].queryset = locations
+        self.fields['location'].required = True
+        self.fields['to_location'].queryset = locations
+        if not self.is_bound and not self.initial.get('location'):
+            self.initial['location'] = WarehouseLocation.central_id()
+
     def clean_quantity(self):
         quantity = self.cleaned_data.get('quantity')
         if quantity and quantity <= 0:
@@ -92,6 +140,91 @@ class WarehouseTransactionForm(forms.ModelForm):
             raise ValidationError(_('Цена не может быть отрицательной.'))
         return price
 
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('transaction_type') == 'TRANSFER':
+            to_location = cleaned_data.get('to_location')
+            if to_location is None:
+                self.add_error('to_location', _('Укажите, куда перемещается товар.'))
+            elif to_location == cleaned_data.get('location'):
+                self.add_error('to_location', _('Место назначения совпадает с исходным.'))
+        else:
+            cleaned_data['to_location'] = None
+        return cleaned_data
+
+    def save(self, commit=True):
+        instance = super().save(commit=False)
+        if instance.transaction_type == 'ADJUSTMENT' and self.cleaned_data.get('adjustment_direction') == 'decrease':
+            instance.quantity_delta = -instance.quantity
+        if commit:
+            instance.save()
+        return instance
+
+class WarehouseDocumentForm(forms.ModelForm):
+    """Шапка многострочного складского документа"""
+    class Meta:
+        model = WarehouseDocument
+        fields = ['document_type', 'number', 'document_date', 'location', 'counterparty', 'project', 'description']
+        widgets = {
+            'document_type': forms.Select(attrs={'class': 'form-select'}),
+            'location': forms.Select(attrs={'class': 'form-select'}),
+            'number': forms.TextInput(attrs={'class': 'form-control', 'placeholder': _('Номер накладной')}),
+            'document_date': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
+            'counterparty': forms.TextInput(attrs={'class': 'form-control', 'placeholder': _('Поставщик или получатель')}),
+            'project': forms.Select(attrs={'class': 'form-select'}),
+            'description': forms.Textarea(attrs={'class': 'form-control', 'rows': 2, 'placeholder': _('Описание')}),
+        }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['location'].queryset = WarehouseLocation.objects.filter(is_active=True)
+        self.fields['location'].required = True
+        if not self.is_bound and not self.initial.get('location'):
+            self.initial['location'] = WarehouseLocation.central_id()
+
+class WarehouseDocumentLineForm(forms.Form):
+    """Строка складского документа
+    
+    Список товаров передается готовым (item_choices), чтобы документ из
+    сотен строк не выполнял запрос товаров на каждую строку.
+    """
+    item = forms.TypedChoiceField(
+        label=_('Товар'),
+        coerce=int,
+        widget=forms.Select(attrs={'class': 'form-select form-select-sm'})
+    )
+    quantity = forms.DecimalField(
+        label=_('Количество'),
+        max_digits=10,
+        decimal_places=2,
+        min_value=Decimal('0.01'),
+        widget=forms.NumberInput(attrs={'class': 'form-control form-control-sm', 'step': '0.01', 'min': '0.01'})
+    )
+    price = forms.DecimalField(
+        label=_('Цена'),
+        max_digits=12,
+        decimal_places=2,
+        min_value=Decimal('0.00'),
+        required=False,
+        widget=forms.NumberInput(attrs={'class': 'form-control form-control-sm', 'step': '0.01', 'min': '0'})
+    )
+    description = forms.CharField(
+        label=_('Примечание'),
+        required=False,
+        widget=forms.TextInput(attrs={'class': 'form-control form-control-sm'})
+    )
+
+    def __init__(self, *args, item_choices=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['item'].choices = [('', _('Выберите товар'))] + list(item_choices)
+
+WarehouseDocumentLineFormSet = forms.formset_factory(
+    WarehouseDocumentLineForm,
+    extra=10,
+    max_num=500,
+    validate_max=True
+)
+
 class ProjectEquipmentForm(forms.ModelForm):
     """Форма для добавления оборудования к проекту"""
     class Meta:
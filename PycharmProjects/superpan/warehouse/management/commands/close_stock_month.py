@@ -0,0 +1,56 @@
+"""
+Закрытие месяца на складе: снимки остатков всех товаров на конец месяца
+Использование:
+    python manage.py close_stock_month                  # прошлый месяц
+    python manage.py close_stock_month --month 2025-03
+    python manage.py close_stock_month --backfill       # все месяцы без снимков
+Запуск по расписанию (cron), 1-го числа каждого месяца:
+    15 0 1 * * cd /path/to/superpan && python manage.py close_stock_month --backfill
+"""
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from warehouse.stock_history import last_closed_month_end, month_end, take_snapshots, unclosed_month_ends
+
+
+class Command(BaseCommand):
+    help = 'Снимки остатков склада на конец закрытых месяцев для остатков на дату'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help='Месяц в формате ГГГГ-ММ (по умолчанию - прошлый)')
+        parser.add_argument(
+            '--backfill',
+            action='store_true',
+            help='Записать снимки за все закрытые месяцы с операциями, для которых их еще нет'
+        )
+
+    def handle(self, *args, **options):
+        if options['month'] and options['backfill']:
+            raise CommandError('Укажите либо --month, либо --backfill')
+
+        if options['backfill']:
+            periods = unclosed_month_ends()
+        elif options['month']:
+            try:
+                periods = [month_end(datetime.strptime(options['month'], '%Y-%m').date())]
+            except ValueError:
+                raise CommandError(f"Некорректный месяц: {options['month']}")
+            if periods[0] > last_closed_month_end():
+                raise CommandError(f"Месяц {options['month']} еще не закрыт")
+        else:
+            periods = [last_closed_month_end()]
+
+        started_at = time.perf_counter()
+        snapshots = 0
+        # Месяцы закрываются по порядку: каждый считается от снимка предыдущего
+        for period_end in periods:
+            count = take_snapshots(period_end)
+            snapshots += count
+            self.stdout.write(f'  {period_end:%m.%Y}: {count} товаров')
+
+        elapsed = time.perf_counter() - started_at
+        self.stdout.write(self.style.SUCCESS(
+            f'Закрыто месяцев {len(periods)}, записано снимков {snapshots} за {elapsed:.1f} с'
+        ))
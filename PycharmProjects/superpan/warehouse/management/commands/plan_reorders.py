@@ -0,0 +1,56 @@
+"""
+Ночной расчет рекомендаций к заказу по фактическому расходу товаров
+Использование:
+    python manage.py plan_reorders
+    python manage.py plan_reorders --short-window 14 --long-window 60 --lead-time 10 --set-min-quantity
+Запуск по расписанию (cron), каждую ночь:
+    30 2 * * * cd /path/to/superpan && python manage.py plan_reorders
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from warehouse.reorder import plan, save_suggestions
+
+
+class Command(BaseCommand):
+    help = 'Скорость расхода, дни до нуля и рекомендуемые заказы по всем активным товарам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--short-window', type=int, default=30, help='Короткое окно расхода, дней')
+        parser.add_argument('--long-window', type=int, default=90, help='Длинное окно расхода, дней')
+        parser.add_argument('--lead-time', type=int, default=14, help='Срок поставки, дней')
+        parser.add_argument('--cover-days', type=int, default=30, help='На сколько дней расхода заказывать')
+        parser.add_argument(
+            '--safety-factor',
+            type=float,
+            default=1.65,
+            help='Страховой запас в стандартных отклонениях дневного расхода (1.65 - около 95%% без дефицита)'
+        )
+        parser.add_argument(
+            '--set-min-quantity',
+            action='store_true',
+            help='Выставить минимальный остаток товаров равным рассчитанной точке заказа'
+        )
+
+    def handle(self, *args, **options):
+        for option in ('short_window', 'long_window', 'lead_time', 'cover_days'):
+            if options[option] <= 0:
+                raise CommandError(f"--{option.replace('_', '-')} должно быть больше 0")
+
+        started_at = time.perf_counter()
+        suggestions = plan(
+            short_window=options['short_window'],
+            long_window=options['long_window'],
+            lead_time=options['lead_time'],
+            cover_days=options['cover_days'],
+            safety_factor=options['safety_factor']
+        )
+        computed = time.perf_counter() - started_at
+        save_suggestions(suggestions, set_min_quantity=options['set_min_quantity'])
+
+        to_order = sum(1 for suggestion in suggestions if suggestion.suggested_quantity > 0)
+        elapsed = time.perf_counter() - started_at
+        self.stdout.write(self.style.SUCCESS(
+            f'Товаров {len(suggestions)}, к заказу {to_order}: расчет {computed:.1f} с, всего {elapsed:.1f} с'
+        ))
@@ -0,0 +1,59 @@
+"""
+Переоценка склада по FIFO: партии, себестоимость операций и списания на проекты
+Использование:
+    python manage.py revalue_stock
+    python manage.py revalue_stock --item 15 --item 16 --dry-run
+После перехода на партии команда запускается один раз для всей истории склада.
+"""
+import time
+from contextlib import nullcontext
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from warehouse.costing import revalue_items, stock_value
+from warehouse.models import WarehouseItem
+
+
+class Command(BaseCommand):
+    help = 'Пересчет партий и себестоимости операций склада по FIFO с выравниванием списаний на проекты'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--item', action='append', type=int, default=[], help='ID товара (можно несколько)')
+        parser.add_argument('--chunk-size', type=int, default=200, help='Товаров в одной транзакции')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Посчитать изменения и откатить их'
+        )
+
+    def handle(self, *args, **options):
+        items = WarehouseItem.objects.order_by('pk')
+        if options['item']:
+            items = items.filter(pk__in=options['item'])
+        item_ids = list(items.values_list('pk', flat=True))
+
+        started_at = time.perf_counter()
+        chunk_size = max(options['chunk_size'], 1)
+        changed = 0
+        charged = Decimal('0.00')
+        # Каждая порция товаров переоценивается в своей транзакции;
+        # при --dry-run все выполняется в общей транзакции и откатывается
+        with transaction.atomic() if options['dry_run'] else nullcontext():
+            for start in range(0, len(item_ids), chunk_size):
+                chunk_changed, chunk_charged = revalue_items(item_ids[start:start + chunk_size])
+                changed += chunk_changed
+                charged += chunk_charged
+                self.stdout.write(f'  {min(start + chunk_size, len(item_ids))}/{len(item_ids)}')
+
+            value = stock_value(items)
+            if options['dry_run']:
+                transaction.set_rollback(True)
+
+        elapsed = time.perf_counter() - started_at
+        prefix = 'Пробный запуск (изменения отменены): ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}переоценено товаров {len(item_ids)}, изменена себестоимость {changed} операций, '
+            f'списания на проекты {charged:+} ₽, стоимость остатка {value} ₽ за {elapsed:.1f} с'
+        ))
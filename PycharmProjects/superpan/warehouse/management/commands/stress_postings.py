@@ -0,0 +1,148 @@
+"""
+Нагрузочная проверка проведения складских операций
+Использование:
+    python manage.py stress_postings --postings 5000 --threads 16
+
+Создает временный товар и временное место хранения, параллельно проводит
+приходы, расходы, корректировки и перемещения между центральным складом и
+этим местом из нескольких потоков и проверяет, что остаток товара равен
+сумме изменений по проведенным операциям, остаток после каждой операции
+совпадает с нарастающим итогом, остаток ни разу не ушел в минус, а
+остаток в каждом месте хранения равен сумме его движений. Товар, место
+и операции после проверки удаляются.
+"""
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections
+from django.db.models import Q, Sum
+
+from warehouse.models import StockBalance, WarehouseItem, WarehouseLocation, WarehouseTransaction
+from warehouse.posting import InsufficientStock, post, transfer
+
+# Сколько раз повторяется операция, если база занята другим потоком (SQLite)
+RETRIES = 20
+
+
+def quantity_total(value):
+    """Итог агрегата Sum как количество с двумя знаками
+
+    В SQLite сумма десятичных полей считается в float (Sum с filter
+    возвращает, например, 101.4600000000001), поэтому перед сравнением с
+    остатком итог округляется до точности поля количества.
+    """
+    return Decimal(str(value or 0)).quantize(Decimal('0.01'))
+
+
+class Command(BaseCommand):
+    help = 'Параллельное проведение тысяч складских операций с проверкой остатка'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--postings', type=int, default=5000, help='Число операций')
+        parser.add_argument('--threads', type=int, default=16, help='Число потоков')
+        parser.add_argument('--initial', default='100', help='Начальный остаток товара')
+        parser.add_argument('--seed', type=int, default=None, help='Начальное значение генератора случайных чисел')
+        parser.add_argument('--keep', action='store_true', help='Не удалять временный товар после проверки')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        stamp = int(time.time())
+        central = WarehouseLocation.objects.get(pk=WarehouseLocation.central_id())
+        site = WarehouseLocation.objects.create(name=f'Нагрузочный тест {stamp}', location_type='SITE')
+        item = WarehouseItem.objects.create(
+            name=f'Нагрузочный тест {stamp}',
+            item_type='MATERIAL',
+            unit='шт'
+        )
+        # Начальный остаток приходуется операцией, чтобы он вошел в проверяемые суммы
+        post(item, 'IN', Decimal(options['initial']), location=central, description='stress')
+
+        plan = []
+        for _ in range(max(options['postings'], 1)):
+            transaction_type = rng.choices(['IN', 'OUT', 'ADJUSTMENT', 'TRANSFER'], weights=[4, 4, 1, 1])[0]
+            quantity = Decimal(rng.randint(1, 500)) / 100
+            location, other = (central, site) if rng.random() < 0.5 else (site, central)
+            plan.append((transaction_type, quantity, rng.random() < 0.5, location, other))
+
+        counters = {'posted': 0, 'rejected': 0, 'failed': 0}
+
+        def run(step):
+            transaction_type, quantity, decrease, location, other = step
+            close_old_connections()
+            try:
+                for attempt in range(RETRIES):
+                    try:
+                        if transaction_type == 'TRANSFER':
+                            transfer(item, quantity, location, other, description='stress')
+                        else:
+                            post(item, transaction_type, quantity, decrease=decrease, location=location, description='stress')
+                        return 'posted'
+                    except OperationalError:
+                        time.sleep(0.01 * (attempt + 1))
+                return 'failed'
+            except InsufficientStock:
+                return 'rejected'
+            finally:
+                close_old_connections()
+
+        started_at = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(options['threads'], 1)) as executor:
+            for result in executor.map(run, plan):
+                counters[result] += 1
+        elapsed = time.perf_counter() - started_at
+
+        try:
+            self.verify(item, [central, site])
+        finally:
+            if not options['keep']:
+                WarehouseTransaction.objects.filter(item=item).delete()
+                WarehouseItem.objects.filter(pk=item.pk).delete()
+                WarehouseLocation.objects.filter(pk=site.pk).delete()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Остаток сходится: проведено {counters['posted']}, отклонено по остатку {counters['rejected']}, "
+            f"не проведено из-за блокировок {counters['failed']} за {elapsed:.1f} с "
+            f"({counters['posted'] / elapsed:.0f} операций/с)"
+        ))
+
+    def verify(self, item, locations):
+        current = WarehouseItem.objects.values_list('current_quantity', flat=True).get(pk=item.pk)
+        transactions = WarehouseTransaction.objects.filter(item=item)
+        posted = quantity_total(transactions.aggregate(total=Sum('quantity_delta'))['total'])
+        if current != posted:
+            raise CommandError(f'Остаток {current} не равен сумме изменений по операциям {posted}')
+        if transactions.filter(balance_after__lt=0).exists():
+            raise CommandError('Остаток уходил в минус')
+        by_locations = quantity_total(StockBalance.objects.filter(item=item).aggregate(total=Sum('quantity'))['total'])
+        if current != by_locations:
+            raise CommandError(f'Остаток {current} не равен сумме остатков по местам хранения {by_locations}')
+        if StockBalance.objects.filter(item=item, quantity__lt=0).exists():
+            raise CommandError('Остаток в месте хранения уходил в минус')
+
+        # Остаток места - изменения его операций, минус перемещения из него, плюс перемещения в него
+        for location in locations:
+            moves = transactions.aggregate(
+                changed=Sum('quantity_delta', filter=Q(location=location) & ~Q(transaction_type='TRANSFER')),
+                moved_out=Sum('quantity', filter=Q(location=location, transaction_type='TRANSFER')),
+                moved_in=Sum('quantity', filter=Q(to_location=location, transaction_type='TRANSFER'))
+            )
+            moves = {key: quantity_total(value) for key, value in moves.items()}
+            expected = moves['changed'] - moves['moved_out'] + moves['moved_in']
+            balance = (
+                StockBalance.objects.filter(item=item, location=location)
+                .values_list('quantity', flat=True).first()
+            ) or Decimal('0.00')
+            if balance != expected:
+                raise CommandError(f'Остаток в месте «{location}» {balance}, по операциям {expected}')
+
+        # Проводки одного товара идут под блокировкой его строки, поэтому в
+        # порядке id остаток после каждой операции равен нарастающей сумме
+        # изменений; потерянное обновление нарушило бы это равенство
+        balance = Decimal('0.00')
+        for pk, delta, balance_after in transactions.order_by('pk').values_list('pk', 'quantity_delta', 'balance_after'):
+            balance += delta
+            if balance != balance_after:
+                raise CommandError(f'Операция {pk}: остаток после операции {balance_after}, по цепочке изменений {balance}')
@@ -0,0 +1,60 @@
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Case, DecimalField, F, Sum, Value, When
+
+
+def fill_quantity_deltas(apps, schema_editor):
+    """Изменения остатка по прежним операциям и выравнивающие корректировки
+
+    Прежние операции меняли остаток только для прихода и расхода. Если
+    сумма изменений не совпадает с остатком товара (остаток правили
+    вручную), добавляется корректировка на разницу.
+    """
+    WarehouseItem = apps.get_model('warehouse', 'WarehouseItem')
+    WarehouseTransaction = apps.get_model('warehouse', 'WarehouseTransaction')
+
+    WarehouseTransaction.objects.update(quantity_delta=Case(
+        When(transaction_type='IN', then=F('quantity')),
+        When(transaction_type='OUT', then=-F('quantity')),
+        default=Value(Decimal('0.00')),
+        output_field=DecimalField(max_digits=10, decimal_places=2)
+    ))
+
+    posted = dict(
+        WarehouseTransaction.objects.values_list('item_id').annotate(total=Sum('quantity_delta')).order_by()
+    )
+    adjustments = []
+    for item_id, current_quantity in WarehouseItem.objects.values_list('id', 'current_quantity'):
+        difference = current_quantity - (posted.get(item_id) or Decimal('0.00'))
+        if difference:
+            adjustments.append(WarehouseTransaction(
+                item_id=item_id,
+                transaction_type='ADJUSTMENT',
+                quantity=abs(difference),
+                quantity_delta=difference,
+                balance_after=current_quantity,
+                description='Выравнивание остатка при вводе журнала'
+            ))
+    WarehouseTransaction.objects.bulk_create(adjustments, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='warehousetransaction',
+            name='quantity_delta',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=10, verbose_name='Изменение остатка'),
+        ),
+        migrations.AddField(
+            model_name='warehousetransaction',
+            name='balance_after',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=10, null=True, verbose_name='Остаток после операции'),
+        ),
+        migrations.RunPython(fill_quantity_deltas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0002_warehousetransaction_quantity_delta'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WarehouseDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document_type', models.CharField(choices=[('RECEIPT', 'Приходная накладная'), ('ISSUE', 'Отпуск материалов')], max_length=20, verbose_name='Тип документа')),
+                ('number', models.CharField(blank=True, max_length=100, verbose_name='Номер документа')),
+                ('document_date', models.DateField(blank=True, null=True, verbose_name='Дата документа')),
+                ('counterparty', models.CharField(blank=True, max_length=200, verbose_name='Поставщик / получатель')),
+                ('description', models.TextField(blank=True, verbose_name='Описание')),
+                ('lines_count', models.PositiveIntegerField(default=0, verbose_name='Строк')),
+                ('total_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15, verbose_name='Сумма документа')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создан')),
+                ('created_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='created_warehouse_documents', to=settings.AUTH_USER_MODEL, verbose_name='Создал')),
+                ('project', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='warehouse_documents', to='projects.project', verbose_name='Проект')),
+            ],
+            options={
+                'verbose_name': 'Складской документ',
+                'verbose_name_plural': 'Складские документы',
+                'db_table': 'warehouse_documents',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='warehousetransaction',
+            name='document',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='transactions', to='warehouse.warehousedocument', verbose_name='Документ'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+from decimal import Decimal
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0003_warehousedocument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WarehouseStockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_end', models.DateField(verbose_name='Остаток на конец дня')),
+                ('quantity', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=10, verbose_name='Количество')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создан')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_snapshots', to='warehouse.warehouseitem', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Снимок остатка',
+                'verbose_name_plural': 'Снимки остатков',
+                'db_table': 'warehouse_stock_snapshots',
+                'ordering': ['-period_end', 'item'],
+                'unique_together': {('item', 'period_end')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='warehousestocksnapshot',
+            index=models.Index(fields=['period_end'], name='stock_snapshot_period_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='warehousetransaction',
+            index=models.Index(fields=['item', 'created_at'], name='warehouse_txn_item_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='warehousetransaction',
+            index=models.Index(fields=['created_at'], name='warehouse_txn_created_idx'),
+        ),
+    ]
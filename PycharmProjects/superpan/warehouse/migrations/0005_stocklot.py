@@ -0,0 +1,53 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0004_warehousestocksnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='warehousetransaction',
+            name='cost_amount',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, help_text='Стоимость поступившей партии или списанного количества по FIFO', max_digits=15, null=True, verbose_name='Себестоимость'),
+        ),
+        migrations.CreateModel(
+            name='StockLot',
+            fields=[
+                ('transaction', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='lot', serialize=False, to='warehouse.warehousetransaction', verbose_name='Операция поступления')),
+                ('received_at', models.DateTimeField(verbose_name='Поступила')),
+                ('quantity', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Количество')),
+                ('remaining_quantity', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Остаток партии')),
+                ('unit_cost', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Цена за единицу')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lots', to='warehouse.warehouseitem', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Партия товара',
+                'verbose_name_plural': 'Партии товаров',
+                'db_table': 'warehouse_stock_lots',
+                'ordering': ['item', 'received_at', 'transaction'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='stocklot',
+            index=models.Index(condition=models.Q(('remaining_quantity__gt', 0)), fields=['item', 'received_at', 'transaction'], name='stock_lot_open_fifo_idx'),
+        ),
+        migrations.CreateModel(
+            name='LotConsumption',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Количество')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=15, verbose_name='Стоимость')),
+                ('lot', models.ForeignKey(on_delete=django.db.models.deletion.RESTRICT, related_name='consumptions', to='warehouse.stocklot', verbose_name='Партия')),
+                ('transaction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lot_consumptions', to='warehouse.warehousetransaction', verbose_name='Операция списания')),
+            ],
+            options={
+                'verbose_name': 'Списание партии',
+                'verbose_name_plural': 'Списания партий',
+                'db_table': 'warehouse_lot_consumptions',
+            },
+        ),
+    ]
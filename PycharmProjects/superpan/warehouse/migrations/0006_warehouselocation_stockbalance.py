@@ -0,0 +1,93 @@
+from decimal import Decimal
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def place_stock_at_central(apps, schema_editor):
+    """Весь прежний остаток и все прежние операции - на центральном складе"""
+    WarehouseLocation = apps.get_model('warehouse', 'WarehouseLocation')
+    StockBalance = apps.get_model('warehouse', 'StockBalance')
+    WarehouseItem = apps.get_model('warehouse', 'WarehouseItem')
+    WarehouseTransaction = apps.get_model('warehouse', 'WarehouseTransaction')
+    WarehouseDocument = apps.get_model('warehouse', 'WarehouseDocument')
+
+    central, created = WarehouseLocation.objects.get_or_create(
+        name='Центральный склад',
+        defaults={'location_type': 'CENTRAL'}
+    )
+    WarehouseTransaction.objects.filter(location__isnull=True).update(location=central)
+    WarehouseDocument.objects.filter(location__isnull=True).update(location=central)
+    StockBalance.objects.bulk_create(
+        [
+            StockBalance(item_id=item_id, location=central, quantity=quantity)
+            for item_id, quantity in WarehouseItem.objects.exclude(current_quantity=0).values_list('id', 'current_quantity')
+        ],
+        batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0011_projectledgerentry_warehouse_transaction'),
+        ('warehouse', '0005_stocklot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WarehouseLocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, unique=True, verbose_name='Название')),
+                ('location_type', models.CharField(choices=[('CENTRAL', 'Центральный склад'), ('SITE', 'Объект')], default='SITE', max_length=20, verbose_name='Тип места')),
+                ('address', models.CharField(blank=True, max_length=300, verbose_name='Адрес')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Активно')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создано')),
+                ('project', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='warehouse_locations', to='projects.project', verbose_name='Проект')),
+            ],
+            options={
+                'verbose_name': 'Место хранения',
+                'verbose_name_plural': 'Места хранения',
+                'db_table': 'warehouse_locations',
+                'ordering': ['location_type', 'name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=10, verbose_name='Количество')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлен')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balances', to='warehouse.warehouseitem', verbose_name='Товар')),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='balances', to='warehouse.warehouselocation', verbose_name='Место хранения')),
+            ],
+            options={
+                'verbose_name': 'Остаток в месте хранения',
+                'verbose_name_plural': 'Остатки по местам хранения',
+                'db_table': 'warehouse_stock_balances',
+                'ordering': ['location', 'item'],
+                'unique_together': {('item', 'location')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='stockbalance',
+            index=models.Index(condition=models.Q(('quantity__gt', 0)), fields=['location', 'item'], name='stock_balance_location_idx'),
+        ),
+        migrations.AddField(
+            model_name='warehousedocument',
+            name='location',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='documents', to='warehouse.warehouselocation', verbose_name='Место хранения'),
+        ),
+        migrations.AddField(
+            model_name='warehousetransaction',
+            name='location',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='transactions', to='warehouse.warehouselocation', verbose_name='Место хранения'),
+        ),
+        migrations.AddField(
+            model_name='warehousetransaction',
+            name='to_location',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='incoming_transfers', to='warehouse.warehouselocation', verbose_name='Куда переместить'),
+        ),
+        migrations.RunPython(place_stock_at_central, migrations.RunPython.noop),
+    ]
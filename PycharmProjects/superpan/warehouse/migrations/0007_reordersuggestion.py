@@ -0,0 +1,38 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0006_warehouselocation_stockbalance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReorderSuggestion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('current_quantity', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Остаток при расчете')),
+                ('daily_usage', models.DecimalField(decimal_places=4, help_text='Большая из скоростей расхода за короткое и длинное окно', max_digits=12, verbose_name='Расход в день')),
+                ('usage_short_window', models.DecimalField(decimal_places=4, max_digits=12, verbose_name='Расход в день (короткое окно)')),
+                ('usage_long_window', models.DecimalField(decimal_places=4, max_digits=12, verbose_name='Расход в день (длинное окно)')),
+                ('reorder_point', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Точка заказа')),
+                ('days_until_stockout', models.DecimalField(blank=True, decimal_places=1, help_text='Пусто - расхода за окно не было', max_digits=10, null=True, verbose_name='Дней до нуля')),
+                ('stockout_date', models.DateField(blank=True, null=True, verbose_name='Дата окончания остатка')),
+                ('suggested_quantity', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Рекомендуется заказать')),
+                ('computed_at', models.DateTimeField(verbose_name='Рассчитано')),
+                ('item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='reorder_suggestion', to='warehouse.warehouseitem', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Рекомендация к заказу',
+                'verbose_name_plural': 'Рекомендации к заказу',
+                'db_table': 'warehouse_reorder_suggestions',
+                'ordering': ['days_until_stockout'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='reordersuggestion',
+            index=models.Index(condition=models.Q(('suggested_quantity__gt', 0)), fields=['days_until_stockout'], name='reorder_to_order_idx'),
+        ),
+    ]
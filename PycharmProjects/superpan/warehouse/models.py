@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import MinValueValidator
 from decimal import Decimal
@@ -20,6 +20,46 @@ class WarehouseCategory(models.Model):
     def __str__(self):
         return self.name
 
+class WarehouseLocation(models.Model):
+    """Место хранения: центральный склад или контейнер на объекте"""
+    LOCATION_TYPE_CHOICES = [
+        ('CENTRAL', _('Центральный склад')),
+        ('SITE', _('Объект')),
+    ]
+    
+    name = models.CharField(_('Название'), max_length=200, unique=True)
+    location_type = models.CharField(_('Тип места'), max_length=20, choices=LOCATION_TYPE_CHOICES, default='SITE')
+    project = models.ForeignKey('projects.Project', on_delete=models.SET_NULL, null=True, blank=True, related_name='warehouse_locations', verbose_name=_('Проект'))
+    address = models.CharField(_('Адрес'), max_length=300, blank=True)
+    is_active = models.BooleanField(_('Активно'), default=True)
+    created_at = models.DateTimeField(_('Создано'), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('Место хранения')
+        verbose_name_plural = _('Места хранения')
+        db_table = 'warehouse_locations'
+        ordering = ['location_type', 'name']
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def central_id(cls):
+        """id центрального склада - места операций, для которых место не указано"""
+        location_id = (
+            cls.objects.filter(location_type='CENTRAL', is_active=True)
+            .order_by('pk')
+            .values_list('pk', flat=True)
+            .first()
+        )
+        if location_id is None:
+            location, created = cls.objects.get_or_create(
+                name='Центральный склад',
+                defaults={'location_type': 'CENTRAL'}
+            )
+            location_id = location.pk
+        return location_id
+
 class WarehouseItem(models.Model):
     """Товары на складе"""
     ITEM_TYPE_CHOICES = [
@@ -94,11 +134,140 @@ class WarehouseItem(models.Model):
     def __str__(self):
         return f"{self.name} ({self.get_item_type_display()})"
 
+    def save(self, *args, **kwargs):
+        """Остаток меняется только проводками (warehouse.posting)
+        
+        Начальный остаток нового товара записывается корректировкой на
+        центральном складе (и партией по цене закупки), чтобы сумма
+        изменений по операциям совпадала с остатком; полное сохранение существующего товара остаток не перезаписывает.
+        """
+        if not self._state.adding:
+            if kwargs.get('update_fields') is None:
+                kwargs['update_fields'] = [
+                    field.name for field in self._meta.concrete_fields
+                    if not field.primary_key and field.name != 'current_quantity'
+                ]
+            super().save(*args, **kwargs)
+            return
+        
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if self.current_quantity:
+                from .costing import cost_transactions
+                
+                location_id = WarehouseLocation.central_id()
+                StockBalance.objects.create(item=self, location_id=location_id, quantity=self.current_quantity)
+                opening = WarehouseTransaction.objects.bulk_create([WarehouseTransaction(
+                    item=self,
+                    location_id=location_id,
+                    transaction_type='ADJUSTMENT',
+                    quantity=self.current_quantity,
+                    quantity_delta=self.current_quantity,
+                    balance_after=self.current_quantity,
+                    price=self.purchase_price,
+                    total_amount=(self.current_quantity * self.purchase_price).quantize(Decimal('0.01')),
+                    description=_('Начальный остаток'),
+                    created_by=self.created_by
+                )])
+                cost_transactions(opening)
+
+    def stock_as_of(self, on_date):
+        """Остаток товара на конец дня on_date"""
+        from .stock_history import stock_as_of
+        
+        return stock_as_of(self.pk, on_date)
+
     @property
     def is_low_stock(self):
         """Проверка на низкий остаток"""
         return self.current_quantity <= self.min_quantity
 
+class StockBalance(models.Model):
+    """Остаток товара в месте хранения
+    
+    Меняется проводками вместе с общим остатком товара
+    (warehouse.posting): сумма остатков товара по местам равна
+    WarehouseItem.current_quantity.
+    """
+    item = models.ForeignKey(WarehouseItem, on_delete=models.CASCADE, related_name='balances', verbose_name=_('Товар'))
+    location = models.ForeignKey(WarehouseLocation, on_delete=models.PROTECT, related_name='balances', verbose_name=_('Место хранения'))
+    quantity = models.DecimalField(
+        _('Количество'),
+        max_digits=10,
+        decimal_places=2,
+        default=Decimal('0.00')
+    )
+    updated_at = models.DateTimeField(_('Обновлен'), auto_now=True)
+
+    class Meta:
+        verbose_name = _('Остаток в месте хранения')
+        verbose_name_plural = _('Остатки по местам хранения')
+        db_table = 'warehouse_stock_balances'
+        ordering = ['location', 'item']
+        # Уникальный индекс (товар, место) отвечает на «где лежит товар»,
+        # индекс по месту - на «что лежит на объекте»
+        unique_together = ['item', 'location']
+        indexes = [
+            models.Index(
+                fields=['location', 'item'],
+                name='stock_balance_location_idx',
+                condition=models.Q(quantity__gt=0)
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.item.name} - {self.location.name}: {self.quantity} {self.item.unit}"
+
+class WarehouseDocument(models.Model):
+    """Складской документ (приходная накладная, требование на отпуск) из нескольких строк
+    
+    Строки документа - операции склада с ссылкой на документ; документ
+    проводится целиком в одной транзакции (warehouse.posting.post_document).
+    """
+    DOCUMENT_TYPE_CHOICES = [
+        ('RECEIPT', _('Приходная накладная')),
+        ('ISSUE', _('Отпуск материалов')),
+    ]
+    
+    # Тип операций склада по строкам документа
+    TRANSACTION_TYPES = {
+        'RECEIPT': 'IN',
+        'ISSUE': 'OUT',
+    }
+    
+    document_type = models.CharField(_('Тип документа'), max_length=20, choices=DOCUMENT_TYPE_CHOICES)
+    number = models.CharField(_('Номер документа'), max_length=100, blank=True)
+    document_date = models.DateField(_('Дата документа'), null=True, blank=True)
+    counterparty = models.CharField(_('Поставщик / получатель'), max_length=200, blank=True)
+    project = models.ForeignKey('projects.Project', on_delete=models.SET_NULL, null=True, blank=True, related_name='warehouse_documents', verbose_name=_('Проект'))
+    location = models.ForeignKey(WarehouseLocation, on_delete=models.PROTECT, null=True, blank=True, related_name='documents', verbose_name=_('Место хранения'))
+    description = models.TextField(_('Описание'), blank=True)
+    
+    lines_count = models.PositiveIntegerField(_('Строк'), default=0)
+    total_amount = models.DecimalField(
+        _('Сумма документа'),
+        max_digits=15,
+        decimal_places=2,
+        default=Decimal('0.00')
+    )
+    
+    created_at = models.DateTimeField(_('Создан'), auto_now_add=True)
+    created_by = models.ForeignKey('accounts.User', on_delete=models.SET_NULL, null=True, related_name='created_warehouse_documents', verbose_name=_('Создал'))
+
+    class Meta:
+        verbose_name = _('Складской документ')
+        verbose_name_plural = _('Складские документы')
+        db_table = 'warehouse_documents'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        number = f" № {self.number}" if self.number else ''
+        return f"{self.get_document_type_display()}{number}"
+
+    @property
+    def transaction_type(self):
+        return self.TRANSACTION_TYPES[self.document_type]
+
 class WarehouseTransaction(models.Model):
     """Транзакции склада (приход/расход)"""
     TRANSACTION_TYPE_CHOICES = [
@@ -131,8 +300,39 @@ class WarehouseTransaction(models.Model):
         default=Decimal('0.00')
     )
     
+    # Проводка по остатку (warehouse.posting)
+    quantity_delta = models.DecimalField(
+        _('Изменение остатка'),
+        max_digits=10,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        editable=False
+    )
+    balance_after = models.DecimalField(
+        _('Остаток после операции'),
+        max_digits=10,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        editable=False
+    )
+    cost_amount = models.DecimalField(
+        _('Себестоимость'),
+        max_digits=15,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        editable=False,
+        help_text=_('Стоимость поступившей партии или списанного количества по FIFO')
+    )
+    
     # Связь с проектом (если применимо)
     project = models.ForeignKey('projects.Project', on_delete=models.SET_NULL, null=True, blank=True, related_name='warehouse_transactions', verbose_name=_('Проект'))
+    document = models.ForeignKey(WarehouseDocument, on_delete=models.PROTECT, null=True, blank=True, related_name='transactions', verbose_name=_('Документ'))
+    
+    # Место хранения; для перемещения - откуда и куда
+    location = models.ForeignKey(WarehouseLocation, on_delete=models.PROTECT, null=True, blank=True, related_name='transactions', verbose_name=_('Место хранения'))
+    to_location = models.ForeignKey(WarehouseLocation, on_delete=models.PROTECT, null=True, blank=True, related_name='incoming_transfers', verbose_name=_('Куда переместить'))
     
     # Дополнительная информация
     description = models.TextField(_('Описание'), blank=True)
@@ -147,20 +347,178 @@ class WarehouseTransaction(models.Model):
         verbose_name_plural = _('Транзакции склада')
         db_table = 'warehouse_transactions'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['item', 'created_at'], name='warehouse_txn_item_created_idx'),
+            models.Index(fields=['created_at'], name='warehouse_txn_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.get_transaction_type_display()} {self.item.name} - {self.quantity} {self.item.unit}"
 
     def save(self, *args, **kwargs):
+        """Новая операция проводится по остатку товара в той же транзакции
+        
+        Повторное сохранение проведенной операции (описание, номер
+        документа) остаток не меняет.
+        """
+        from .costing import cost_transactions
+        from .posting import post_balance
+        
         self.total_amount = (self.quantity * self.price).quantize(Decimal('0.01'))
-        super().save(*args, **kwargs)
+        if not self._state.adding:
+            super().save(*args, **kwargs)
+            return
+        
+        with transaction.atomic():
+            post_balance(self)
+            super().save(*args, **kwargs)
+            cost_transactions([self])
+    
+    def delete(self, *args, **kwargs):
+        """Удаление операции с обратной проводкой по остатку
+        
+        Снимки остатков на закрытые после операции месяцы уменьшаются на
+        изменение остатка по ней, чтобы остаток на дату не расходился с
+        операциями. Списанное операцией возвращается в партии, списание
+        на проект сторнируется.
+        """
+        from .costing import uncost_transaction
+        from .posting import apply_location_delta, apply_quantity_delta, location_deltas
+        from .stock_history import unpost_from_snapshots
         
-        # Обновляем текущее количество товара
-        if self.transaction_type == 'IN':
-            self.item.current_quantity += self.quantity
-        elif self.transaction_type == 'OUT':
-            self.item.current_quantity -= self.quantity
-        self.item.save()
+        with transaction.atomic():
+            uncost_transaction(self)
+            apply_quantity_delta(self.item_id, -self.quantity_delta)
+            for location_id, delta in reversed(location_deltas(self)):
+                apply_location_delta(self.item_id, location_id, -delta)
+            unpost_from_snapshots(self)
+            return super().delete(*args, **kwargs)
+
+class StockLot(models.Model):
+    """Партия товара для оценки по FIFO
+    
+    Партию создает каждая операция, увеличивающая остаток (приход,
+    корректировка в плюс); списания забирают количество из открытых
+    партий товара в порядке поступления (см. warehouse.costing).
+    """
+    transaction = models.OneToOneField(WarehouseTransaction, on_delete=models.CASCADE, primary_key=True, related_name='lot', verbose_name=_('Операция поступления'))
+    item = models.ForeignKey(WarehouseItem, on_delete=models.CASCADE, related_name='lots', verbose_name=_('Товар'))
+    received_at = models.DateTimeField(_('Поступила'))
+    quantity = models.DecimalField(_('Количество'), max_digits=10, decimal_places=2)
+    remaining_quantity = models.DecimalField(_('Остаток партии'), max_digits=10, decimal_places=2)
+    unit_cost = models.DecimalField(_('Цена за единицу'), max_digits=12, decimal_places=2)
+
+    class Meta:
+        verbose_name = _('Партия товара')
+        verbose_name_plural = _('Партии товаров')
+        db_table = 'warehouse_stock_lots'
+        ordering = ['item', 'received_at', 'transaction']
+        indexes = [
+            # Очередь открытых партий товара: списание читает только ее
+            models.Index(
+                fields=['item', 'received_at', 'transaction'],
+                name='stock_lot_open_fifo_idx',
+                condition=models.Q(remaining_quantity__gt=0)
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.item.name}: {self.remaining_quantity} из {self.quantity} по {self.unit_cost}"
+
+    @property
+    def remaining_value(self):
+        return (self.remaining_quantity * self.unit_cost).quantize(Decimal('0.01'))
+
+class LotConsumption(models.Model):
+    """Количество партии, списанное операцией"""
+    transaction = models.ForeignKey(WarehouseTransaction, on_delete=models.CASCADE, related_name='lot_consumptions', verbose_name=_('Операция списания'))
+    lot = models.ForeignKey(StockLot, on_delete=models.RESTRICT, related_name='consumptions', verbose_name=_('Партия'))
+    quantity = models.DecimalField(_('Количество'), max_digits=10, decimal_places=2)
+    amount = models.DecimalField(_('Стоимость'), max_digits=15, decimal_places=2)
+
+    class Meta:
+        verbose_name = _('Списание партии')
+        verbose_name_plural = _('Списания партий')
+        db_table = 'warehouse_lot_consumptions'
+
+    def __str__(self):
+        return f"{self.lot} - {self.quantity}"
+
+class WarehouseStockSnapshot(models.Model):
+    """Остаток товара на конец закрытого месяца
+    
+    Снимки пишутся при закрытии месяца для всех товаров сразу (команда
+    close_stock_month). Остаток на произвольную дату - ближайший снимок
+    до нее и операции после него (см. warehouse.stock_history).
+    """
+    item = models.ForeignKey(WarehouseItem, on_delete=models.CASCADE, related_name='stock_snapshots', verbose_name=_('Товар'))
+    period_end = models.DateField(_('Остаток на конец дня'))
+    quantity = models.DecimalField(
+        _('Количество'),
+        max_digits=10,
+        decimal_places=2,
+        default=Decimal('0.00')
+    )
+    created_at = models.DateTimeField(_('Создан'), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('Снимок остатка')
+        verbose_name_plural = _('Снимки остатков')
+        db_table = 'warehouse_stock_snapshots'
+        ordering = ['-period_end', 'item']
+        unique_together = ['item', 'period_end']
+        indexes = [
+            models.Index(fields=['period_end'], name='stock_snapshot_period_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.item.name} на {self.period_end:%d.%m.%Y}: {self.quantity} {self.item.unit}"
+
+class ReorderSuggestion(models.Model):
+    """Рекомендация к заказу товара по фактическому расходу
+    
+    Пересчитывается ночной командой plan_reorders (warehouse.reorder) для
+    всех активных товаров: скорость расхода по операциям списания,
+    дни до нуля, точка заказа и рекомендуемое количество.
+    """
+    item = models.OneToOneField(WarehouseItem, on_delete=models.CASCADE, related_name='reorder_suggestion', verbose_name=_('Товар'))
+    current_quantity = models.DecimalField(_('Остаток при расчете'), max_digits=10, decimal_places=2)
+    daily_usage = models.DecimalField(
+        _('Расход в день'),
+        max_digits=12,
+        decimal_places=4,
+        help_text=_('Большая из скоростей расхода за короткое и длинное окно')
+    )
+    usage_short_window = models.DecimalField(_('Расход в день (короткое окно)'), max_digits=12, decimal_places=4)
+    usage_long_window = models.DecimalField(_('Расход в день (длинное окно)'), max_digits=12, decimal_places=4)
+    reorder_point = models.DecimalField(_('Точка заказа'), max_digits=12, decimal_places=2)
+    days_until_stockout = models.DecimalField(
+        _('Дней до нуля'),
+        max_digits=10,
+        decimal_places=1,
+        null=True,
+        blank=True,
+        help_text=_('Пусто - расхода за окно не было')
+    )
+    stockout_date = models.DateField(_('Дата окончания остатка'), null=True, blank=True)
+    suggested_quantity = models.DecimalField(_('Рекомендуется заказать'), max_digits=12, decimal_places=2)
+    computed_at = models.DateTimeField(_('Рассчитано'))
+
+    class Meta:
+        verbose_name = _('Рекомендация к заказу')
+        verbose_name_plural = _('Рекомендации к заказу')
+        db_table = 'warehouse_reorder_suggestions'
+        ordering = ['days_until_stockout']
+        indexes = [
+            models.Index(
+                fields=['days_until_stockout'],
+                name='reorder_to_order_idx',
+                condition=models.Q(suggested_quantity__gt=0)
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.item.name}: заказать {self.suggested_quantity} {self.item.unit}"
 
 class ProjectEquipment(models.Model):
     """Оборудование, используемое в проекте"""
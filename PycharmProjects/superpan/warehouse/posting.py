@@ -0,0 +1,300 @@
+# Проведение складских операций: остаток товара и остатки по местам
+# хранения меняются через F() в одной транзакции с записью операции
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from .models import StockBalance, WarehouseItem, WarehouseLocation
+
+ZERO = Decimal('0.00')
+
+
+class InsufficientStock(ValidationError):
+    """Списание больше текущего остатка товара"""
+
+
+def signed_quantity(warehouse_transaction):
+    """Изменение остатка товара по операции
+
+    Приход увеличивает остаток, расход уменьшает. Корректировка идет в
+    сторону, заданной знаком quantity_delta (по умолчанию - увеличение).
+    Перемещение не меняет общий остаток товара, только остатки по
+    местам хранения (location_deltas).
+    """
+    transaction_type = warehouse_transaction.transaction_type
+    quantity = warehouse_transaction.quantity
+    if transaction_type == 'IN':
+        return quantity
+    if transaction_type == 'OUT':
+        return -quantity
+    if transaction_type == 'ADJUSTMENT':
+        return -quantity if (warehouse_transaction.quantity_delta or ZERO) < 0 else quantity
+    if transaction_type == 'TRANSFER':
+        return ZERO
+    raise ValidationError(_('Неизвестный тип операции: %(type)s') % {'type': transaction_type})
+
+
+def apply_quantity_delta(item_id, delta):
+    """Изменить остаток товара на delta одним UPDATE и вернуть новый остаток
+
+    Уменьшение проходит только если остатка хватает: условие проверяется
+    в том же UPDATE, поэтому параллельные списания не уводят остаток в
+    минус. Вызывать внутри транзакции.
+    """
+    if delta:
+        items = WarehouseItem.objects.filter(pk=item_id)
+        if delta < 0:
+            items = items.filter(current_quantity__gte=-delta)
+        if not items.update(current_quantity=F('current_quantity') + delta, updated_at=timezone.now()):
+            available = WarehouseItem.objects.filter(pk=item_id).values_list('current_quantity', flat=True).first()
+            raise InsufficientStock(
+                _('Недостаточно товара на складе: остаток %(available)s, требуется %(required)s') % {
+                    'available': available if available is not None else ZERO,
+                    'required': -delta,
+                }
+            )
+    return WarehouseItem.objects.filter(pk=item_id).values_list('current_quantity', flat=True).get()
+
+
+def location_deltas(warehouse_transaction):
+    """Изменения остатков по местам хранения: [(id места, изменение)]
+
+    Перемещение списывает количество с места операции и приходует в
+    to_location; остальные операции меняют остаток места на quantity_delta.
+    """
+    if warehouse_transaction.transaction_type == 'TRANSFER':
+        if warehouse_transaction.to_location_id is None:
+            return []
+        return [
+            (warehouse_transaction.location_id, -warehouse_transaction.quantity),
+            (warehouse_transaction.to_location_id, warehouse_transaction.quantity),
+        ]
+    if not warehouse_transaction.quantity_delta:
+        return []
+    return [(warehouse_transaction.location_id, warehouse_transaction.quantity_delta)]
+
+
+def apply_location_delta(item_id, location_id, delta):
+    """Изменить остаток товара в месте хранения на delta одним UPDATE
+
+    Уменьшение, как и для общего остатка, проходит только при достаточном
+    остатке в этом месте; строка остатка создается при первом поступлении
+    товара в место. Вызывать внутри транзакции.
+    """
+    if not delta:
+        return
+    balances = StockBalance.objects.filter(item_id=item_id, location_id=location_id)
+    changes = {'quantity': F('quantity') + delta, 'updated_at': timezone.now()}
+    if delta < 0:
+        if balances.filter(quantity__gte=-delta).update(**changes):
+            return
+        available = balances.values_list('quantity', flat=True).first()
+        location = WarehouseLocation.objects.filter(pk=location_id).values_list('name', flat=True).first()
+        raise InsufficientStock(
+            _('Недостаточно товара в месте «%(location)s»: остаток %(available)s, требуется %(required)s') % {
+                'location': location or location_id,
+                'available': available if available is not None else ZERO,
+                'required': -delta,
+            }
+        )
+    if balances.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            StockBalance.objects.create(item_id=item_id, location_id=location_id, quantity=delta)
+    except IntegrityError:
+        # Строку только что создал параллельный запрос
+        balances.update(**changes)
+
+
+def post_balance(warehouse_transaction):
+    """Провести операцию по остатку: записать в нее изменение и остаток после операции
+
+    Общий остаток товара и остатки по местам хранения меняются вместе;
+    место не указано - центральный склад. Сама операция сохраняется
+    вызывающим кодом в той же транзакции (WarehouseTransaction.save).
+    """
+    if warehouse_transaction.location_id is None:
+        warehouse_transaction.location_id = WarehouseLocation.central_id()
+    if warehouse_transaction.transaction_type == 'TRANSFER' and (
+        warehouse_transaction.to_location_id is None
+        or warehouse_transaction.to_location_id == warehouse_transaction.location_id
+    ):
+        raise ValidationError(_('Для перемещения укажите другое место хранения, куда перемещается товар'))
+
+    delta = signed_quantity(warehouse_transaction)
+    warehouse_transaction.quantity_delta = delta
+    warehouse_transaction.balance_after = apply_quantity_delta(warehouse_transaction.item_id, delta)
+    for location_id, location_delta in location_deltas(warehouse_transaction):
+        apply_location_delta(warehouse_transaction.item_id, location_id, location_delta)
+
+
+def post(item, transaction_type, quantity, user=None, decrease=False, **fields):
+    """Создать и провести операцию склада
+
+    decrease - направление корректировки (ADJUSTMENT). Возвращает
+    сохраненную операцию; при нехватке остатка - InsufficientStock,
+    и ничего не записывается.
+    """
+    from .models import WarehouseTransaction
+
+    warehouse_transaction = WarehouseTransaction(
+        item=item,
+        transaction_type=transaction_type,
+        quantity=quantity,
+        created_by=user,
+        **fields
+    )
+    if transaction_type == 'ADJUSTMENT' and decrease:
+        warehouse_transaction.quantity_delta = -quantity
+    with transaction.atomic():
+        warehouse_transaction.save()
+    return warehouse_transaction
+
+
+def transfer(item, quantity, from_location, to_location, user=None, **fields):
+    """Переместить товар между местами хранения одной операцией
+
+    Списание с from_location и приход в to_location проводятся в одной
+    транзакции: при нехватке товара в исходном месте не меняется ничего.
+    """
+    return post(item, 'TRANSFER', quantity, user, location=from_location, to_location=to_location, **fields)
+
+
+def post_document(document, lines, user=None):
+    """Провести многострочный документ одной транзакцией
+
+    lines - список словарей с ключами item (id товара), quantity, price и
+    необязательным description. Строки проверяются все вместе: ошибки
+    собираются по всем строкам и возвращаются одним ValidationError,
+    при нехватке остатка - InsufficientStock. Изменения остатков
+    суммируются по товарам и записываются одним UPDATE общих остатков
+    и одним - остатков в месте хранения документа, строки
+    документа - одним bulk_create и оцениваются по FIFO пачкой
+    (warehouse.costing). Возвращает документ.
+    """
+    from django.db.models import Case, When
+
+    from .costing import cost_transactions
+    from .models import WarehouseTransaction
+
+    transaction_type = document.transaction_type
+    sign = 1 if transaction_type == 'IN' else -1
+    if document.location_id is None:
+        document.location_id = WarehouseLocation.central_id()
+    errors = []
+    if not lines:
+        errors.append(_('В документе нет строк'))
+
+    item_ids = {line['item'] for line in lines}
+    with transaction.atomic():
+        # Строки товаров блокируются в порядке id: два документа с общими
+        # товарами не взаимоблокируются, а остаток не меняется до коммита
+        items = {
+            item.pk: item for item in
+            WarehouseItem.objects.select_for_update().filter(pk__in=item_ids).order_by('pk')
+        }
+
+        deltas = {}
+        for number, line in enumerate(lines, start=1):
+            item = items.get(line['item'])
+            if item is None or not item.is_active:
+                errors.append(_('Строка %(number)s: товар не найден') % {'number': number})
+                continue
+            if line['quantity'] is None or line['quantity'] <= 0:
+                errors.append(_('Строка %(number)s: количество должно быть больше нуля') % {'number': number})
+                continue
+            if (line.get('price') or ZERO) < 0:
+                errors.append(_('Строка %(number)s: цена не может быть отрицательной') % {'number': number})
+                continue
+            deltas[item.pk] = deltas.get(item.pk, ZERO) + sign * line['quantity']
+        if errors:
+            raise ValidationError(errors)
+
+        # Все строки документа - одно место хранения, поэтому изменения
+        # остатков в нем совпадают с изменениями общих остатков товаров
+        balances = {
+            balance.item_id: balance for balance in
+            StockBalance.objects.select_for_update()
+            .filter(item_id__in=deltas, location_id=document.location_id)
+            .order_by('item_id')
+        }
+        shortages = []
+        for item_id, delta in deltas.items():
+            available = min(
+                items[item_id].current_quantity,
+                balances[item_id].quantity if item_id in balances else ZERO
+            )
+            if delta < 0 and available + delta < 0:
+                shortages.append(_('%(item)s: остаток %(available)s %(unit)s, требуется %(required)s') % {
+                    'item': items[item_id].name,
+                    'available': available,
+                    'unit': items[item_id].unit,
+                    'required': -delta,
+                })
+        if shortages:
+            raise InsufficientStock(shortages)
+
+        changed = {item_id: delta for item_id, delta in deltas.items() if delta}
+        if changed:
+            WarehouseItem.objects.filter(pk__in=changed).update(
+                current_quantity=Case(
+                    *(When(pk=item_id, then=F('current_quantity') + delta) for item_id, delta in changed.items()),
+                    default=F('current_quantity')
+                ),
+                updated_at=timezone.now()
+            )
+            StockBalance.objects.bulk_create(
+                [
+                    StockBalance(item_id=item_id, location_id=document.location_id)
+                    for item_id in changed if item_id not in balances
+                ],
+                ignore_conflicts=True
+            )
+            StockBalance.objects.filter(item_id__in=changed, location_id=document.location_id).update(
+                quantity=Case(
+                    *(When(item_id=item_id, then=F('quantity') + delta) for item_id, delta in changed.items()),
+                    default=F('quantity')
+                ),
+                updated_at=timezone.now()
+            )
+
+        document.lines_count = len(lines)
+        document.total_amount = ZERO
+        if user is not None:
+            document.created_by = user
+        document.save()
+
+        # Остаток после каждой строки - нарастающим итогом от остатка до документа
+        balances = {item_id: item.current_quantity for item_id, item in items.items()}
+        transactions = []
+        for line in lines:
+            price = line.get('price') or ZERO
+            delta = sign * line['quantity']
+            balances[line['item']] += delta
+            total_amount = (line['quantity'] * price).quantize(Decimal('0.01'))
+            document.total_amount += total_amount
+            transactions.append(WarehouseTransaction(
+                item_id=line['item'],
+                transaction_type=transaction_type,
+                quantity=line['quantity'],
+                price=price,
+                total_amount=total_amount,
+                quantity_delta=delta,
+                balance_after=balances[line['item']],
+                project=document.project,
+                document=document,
+                location_id=document.location_id,
+                description=line.get('description') or document.description,
+                reference_number=document.number,
+                created_by=document.created_by
+            ))
+        WarehouseTransaction.objects.bulk_create(transactions, batch_size=500)
+        cost_transactions(transactions)
+        type(document).objects.filter(pk=document.pk).update(total_amount=document.total_amount)
+
+    return document
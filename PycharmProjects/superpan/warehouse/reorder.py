@@ -0,0 +1,140 @@
+# Планирование заказов: скорость расхода товаров по операциям списания,
+# дни до нуля и рекомендуемое количество к заказу
+from datetime import timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import ReorderSuggestion, WarehouseItem, WarehouseTransaction
+from .stock_history import day_end
+
+
+def daily_usage_matrix(item_ids, days, today):
+    """Матрица расхода товаров по дням: строка - товар из item_ids, столбец - дней назад
+
+    Расход берется одним сгруппированным запросом дневных сумм по
+    операциям OUT за days дней, включая сегодня.
+    """
+    usage = np.zeros((len(item_ids), days))
+    rows = (
+        WarehouseTransaction.objects
+        .filter(
+            transaction_type='OUT',
+            created_at__gte=day_end(today - timedelta(days=days)),
+            created_at__lt=day_end(today)
+        )
+        .annotate(day=TruncDate('created_at'))
+        .values_list('item_id', 'day')
+        .annotate(total=Sum('quantity'))
+        .order_by()
+    )
+    totals = np.array(
+        [(item_id, (today - day).days, float(total)) for item_id, day, total in rows],
+        dtype=float
+    ).reshape(-1, 3)
+    if not len(totals):
+        return usage
+
+    # Строка товара - позиция его id в отсортированном item_ids
+    positions = np.searchsorted(item_ids, totals[:, 0].astype(np.int64))
+    positions = np.minimum(positions, len(item_ids) - 1)
+    known = item_ids[positions] == totals[:, 0]
+    np.add.at(
+        usage,
+        (positions[known], totals[known, 1].astype(np.int64)),
+        totals[known, 2]
+    )
+    return usage
+
+
+def plan(short_window=30, long_window=90, lead_time=14, cover_days=30, safety_factor=1.65, today=None):
+    """Рассчитать рекомендации по всем активным товарам
+
+    Скорость расхода - большая из средних за короткое и длинное окно
+    (рост расхода сразу поднимает точку заказа). Страховой запас -
+    safety_factor стандартных отклонений дневного расхода за срок
+    поставки lead_time; точка заказа - расход за срок поставки плюс
+    страховой запас. Если остаток не выше точки заказа, рекомендуется
+    заказать до точки заказа плюс расход на cover_days дней. Все
+    вычисления - векторами NumPy по всем товарам сразу. Возвращает
+    несохраненные ReorderSuggestion.
+    """
+    today = today or timezone.localdate()
+    long_window = max(long_window, short_window)
+    items = np.array(
+        list(WarehouseItem.objects.filter(is_active=True).order_by('pk').values_list('pk', 'current_quantity')),
+        dtype=object
+    ).reshape(-1, 2)
+    if not len(items):
+        return []
+    item_ids = items[:, 0].astype(np.int64)
+    current = items[:, 1].astype(float)
+
+    usage = daily_usage_matrix(item_ids, long_window, today)
+    short_rate = usage[:, :short_window].sum(axis=1) / short_window
+    long_rate = usage.sum(axis=1) / long_window
+    rate = np.maximum(short_rate, long_rate)
+
+    safety_stock = safety_factor * usage.std(axis=1) * np.sqrt(lead_time)
+    reorder_point = rate * lead_time + safety_stock
+    suggested = np.where(
+        (rate > 0) & (current <= reorder_point),
+        np.ceil(np.maximum(reorder_point + rate * cover_days - current, 0)),
+        0
+    )
+    days_left = np.where(rate > 0, current / np.where(rate > 0, rate, 1), np.nan)
+
+    computed_at = timezone.now()
+    suggestions = []
+    for index, item_id in enumerate(item_ids.tolist()):
+        days = None if np.isnan(days_left[index]) else days_left[index]
+        suggestions.append(ReorderSuggestion(
+            item_id=item_id,
+            current_quantity=Decimal(f'{current[index]:.2f}'),
+            daily_usage=Decimal(f'{rate[index]:.4f}'),
+            usage_short_window=Decimal(f'{short_rate[index]:.4f}'),
+            usage_long_window=Decimal(f'{long_rate[index]:.4f}'),
+            reorder_point=Decimal(f'{reorder_point[index]:.2f}'),
+            days_until_stockout=None if days is None else Decimal(f'{min(days, 999999):.1f}'),
+            stockout_date=None if days is None or days > 3650 else today + timedelta(days=int(days)),
+            suggested_quantity=Decimal(f'{suggested[index]:.2f}'),
+            computed_at=computed_at
+        ))
+    return suggestions
+
+
+def save_suggestions(suggestions, set_min_quantity=False):
+    """Записать рекомендации (вставка или обновление по товару) и убрать устаревшие
+
+    set_min_quantity - выставить минимальный остаток товаров равным
+    точке заказа.
+    """
+    fields = [
+        'current_quantity', 'daily_usage', 'usage_short_window', 'usage_long_window', 'reorder_point',
+        'days_until_stockout', 'stockout_date', 'suggested_quantity', 'computed_at'
+    ]
+    with transaction.atomic():
+        ReorderSuggestion.objects.bulk_create(
+            suggestions,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['item'],
+            update_fields=fields
+        )
+        if suggestions:
+            ReorderSuggestion.objects.filter(computed_at__lt=suggestions[0].computed_at).delete()
+        else:
+            ReorderSuggestion.objects.all().delete()
+        if set_min_quantity:
+            WarehouseItem.objects.bulk_update(
+                [
+                    WarehouseItem(pk=suggestion.item_id, min_quantity=suggestion.reorder_point)
+                    for suggestion in suggestions
+                ],
+                ['min_quantity'],
+                batch_size=1000
+            )
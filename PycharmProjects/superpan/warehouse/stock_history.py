@@ -0,0 +1,146 @@
+# Остатки склада на дату: снимки остатков на конец закрытых месяцев
+# и операции после ближайшего снимка
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, F, Max, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import WarehouseItem, WarehouseStockSnapshot, WarehouseTransaction
+
+ZERO = Decimal('0.00')
+
+
+def day_end(on_date):
+    """Начало следующего дня в текущем часовом поясе - граница операций, вошедших в остаток на on_date"""
+    return timezone.make_aware(datetime.combine(on_date + timedelta(days=1), time.min))
+
+
+def month_end(value):
+    """Последний день месяца даты"""
+    next_month = date(value.year + value.month // 12, value.month % 12 + 1, 1)
+    return next_month - timedelta(days=1)
+
+
+def last_closed_month_end(today=None):
+    """Последний день прошлого месяца - конец последнего закрытого месяца"""
+    today = today or timezone.localdate()
+    return today.replace(day=1) - timedelta(days=1)
+
+
+def stock_as_of(item_id, on_date):
+    """Остаток товара на конец дня on_date
+
+    Берется ближайший снимок товара не позже on_date, к нему прибавляются
+    изменения остатка по операциям после снимка; без снимков операции
+    суммируются с начала учета.
+    """
+    snapshot = (
+        WarehouseStockSnapshot.objects
+        .filter(item_id=item_id, period_end__lte=on_date)
+        .order_by('-period_end')
+        .values_list('period_end', 'quantity')
+        .first()
+    )
+    transactions = WarehouseTransaction.objects.filter(item_id=item_id, created_at__lt=day_end(on_date))
+    opening = ZERO
+    if snapshot is not None:
+        period_end, opening = snapshot
+        transactions = transactions.filter(created_at__gte=day_end(period_end))
+    movement = transactions.aggregate(total=Sum('quantity_delta'))['total'] or ZERO
+    return opening + movement
+
+
+def _balances(on_date, items=None, include_on_date=True):
+    """Остатки товаров на конец дня on_date одним сгруппированным запросом
+
+    Снимки пишутся для всех товаров сразу, поэтому ближайший период
+    снимков общий; товары без снимка за этот период появились позже и
+    считаются по операциям.
+    """
+    lookup = 'period_end__lte' if include_on_date else 'period_end__lt'
+    period_end = (
+        WarehouseStockSnapshot.objects
+        .filter(**{lookup: on_date})
+        .aggregate(period_end=Max('period_end'))['period_end']
+    )
+
+    movement_filter = Q(transactions__created_at__lt=day_end(on_date))
+    opening = Value(ZERO)
+    if period_end is not None:
+        movement_filter &= Q(transactions__created_at__gte=day_end(period_end))
+        opening = Subquery(
+            WarehouseStockSnapshot.objects
+            .filter(item=OuterRef('pk'), period_end=period_end)
+            .values('quantity')[:1]
+        )
+
+    amount_field = DecimalField(max_digits=10, decimal_places=2)
+    rows = (
+        (items if items is not None else WarehouseItem.objects.all())
+        .order_by()
+        .annotate(
+            opening=Coalesce(opening, Value(ZERO), output_field=amount_field),
+            movement=Coalesce(
+                Sum('transactions__quantity_delta', filter=movement_filter),
+                Value(ZERO),
+                output_field=amount_field
+            )
+        )
+        .values_list('pk', 'opening', 'movement')
+    )
+    return {item_id: opening + movement for item_id, opening, movement in rows}
+
+
+def stock_as_of_all(on_date, items=None):
+    """Остатки на конец дня on_date по всем товарам (или queryset items): {id товара: количество}"""
+    return _balances(on_date, items)
+
+
+def take_snapshots(period_end):
+    """Записать снимки остатков всех товаров на конец дня period_end
+
+    Остатки считаются от предыдущего снимка; повторный вызов для того
+    же дня пересчитывает снимки. Возвращает число снимков.
+    """
+    if period_end >= timezone.localdate():
+        raise ValueError(f'День {period_end:%d.%m.%Y} еще не закрыт')
+    with transaction.atomic():
+        balances = _balances(period_end, include_on_date=False)
+        WarehouseStockSnapshot.objects.filter(period_end=period_end).delete()
+        WarehouseStockSnapshot.objects.bulk_create(
+            [
+                WarehouseStockSnapshot(item_id=item_id, period_end=period_end, quantity=quantity)
+                for item_id, quantity in balances.items()
+            ],
+            batch_size=1000
+        )
+    return len(balances)
+
+
+def unclosed_month_ends(until=None):
+    """Концы месяцев с операциями до until (по умолчанию - последнего закрытого), для которых нет снимков"""
+    until = until or last_closed_month_end()
+    first_at = WarehouseTransaction.objects.order_by('created_at').values_list('created_at', flat=True).first()
+    if first_at is None:
+        return []
+    existing = set(WarehouseStockSnapshot.objects.values_list('period_end', flat=True).distinct())
+    periods = []
+    current = month_end(timezone.localtime(first_at).date())
+    while current <= until:
+        if current not in existing:
+            periods.append(current)
+        current = month_end(current + timedelta(days=1))
+    return periods
+
+
+def unpost_from_snapshots(warehouse_transaction):
+    """Убрать изменение остатка удаляемой операции из снимков после нее"""
+    if not warehouse_transaction.quantity_delta or warehouse_transaction.created_at is None:
+        return
+    WarehouseStockSnapshot.objects.filter(
+        item_id=warehouse_transaction.item_id,
+        period_end__gte=timezone.localtime(warehouse_transaction.created_at).date()
+    ).update(quantity=F('quantity') - warehouse_transaction.quantity_delta)
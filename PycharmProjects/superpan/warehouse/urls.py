@@ -17,6 +17,20 @@ urlpatterns = [
     path('transactions/', views.warehouse_transactions_list, name='transactions_list'),
     path('transactions/create/', views.warehouse_transaction_create, name='transaction_create'),
     
+    # Места хранения
+    path('locations/', views.warehouse_locations_list, name='locations_list'),
+    path('locations/create/', views.warehouse_location_create, name='location_create'),
+    path('locations/<int:location_id>/', views.warehouse_location_detail, name='location_detail'),
+    
+    # Остатки на дату
+    path('stock-as-of/', views.warehouse_stock_as_of, name='stock_as_of'),
+    
+    # Многострочные документы
+    path('documents/', views.warehouse_documents_list, name='documents_list'),
+    path('documents/create/', views.warehouse_document_create, name='document_create'),
+    path('documents/<int:document_id>/', views.warehouse_document_detail, name='document_detail'),
+    path('api/documents/', views.warehouse_document_api, name='document_api'),
+    
     # Категории
     path('categories/', views.warehouse_categories_list, name='categories_list'),
     path('categories/create/', views.warehouse_category_create, name='category_create'),
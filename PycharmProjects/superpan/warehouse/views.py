@@ -1,29 +1,58 @@
+import json
+import logging
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.core.exceptions import ValidationError
 from django.core.paginator import Paginator
-from django.db.models import Sum, F
+from django.db.models import Count, Sum, F, Q
 from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
 from django.views.decorators.http import require_http_methods
 
-from .models import WarehouseCategory, WarehouseItem, WarehouseTransaction, ProjectEquipment
+from .models import (
+    WarehouseCategory, WarehouseItem, WarehouseLocation, StockBalance, WarehouseTransaction, WarehouseDocument,
+    ReorderSuggestion, ProjectEquipment
+)
+from .costing import stock_value
+from .posting import InsufficientStock, post_document
+from .stock_history import stock_as_of_all
 from .forms import (
     WarehouseCategoryForm, WarehouseItemForm, WarehouseTransactionForm, 
-    ProjectEquipmentForm, WarehouseSearchForm
+    ProjectEquipmentForm, WarehouseSearchForm,
+    WarehouseDocumentForm, WarehouseDocumentLineFormSet, WarehouseLocationForm
 )
 from projects.models import Project
 
+logger = logging.getLogger(__name__)
+
+# Строк в одном документе, принимаемом через API
+MAX_DOCUMENT_LINES = 500
+
 @login_required
 def warehouse_dashboard(request):
     """Главная страница склада"""
-    # Статистика
-    total_items = WarehouseItem.objects.filter(is_active=True).count()
-    low_stock_items = WarehouseItem.objects.filter(is_active=True, current_quantity__lte=F('min_quantity')).count()
-    total_materials = WarehouseItem.objects.filter(is_active=True, item_type='MATERIAL').count()
-    total_equipment = WarehouseItem.objects.filter(is_active=True, item_type='EQUIPMENT').count()
+    # Статистика - одним агрегатом
+    stats = WarehouseItem.objects.filter(is_active=True).aggregate(
+        total_items=Count('pk'),
+        low_stock_items=Count('pk', filter=Q(current_quantity__lte=F('min_quantity'))),
+        total_materials=Count('pk', filter=Q(item_type='MATERIAL')),
+        total_equipment=Count('pk', filter=Q(item_type='EQUIPMENT')),
+    )
+    
+    # Места хранения с числом позиций в наличии - одним сгруппированным запросом
+    locations = WarehouseLocation.objects.filter(is_active=True).annotate(
+        items_count=Count('balances', filter=Q(balances__quantity__gt=0))
+    ).order_by('location_type', 'name')
     
     # Последние транзакции
-    recent_transactions = WarehouseTransaction.objects.select_related('item', 'project', 'created_by').order_by('-created_at')[:10]
+    recent_transactions = WarehouseTransaction.objects.select_related(
+        'item', 'project', 'created_by', 'location', 'to_location'
+    ).order_by('-created_at')[:10]
     
     # Товары с низким остатком
     low_stock_items_list = WarehouseItem.objects.filter(
@@ -31,11 +60,15 @@ def warehouse_dashboard(request):
         current_quantity__lte=F('min_quantity')
     ).order_by('current_quantity')[:10]
     
+    # Рекомендации ночного расчета (plan_reorders): ближайшие к нулю товары
+    reorder_suggestions = ReorderSuggestion.objects.filter(
+        suggested_quantity__gt=0, item__is_active=True
+    ).select_related('item').order_by(F('days_until_stockout').asc(nulls_last=True))[:10]
+    
     context = {
-        'total_items': total_items,
-        'low_stock_items': low_stock_items,
-        'total_materials': total_materials,
-        'total_equipment': total_equipment,
+        **stats,
+        'locations': locations,
+        'reorder_suggestions': reorder_suggestions,
         'recent_transactions': recent_transactions,
         'low_stock_items_list': low_stock_items_list,
     }
@@ -87,10 +120,16 @@ def warehouse_item_detail(request, item_id):
     """Детальная информация о товаре"""
     item = get_object_or_404(WarehouseItem, id=item_id)
     transactions = item.transactions.select_related('project', 'created_by').order_by('-created_at')[:20]
+    open_lots = item.lots.filter(remaining_quantity__gt=0).order_by('received_at', 'transaction_id')[:20]
+    # Где лежит товар - по уникальному индексу (товар, место)
+    balances = item.balances.filter(quantity__gt=0).select_related('location').order_by('location__name')
     
     context = {
         'item': item,
         'transactions': transactions,
+        'balances': balances,
+        'open_lots': open_lots,
+        'stock_value': stock_value(WarehouseItem.objects.filter(pk=item.pk)),
     }
     
     return render(request, 'warehouse/item_detail.html', context)
@@ -146,9 +185,13 @@ def warehouse_transaction_create(request):
         if form.is_valid():
             transaction = form.save(commit=False)
             transaction.created_by = request.user
-            transaction.save()
-            messages.success(request, _('Транзакция успешно создана.'))
-            return redirect('warehouse:transactions_list')
+            try:
+                transaction.save()
+            except InsufficientStock as e:
+                form.add_error('quantity', e)
+            else:
+                messages.success(request, _('Транзакция успешно создана.'))
+                return redirect('warehouse:transactions_list')
     else:
         form = WarehouseTransactionForm()
     
@@ -159,11 +202,210 @@ def warehouse_transaction_create(request):
     
     return render(request, 'warehouse/transaction_form.html', context)
 
+@login_required
+def warehouse_locations_list(request):
+    """Места хранения с числом позиций и общим количеством в наличии"""
+    locations = WarehouseLocation.objects.filter(is_active=True).select_related('project').annotate(
+        items_count=Count('balances', filter=Q(balances__quantity__gt=0)),
+        total_quantity=Sum('balances__quantity', filter=Q(balances__quantity__gt=0))
+    ).order_by('location_type', 'name')
+    
+    context = {
+        'locations': locations,
+    }
+    
+    return render(request, 'warehouse/locations_list.html', context)
+
+@login_required
+def warehouse_location_create(request):
+    """Создание места хранения"""
+    if request.method == 'POST':
+        form = WarehouseLocationForm(request.POST)
+        if form.is_valid():
+            form.save()
+            messages.success(request, _('Место хранения успешно создано.'))
+            return redirect('warehouse:locations_list')
+    else:
+        form = WarehouseLocationForm()
+    
+    context = {
+        'form': form,
+        'title': _('Создание места хранения'),
+    }
+    
+    return render(request, 'warehouse/location_form.html', context)
+
+@login_required
+def warehouse_location_detail(request, location_id):
+    """Что лежит в месте хранения"""
+    location = get_object_or_404(WarehouseLocation.objects.select_related('project'), id=location_id)
+    # Частичный индекс (место, товар) по остаткам больше нуля
+    balances = StockBalance.objects.filter(
+        location=location, quantity__gt=0
+    ).select_related('item', 'item__category').order_by('item__name')
+    
+    paginator = Paginator(balances, 50)
+    page_number = request.GET.get('page')
+    page_obj = paginator.get_page(page_number)
+    
+    context = {
+        'location': location,
+        'page_obj': page_obj,
+        'balances': page_obj,
+    }
+    
+    return render(request, 'warehouse/location_detail.html', context)
+
+@login_required
+def warehouse_stock_as_of(request):
+    """Остатки товаров на конец выбранного дня"""
+    today = timezone.localdate()
+    try:
+        on_date = date.fromisoformat(request.GET.get('date', ''))
+    except ValueError:
+        on_date = today
+    on_date = min(on_date, today)
+    
+    items = WarehouseItem.objects.select_related('category').order_by('name')
+    balances = stock_as_of_all(on_date, items)
+    rows = [
+        {'item': item, 'quantity': balances.get(item.pk, Decimal('0.00'))}
+        for item in items
+    ]
+    
+    context = {
+        'on_date': on_date,
+        'rows': [row for row in rows if row['quantity'] or row['item'].is_active],
+    }
+    
+    return render(request, 'warehouse/stock_as_of.html', context)
+
+@login_required
+def warehouse_document_create(request):
+    """Создание и проведение многострочного документа (приход или отпуск)"""
+    item_choices = list(
+        WarehouseItem.objects.filter(is_active=True).order_by('name').values_list('id', 'name')
+    )
+    
+    if request.method == 'POST':
+        form = WarehouseDocumentForm(request.POST)
+        formset = WarehouseDocumentLineFormSet(request.POST, prefix='lines', form_kwargs={'item_choices': item_choices})
+        if form.is_valid() and formset.is_valid():
+            lines = [line_form.cleaned_data for line_form in formset if line_form.cleaned_data]
+            try:
+                document = post_document(form.save(commit=False), lines, user=request.user)
+            except ValidationError as e:
+                form.add_error(None, e)
+            else:
+                messages.success(request, _('Документ проведен: %(count)s строк.') % {'count': document.lines_count})
+                return redirect('warehouse:document_detail', document_id=document.id)
+    else:
+        form = WarehouseDocumentForm(initial={'document_type': request.GET.get('type', 'RECEIPT')})
+        formset = WarehouseDocumentLineFormSet(prefix='lines', form_kwargs={'item_choices': item_choices})
+    
+    context = {
+        'form': form,
+        'formset': formset,
+        'title': _('Складской документ'),
+    }
+    
+    return render(request, 'warehouse/document_form.html', context)
+
+@login_required
+def warehouse_document_detail(request, document_id):
+    """Складской документ и его строки"""
+    document = get_object_or_404(
+        WarehouseDocument.objects.select_related('project', 'created_by', 'location'),
+        id=document_id
+    )
+    transactions = document.transactions.select_related('item').order_by('pk')
+    
+    context = {
+        'document': document,
+        'transactions': transactions,
+    }
+    
+    return render(request, 'warehouse/document_detail.html', context)
+
+@login_required
+def warehouse_documents_list(request):
+    """Список складских документов"""
+    documents = WarehouseDocument.objects.select_related('project', 'created_by').order_by('-created_at')
+    
+    paginator = Paginator(documents, 20)
+    page_number = request.GET.get('page')
+    page_obj = paginator.get_page(page_number)
+    
+    context = {
+        'page_obj': page_obj,
+        'documents': page_obj,
+    }
+    
+    return render(request, 'warehouse/documents_list.html', context)
+
+@login_required
+@require_http_methods(["POST"])
+def warehouse_document_api(request):
+    """Проведение многострочного документа через API
+    
+    Принимает {"document_type": "RECEIPT" | "ISSUE", "number", "document_date",
+    "location_id" (по умолчанию - центральный склад), "counterparty",
+    "project_id", "description", "lines": [{"item_id",
+    "quantity", "price", "description"}, ...]} и проводит все строки
+    одной транзакцией.
+    """
+    try:
+        data = json.loads(request.body)
+        lines = [
+            {
+                'item': int(line['item_id']),
+                'quantity': Decimal(str(line['quantity'])),
+                'price': Decimal(str(line.get('price') or '0')),
+                'description': str(line.get('description') or ''),
+            }
+            for line in data.get('lines') or []
+        ]
+    except (ValueError, TypeError, KeyError, InvalidOperation) as e:
+        logger.warning(f"Invalid warehouse document request: {e}")
+        return JsonResponse({'success': False, 'error': 'Некорректные данные документа'}, status=400)
+    
+    if len(lines) > MAX_DOCUMENT_LINES:
+        return JsonResponse(
+            {'success': False, 'error': f'Не более {MAX_DOCUMENT_LINES} строк в документе'},
+            status=400
+        )
+    
+    form = WarehouseDocumentForm({
+        'document_type': data.get('document_type'),
+        'number': data.get('number', ''),
+        'document_date': data.get('document_date'),
+        'location': data.get('location_id') or WarehouseLocation.central_id(),
+        'counterparty': data.get('counterparty', ''),
+        'project': data.get('project_id'),
+        'description': data.get('description', ''),
+    })
+    if not form.is_valid():
+        return JsonResponse({'success': False, 'errors': form.errors}, status=400)
+    
+    try:
+        document = post_document(form.save(commit=False), lines, user=request.user)
+    except InsufficientStock as e:
+        return JsonResponse({'success': False, 'error': 'Недостаточно товара на складе', 'errors': e.messages}, status=409)
+    except ValidationError as e:
+        return JsonResponse({'success': False, 'errors': e.messages}, status=400)
+    
+    return JsonResponse({
+        'success': True,
+        'document_id': document.id,
+        'lines_count': document.lines_count,
+        'total_amount': str(document.total_amount),
+    })
+
 @login_required
 def warehouse_transactions_list(request):
     """Список транзакций склада"""
     transactions = WarehouseTransaction.objects.select_related(
-        'item', 'project', 'created_by'
+        'item', 'project', 'created_by', 'location', 'to_location'
     ).order_by('-created_at')
     
     # Пагинация